@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from nutrition_app.redis_client import get_redis
+
+
+class MenuCache:
+    """
+    Versioned read-through cache for serialized restaurant menus.
+
+    Every restaurant has a version counter in Redis (menu:version:{restaurant_id}).
+    Cached payloads are keyed by restaurant, version and a view specific key, so
+    bumping the version makes every cached payload of that restaurant unreachable
+    in all processes at once. Payloads are kept in a local in-process LRU and in
+    Redis, so a worker that has not seen a menu yet still avoids the database.
+    """
+
+    def __init__(self, client, max_entries=1024, ttl=3600, max_payload_bytes=1024 * 1024):
+        self.client = client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_payload_bytes = max_payload_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _version_key(restaurant_id):
+        return f'menu:version:{restaurant_id}'
+
+    @staticmethod
+    def _payload_key(restaurant_id, version, key):
+        return f'menu:{restaurant_id}:{version}:{key}'
+
+    def version(self, restaurant_id):
+        """
+        Returns the current menu version of a restaurant, or None when Redis is
+        unavailable. Without a shared version other workers could not see our
+        invalidations, so the cache is bypassed rather than risk stale menus.
+        """
+        try:
+            version = self.client.get(self._version_key(restaurant_id))
+        except redis.RedisError:
+            return None
+        return int(version) if version else 0
+
+    def get(self, restaurant_id, key):
+        """
+        Returns the cached payload (bytes) for the current menu version, or None.
+        """
+        version = self.version(restaurant_id)
+        if version is None:
+            return None
+        return self._lookup(self._payload_key(restaurant_id, version, key))
+
+    def get_or_build(self, restaurant_id, key, builder):
+        """
+        Returns the cached payload, calling builder() to produce the bytes on a miss.
+        """
+        # The version is read before building, so data read after a concurrent
+        # write can only ever be stored under the version that write replaced.
+        version = self.version(restaurant_id)
+        if version is None:
+            return builder()
+        payload_key = self._payload_key(restaurant_id, version, key)
+        payload = self._lookup(payload_key)
+        if payload is None:
+            payload = builder()
+            self.set(payload_key, payload)
+        return payload
+
+    def stream_through(self, restaurant_id, key, chunks):
+        """
+        Passes streamed chunks through and caches the joined payload once the
+        stream completes, unless it grew beyond max_payload_bytes.
+        """
+        # Read the version now, before the generator below starts querying.
+        version = self.version(restaurant_id)
+        if version is None:
+            return chunks
+        return self._tee(self._payload_key(restaurant_id, version, key), chunks)
+
+    def _tee(self, payload_key, chunks):
+        buffer, size = [], 0
+        for chunk in chunks:
+            if buffer is not None:
+                size += len(chunk)
+                if size > self.max_payload_bytes:
+                    buffer = None
+                else:
+                    buffer.append(chunk)
+            yield chunk
+        if buffer is not None:
+            self.set(payload_key, b''.join(buffer))
+
+    def _lookup(self, payload_key):
+        with self._lock:
+            payload = self._entries.get(payload_key)
+            if payload is not None:
+                self._entries.move_to_end(payload_key)
+                self.hits += 1
+                return payload
+
+        try:
+            payload = self.client.get(payload_key)
+        except redis.RedisError:
+            payload = None
+
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.remote_hits += 1
+        self._store_local(payload_key, payload)
+        return payload
+
+    def set(self, payload_key, payload):
+        try:
+            self.client.setex(payload_key, self.ttl, payload)
+        except redis.RedisError:
+            pass
+        self._store_local(payload_key, payload)
+
+    def _store_local(self, payload_key, payload):
+        with self._lock:
+            self._entries[payload_key] = payload
+            self._entries.move_to_end(payload_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, restaurant_id):
+        """
+        Bumps the menu version of a restaurant once the current transaction
+        commits (or right away outside of one), called after every menu write.
+        """
+        prefix = f'menu:{restaurant_id}:'
+
+        def bump():
+            with self._lock:
+                for payload_key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[payload_key]
+            try:
+                self.client.incr(self._version_key(restaurant_id))
+            except redis.RedisError:
+                pass
+
+        # Readers between the write and its commit would cache the old menu under the new version
+        transaction.on_commit(bump)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.remote_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "remote_hits": self.remote_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.remote_hits) / lookups if lookups else 0.0,
+            }
+
+
+class TableVersion:
+    """
+    Version counter of a table in Redis, bumped once a write is committed.
+
+    Used as the ETag of listings of the table. A missing counter (new or
+    flushed Redis) starts from the current time in nanoseconds rather than 0,
+    so a version is never handed out for two different table states.
+    """
+
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+
+    def get(self):
+        """
+        Returns the current version, or None when Redis is unavailable.
+        """
+        try:
+            version = self.client.get(self.key)
+            if version is None:
+                self.client.set(self.key, time.time_ns(), nx=True)
+                version = self.client.get(self.key)
+        except redis.RedisError:
+            return None
+        return int(version)
+
+    def bump(self):
+        def incr():
+            try:
+                pipe = self.client.pipeline(transaction=True)
+                pipe.set(self.key, time.time_ns(), nx=True)
+                pipe.incr(self.key)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+
+        # Readers between the write and its commit would tag the old rows with the new version
+        transaction.on_commit(incr)
+
+
+# Payloads are stored pre-serialized, so the cache uses the raw bytes client
+menu_cache = MenuCache(
+    get_redis(decode_responses=False),
+    max_entries=settings.MENU_CACHE['MAX_ENTRIES'],
+    ttl=settings.MENU_CACHE['TTL'],
+    max_payload_bytes=settings.MENU_CACHE['MAX_PAYLOAD_BYTES'],
+)
+
+# ETag of the restaurant listing
+restaurant_list_version = TableVersion(get_redis(), 'version:restaurants')
@@ -0,0 +1,222 @@
+import csv
+import json
+import time
+import uuid
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from nutrition_app.db_router import pin_to_primary, restaurant_scope
+from .cache import menu_cache
+from .models import MenuItem, MenuItemTag, Ingredient, NutritionFact
+from .nutrition_index import nutrition_index
+from .queries import NUTRIENTS
+from .tags import tag_rows
+
+FORMATS = ('jsonl', 'csv')
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+# A validated menu item with its unsaved ingredient and nutrition fact rows
+MenuItemRows = namedtuple('MenuItemRows', ['item', 'ingredients', 'nutrition_fact'])
+
+
+def _clean(model, field_name, value):
+    """
+    Runs the model field's own conversion and validators on a raw value.
+    """
+    try:
+        return model._meta.get_field(field_name).clean(value, None)
+    except ValidationError as e:
+        raise ValidationError(f"{field_name}: {' '.join(e.messages)}")
+
+
+def parse_menu_item(restaurant, data):
+    """
+    Validates one menu item in the MenuItemView.post body format:
+        {"name", "category", "price", "description", "image_url", "tags",
+         "ingredients": [{"name", "quantity", "unit"}], "nutrition_facts": {...}}
+    Returns MenuItemRows, raises ValidationError on invalid data.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError("Menu item must be a JSON object.")
+
+    # Step 1: Menu Item
+    tags = data.get('tags') or []
+    if not isinstance(tags, list):
+        raise ValidationError("tags: Expected a list.")
+    item = MenuItem(
+        item_id=uuid.uuid4(),
+        restaurant=restaurant,
+        name=_clean(MenuItem, 'name', data.get('name')),
+        description=_clean(MenuItem, 'description', data.get('description') or ''),
+        category=_clean(MenuItem, 'category', data.get('category')),
+        price=_clean(MenuItem, 'price', data.get('price')),
+        image_url=_clean(MenuItem, 'image_url', data.get('image_url') or ''),
+        tags=tags
+    )
+
+    # Step 2: Ingredients
+    ingredients = data.get('ingredients') or []
+    if not isinstance(ingredients, list) or not all(isinstance(i, dict) for i in ingredients):
+        raise ValidationError("ingredients: Expected a list of objects.")
+    ingredients = [
+        Ingredient(
+            ingredient_id=uuid.uuid4(),
+            item=item,
+            name=_clean(Ingredient, 'name', ingredient.get('name')),
+            quantity=_clean(Ingredient, 'quantity', ingredient.get('quantity')),
+            unit=_clean(Ingredient, 'unit', ingredient.get('unit') or '')
+        )
+        for ingredient in ingredients
+    ]
+
+    # Step 3: Nutrition Facts
+    nutrition_data = data.get('nutrition_facts') or {}
+    if not isinstance(nutrition_data, dict):
+        raise ValidationError("nutrition_facts: Expected an object.")
+    nutrition_fact = None
+    if nutrition_data:
+        nutrition_fact = NutritionFact(
+            nutrition_id=uuid.uuid4(),
+            item=item,
+            **{nutrient: _clean(NutritionFact, nutrient, nutrition_data.get(nutrient)) for nutrient in NUTRIENTS}
+        )
+
+    return MenuItemRows(item, ingredients, nutrition_fact)
+
+
+def save_menu_items(rows):
+    """
+    Inserts validated MenuItemRows with one bulk insert per table, atomically.
+    bulk_create sends no signals, so callers invalidate the menu cache.
+    """
+    with transaction.atomic():
+        MenuItem.objects.bulk_create([row.item for row in rows])
+        Ingredient.objects.bulk_create([ingredient for row in rows for ingredient in row.ingredients])
+        NutritionFact.objects.bulk_create([row.nutrition_fact for row in rows if row.nutrition_fact])
+        MenuItemTag.objects.bulk_create([tag for row in rows for tag in tag_rows(row.item)])
+        nutrition_index.mark_changed(row.item.item_id for row in rows)
+
+
+def _csv_row_to_item(row):
+    """
+    Maps a CSV row to the JSON item format. Besides the MenuItem columns,
+    tags are "|" separated, ingredients are "name:quantity:unit" entries
+    separated by "|", and each nutrient has its own column.
+    """
+    ingredients = []
+    for entry in filter(None, (row.get('ingredients') or '').split('|')):
+        name, _, rest = entry.partition(':')
+        quantity, _, unit = rest.partition(':')
+        ingredients.append({"name": name.strip(), "quantity": quantity.strip(), "unit": unit.strip()})
+
+    return {
+        "name": row.get('name'),
+        "description": row.get('description'),
+        "category": row.get('category'),
+        "price": row.get('price'),
+        "image_url": row.get('image_url'),
+        "tags": [tag.strip() for tag in (row.get('tags') or '').split('|') if tag.strip()],
+        "ingredients": ingredients,
+        "nutrition_facts": {
+            nutrient: row[nutrient] for nutrient in NUTRIENTS if (row.get(nutrient) or '').strip()
+        },
+    }
+
+
+class UndecodableLine(ValueError):
+    def __init__(self, line_number):
+        super().__init__(f"Line {line_number} is not valid UTF-8.")
+        self.line_number = line_number
+
+
+def decode_lines(lines):
+    """
+    Decodes an iterable of UTF-8 byte lines, raising UndecodableLine on the
+    first one that is not.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            raise UndecodableLine(line_number) from None
+
+
+def read_rows(lines, fmt):
+    """
+    Yields (row_number, data) from an iterable of text lines in JSON Lines or
+    CSV format. Undecodable rows yield their ValueError as data.
+    """
+    if fmt == 'jsonl':
+        for row_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except ValueError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e}")
+    elif fmt == 'csv':
+        # Row 1 is the header
+        for row_number, row in enumerate(csv.DictReader(lines), start=2):
+            yield row_number, _csv_row_to_item(row)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}. Use one of {', '.join(FORMATS)}.")
+
+
+def import_menu(restaurant, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Validates and bulk inserts (row_number, data) pairs into a restaurant's menu,
+    one transaction per batch. Invalid rows are skipped and reported.
+    Returns the import statistics, including rows/sec.
+
+    An undecodable line stops the import after the rows before it are saved,
+    and is reported as the "error" of the result.
+    """
+    started = time.monotonic()
+    imported = rejected = 0
+    errors = []
+    batch = []
+    error = None
+
+    def flush():
+        nonlocal imported
+        if batch:
+            save_menu_items(batch)
+            imported += len(batch)
+            batch.clear()
+
+    try:
+        try:
+            for row_number, data in rows:
+                try:
+                    if isinstance(data, ValueError):
+                        raise ValidationError(str(data))
+                    batch.append(parse_menu_item(restaurant, data))
+                except ValidationError as e:
+                    rejected += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"row": row_number, "error": ' '.join(e.messages)})
+                    continue
+                if len(batch) >= batch_size:
+                    flush()
+        except UndecodableLine as e:
+            error = str(e)
+        flush()
+    finally:
+        if imported:
+            pin_to_primary(restaurant_scope(restaurant.restaurant_id))
+            menu_cache.invalidate(restaurant.restaurant_id)
+
+    seconds = time.monotonic() - started
+    result = {
+        "imported": imported,
+        "rejected": rejected,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round((imported + rejected) / seconds, 1) if seconds else None,
+    }
+    if error is not None:
+        result["error"] = error
+    return result
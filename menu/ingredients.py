@@ -0,0 +1,43 @@
+"""
+Normalized ingredient vocabulary, for excluding items by ingredient.
+
+Ingredient.name is free text ("Roasted Peanuts", "peanut butter"). It is
+reduced to lowercase singular words ("roasted", "peanut"), which are the terms
+of the ingredient posting lists kept by the nutrition index. An excluded
+ingredient hides every item whose ingredients contain all of its words: "peanut"
+hides both of the above, "peanut butter" hides the second, and also an item
+with both peanuts and butter, which errs on the side of caution.
+"""
+
+import re
+from functools import lru_cache
+
+
+def normalize_word(word):
+    word = word.lower()
+    if len(word) > 3:
+        if word.endswith('ies'):
+            return word[:-3] + 'y'
+        if word.endswith(('oes', 'shes', 'ches', 'xes')):
+            return word[:-2]
+        if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=65536)
+def ingredient_words(name):
+    """
+    Returns the normalized words of an ingredient name, in order and without repeats.
+    Cached, as menus repeat a small vocabulary.
+    """
+    return tuple(dict.fromkeys(normalize_word(word) for word in re.findall(r'[^\W\d_]+', name or '')))
+
+
+def parse_ingredients(value):
+    """
+    Parses a comma separated exclude_ingredients query parameter into the word
+    tuples of the excluded ingredients.
+    """
+    excluded = (ingredient_words(name) for name in (value or '').split(','))
+    return list(dict.fromkeys(words for words in excluded if words))
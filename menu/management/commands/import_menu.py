@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from menu.importer import DEFAULT_BATCH_SIZE, FORMATS, decode_lines, import_menu, read_rows
+from menu.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk imports menu items for a restaurant from a JSON Lines or CSV file. "
+        "JSON lines use the menu item POST body format. CSV files have the columns "
+        "name, description, category, price, image_url, tags (\"|\" separated), "
+        "ingredients (\"name:quantity:unit\" entries, \"|\" separated) and one column per nutrient."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant_id', help="Restaurant to import the menu into")
+        parser.add_argument('path', help="JSON Lines (.jsonl/.ndjson) or CSV (.csv) file")
+        parser.add_argument('--format', choices=FORMATS, help="File format, detected from the extension by default")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Items inserted per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            restaurant = Restaurant.objects.get(restaurant_id=options['restaurant_id'])
+        except (Restaurant.DoesNotExist, ValidationError) as e:
+            raise CommandError(f"Restaurant {options['restaurant_id']} not found.") from e
+
+        path = Path(options['path'])
+        fmt = options['format'] or {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(path.suffix.lower())
+        if fmt is None:
+            raise CommandError("Cannot detect the file format, pass --format.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        with path.open('rb') as lines:
+            result = import_menu(restaurant, read_rows(decode_lines(lines), fmt), batch_size=options['batch_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['imported']} items ({result['rejected']} rejected) "
+            f"in {result['seconds']}s, {result['rows_per_second']} rows/sec."
+        ))
+        if "error" in result:
+            raise CommandError(f"{result['error']} The rows after it were not imported.")
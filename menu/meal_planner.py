@@ -0,0 +1,164 @@
+"""
+Meal planner: the combination of menu items closest to nutrition targets.
+
+A meal is scored by its relative squared error against the targets, e.g.
+calories 700 and protein 40: ((calories - 700) / 700)^2 + ((protein - 40) / 40)^2.
+Candidates come from the nutrition index (see menu.nutrition_index), so
+planning does not query the database.
+
+Every meal size from 1 to max_items is searched level by level. Each level
+extends the partial meals kept so far by every other item at once, as one
+NumPy array of (partial meals x items) totals, then keeps the beam_width
+partial meals closest to the share of the targets for that many items.
+Partial meals are dropped (branch and bound) when even the smallest and
+largest remaining items cannot bring them closer to the targets than the best
+meal found so far, or when the cheapest remaining items exceed the budget.
+The search is exhaustive while fewer partial meals than beam_width are left,
+which is the case for small menus.
+
+A narrow beam misses meals of items that are far from the targets on their
+own but complement each other. The search is therefore repeated with a beam
+four times wider, for as long as the previous search suggests the next one
+ends within the time budget. At the deadline the best meal found is returned.
+"""
+
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .nutrition_index import nutrition_index
+
+TARGETS = ('calories', 'protein', 'carbohydrates', 'fat')
+
+
+def error_bound(totals, smallest, largest):
+    """
+    Returns the least error reachable from totals, in units of the targets, by
+    adding between smallest and largest of every column.
+    """
+    shortfall = np.maximum(1 - (totals + largest), 0)
+    excess = np.maximum(totals + smallest - 1, 0)
+    return (shortfall ** 2 + excess ** 2).sum(axis=-1)
+
+
+def best_combination(values, prices, goal, budget=None, max_items=3, beam_width=64, deadline=None,
+                     best=(), best_error=np.inf):
+    """
+    Returns (indices, error, exhaustive, timed_out): the rows of values (one
+    column per goal) whose sum is closest to goal, at most max_items of them,
+    with their prices adding up to at most budget. Only meals better than
+    best, of best_error, are looked for. The deadline is only checked once a
+    meal was found.
+    """
+    count, width = values.shape
+    exhaustive, timed_out = True, False
+    if not count:
+        return best, best_error, exhaustive, timed_out
+    if budget is not None:
+        # Prices are float32 in the index, a cent is rounded away either way
+        budget += 0.005
+    cheapest = np.min(prices)
+    # In units of the targets, the error of totals t is |t - 1|^2
+    values = values / goal
+    squares = (values ** 2).sum(axis=1)
+    smallest, largest = values.min(axis=0), values.max(axis=0)
+
+    for size in range(1, min(max_items, count) + 1):
+        combos = np.zeros((1, 0), dtype=np.int64)
+        totals = np.zeros((1, width))
+        spent = np.zeros(1)
+        for level in range(1, size + 1):
+            if best and deadline is not None and time.monotonic() > deadline:
+                return best, best_error, False, True
+            remaining = size - level
+            # Partial meals are ranked against their share of the targets,
+            # |t + v - share|^2 of every partial meal t and item v in one product
+            offsets = totals - level / size
+            scores = (offsets ** 2).sum(axis=1)[:, None] + 2 * offsets @ values.T + squares[None, :]
+            new_spent = spent[:, None] + prices[None, :]
+            # Items already in the meal
+            scores[np.arange(len(combos))[:, None], combos] = np.inf
+            if budget is not None:
+                scores[new_spent + remaining * cheapest > budget] = np.inf
+            scores = scores.ravel()
+
+            candidates = np.flatnonzero(np.isfinite(scores))
+            # Twice the beam, as every meal of two or more items is found once per order of its items
+            if len(candidates) > 2 * beam_width:
+                exhaustive = False
+                candidates = candidates[np.argpartition(scores[candidates], 2 * beam_width)[:2 * beam_width]]
+            candidates = candidates[np.argsort(scores[candidates], kind='stable')]
+            parents, items = np.divmod(candidates, count)
+            new_totals = totals[parents] + values[items]
+            if remaining:
+                # Branch and bound: partial meals that cannot beat the best meal found
+                keep = error_bound(new_totals, remaining * smallest, remaining * largest) < best_error
+                candidates, parents, items, new_totals = candidates[keep], parents[keep], items[keep], new_totals[keep]
+            if not len(candidates):
+                break
+
+            next_combos = np.sort(np.column_stack([combos[parents], items]), axis=1)
+            _, first = np.unique(next_combos, axis=0, return_index=True)
+            first.sort()
+            if len(first) > beam_width:
+                exhaustive = False
+                first = first[:beam_width]
+            combos, totals = next_combos[first], new_totals[first]
+            spent = new_spent.ravel()[candidates[first]]
+
+            if not remaining:
+                error = ((totals[0] - 1) ** 2).sum()
+                if error < best_error:
+                    best, best_error = tuple(int(index) for index in combos[0]), error
+    return best, best_error, exhaustive, timed_out
+
+
+def plan_meal(targets, budget=None, max_items=3, restaurant_ids=None, exclude_ingredients=None,
+              beam_width=None, time_budget=None):
+    """
+    Returns the meal closest to the {nutrient: target} targets among the
+    items of the given restaurants, with the items, their totals, its error
+    and whether the search was exhaustive or ran out of time.
+    """
+    nutrients = [nutrient for nutrient in TARGETS if nutrient in targets]
+    table, rows = nutrition_index.select(
+        (*nutrients, 'price'),
+        ranges={'price': (None, budget + 0.005)} if budget is not None else None,
+        restaurant_ids=restaurant_ids,
+        exclude_ingredients=exclude_ingredients,
+    )
+    # Items without a value for one of the targets cannot be planned with
+    known = np.flatnonzero(~np.isnan(table).any(axis=1))
+    table = table[known]
+    values, prices = table[:, :-1], table[:, -1]
+    goal = np.array([float(targets[nutrient]) for nutrient in nutrients])
+
+    # The time budget is for the search, not for building the index
+    started = time.monotonic()
+    deadline = started + (time_budget or settings.MEAL_PLANNER['TIME_BUDGET'])
+    beam_width = beam_width or settings.MEAL_PLANNER['BEAM_WIDTH']
+    indices, error = (), np.inf
+    while True:
+        pass_started = time.monotonic()
+        indices, error, exhaustive, timed_out = best_combination(
+            values, prices, goal, budget=budget, max_items=max_items, beam_width=beam_width, deadline=deadline,
+            best=indices, best_error=error,
+        )
+        now = time.monotonic()
+        # A search takes about as many times longer as its beam is wider
+        if exhaustive or timed_out or now + 4 * (now - pass_started) > deadline:
+            break
+        beam_width *= 4
+    items = rows([known[index] for index in indices])
+    return {
+        "items": items,
+        "totals": {
+            column: round(sum(item["nutrition_facts"][column] or 0 for item in items), 2) for column in nutrients
+        } | {"price": round(sum(item["price"] for item in items), 2)},
+        "error": round(float(error), 4) if items else None,
+        "exhaustive": exhaustive,
+        "timed_out": timed_out,
+        "beam_width": beam_width,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    }
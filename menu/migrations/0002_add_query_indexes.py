@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['owner_id'], name='menu_restau_owner_i_90110c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='menuitem',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'item_id'), name='menu_menuitem_restaurant_item'),
+        ),
+        migrations.AddIndex(
+            model_name='nutritionfact',
+            index=models.Index(fields=['item', 'nutrition_id'], name='menu_nutrit_item_id_f1b3a8_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:10
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0002_add_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['created_at', 'restaurant_id'], name='menu_restau_created_6548af_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='menu_restaurant_name_lower'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:19
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_tags(apps, schema_editor):
+    # Same normalization as menu.tags.normalize_tag at the time of this migration
+    MenuItem = apps.get_model('menu', 'MenuItem')
+    MenuItemTag = apps.get_model('menu', 'MenuItemTag')
+    rows = []
+    for item_id, restaurant_id, tags in MenuItem.objects.exclude(tags=None).values_list('item_id', 'restaurant_id', 'tags').iterator(chunk_size=1000):
+        if not isinstance(tags, list):
+            continue
+        normalized = {re.sub(r'[\s_]+', '-', tag.strip().lower())[:100] for tag in tags if isinstance(tag, str) and tag.strip()}
+        rows += [MenuItemTag(item_id=item_id, restaurant_id=restaurant_id, tag=tag) for tag in sorted(normalized)]
+        if len(rows) >= 1000:
+            MenuItemTag.objects.bulk_create(rows)
+            rows = []
+    MenuItemTag.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0003_restaurant_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=100)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_index', to='menu.menuitem')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='menu.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'restaurant', 'item'], name='menu_menuit_tag_f2df7e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('item', 'tag'), name='menu_menuitemtag_item_tag')],
+            },
+        ),
+        migrations.RunPython(index_existing_tags, migrations.RunPython.noop),
+    ]
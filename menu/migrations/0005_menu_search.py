@@ -0,0 +1,184 @@
+from django.db import migrations
+
+# Full-text search index over menu item names, descriptions and ingredient names,
+# maintained by triggers so bulk inserts are indexed too. See menu.search.
+
+SQLITE_FORWARD = [
+    # FTS5 rowids are mapped to items through menu_search_doc, whose INTEGER PRIMARY KEY
+    # survives VACUUM unlike the implicit rowid of menu_menuitem
+    """
+    CREATE TABLE menu_search_doc (
+        id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+        item_id char(32) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE menu_search USING fts5(
+        name, description, ingredients, tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER menu_search_item_insert AFTER INSERT ON menu_menuitem BEGIN
+        INSERT INTO menu_search_doc (item_id) VALUES (NEW.item_id);
+        INSERT INTO menu_search (rowid, name, description, ingredients)
+        VALUES (last_insert_rowid(), NEW.name, coalesce(NEW.description, ''), '');
+    END
+    """,
+    """
+    CREATE TRIGGER menu_search_item_update AFTER UPDATE OF name, description ON menu_menuitem BEGIN
+        UPDATE menu_search SET name = NEW.name, description = coalesce(NEW.description, '')
+        WHERE rowid = (SELECT id FROM menu_search_doc WHERE item_id = NEW.item_id);
+    END
+    """,
+    """
+    CREATE TRIGGER menu_search_item_delete AFTER DELETE ON menu_menuitem BEGIN
+        DELETE FROM menu_search WHERE rowid = (SELECT id FROM menu_search_doc WHERE item_id = OLD.item_id);
+        DELETE FROM menu_search_doc WHERE item_id = OLD.item_id;
+    END
+    """,
+    *(
+        f"""
+        CREATE TRIGGER menu_search_ingredient_{event.lower()} AFTER {event} ON menu_ingredient BEGIN
+            UPDATE menu_search SET ingredients = coalesce(
+                (SELECT group_concat(name, ' ') FROM menu_ingredient WHERE item_id = {row}.item_id), ''
+            )
+            WHERE rowid = (SELECT id FROM menu_search_doc WHERE item_id = {row}.item_id);
+        END
+        """
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ),
+    # An ingredient moved to another item leaves its old item too
+    """
+    CREATE TRIGGER menu_search_ingredient_move AFTER UPDATE OF item_id ON menu_ingredient BEGIN
+        UPDATE menu_search SET ingredients = coalesce(
+            (SELECT group_concat(name, ' ') FROM menu_ingredient WHERE item_id = OLD.item_id), ''
+        )
+        WHERE rowid = (SELECT id FROM menu_search_doc WHERE item_id = OLD.item_id);
+    END
+    """,
+    """
+    INSERT INTO menu_search_doc (item_id) SELECT item_id FROM menu_menuitem
+    """,
+    """
+    INSERT INTO menu_search (rowid, name, description, ingredients)
+    SELECT d.id, m.name, coalesce(m.description, ''),
+           coalesce((SELECT group_concat(i.name, ' ') FROM menu_ingredient i WHERE i.item_id = m.item_id), '')
+    FROM menu_search_doc d JOIN menu_menuitem m ON m.item_id = d.item_id
+    """,
+]
+
+SQLITE_BACKWARD = [
+    *(f"DROP TRIGGER IF EXISTS menu_search_{name}" for name in (
+        'item_insert', 'item_update', 'item_delete',
+        'ingredient_insert', 'ingredient_update', 'ingredient_delete', 'ingredient_move',
+    )),
+    "DROP TABLE IF EXISTS menu_search",
+    "DROP TABLE IF EXISTS menu_search_doc",
+]
+
+POSTGRESQL_FORWARD = [
+    # No foreign key to menu_menuitem, which would make the TRUNCATE of flush() fail;
+    # the triggers below delete the rows of deleted items instead
+    """
+    CREATE TABLE menu_search (
+        item_id uuid PRIMARY KEY,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX menu_search_document ON menu_search USING GIN (document)",
+    """
+    CREATE FUNCTION menu_search_refresh(target uuid) RETURNS void AS $$
+        INSERT INTO menu_search (item_id, document)
+        SELECT m.item_id,
+               setweight(to_tsvector('english', m.name), 'A') ||
+               setweight(to_tsvector('english', coalesce(m.description, '')), 'B') ||
+               setweight(to_tsvector('english', coalesce(
+                   (SELECT string_agg(i.name, ' ') FROM menu_ingredient i WHERE i.item_id = m.item_id), ''
+               )), 'C')
+        FROM menu_menuitem m
+        WHERE m.item_id = target
+        ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE FUNCTION menu_search_item_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM menu_search WHERE item_id = OLD.item_id;
+        ELSE
+            PERFORM menu_search_refresh(NEW.item_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER menu_search_item AFTER INSERT OR UPDATE OF name, description OR DELETE ON menu_menuitem
+    FOR EACH ROW EXECUTE FUNCTION menu_search_item_changed()
+    """,
+    """
+    CREATE FUNCTION menu_search_items_truncated() RETURNS trigger AS $$
+    BEGIN
+        TRUNCATE menu_search;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER menu_search_item_truncate AFTER TRUNCATE ON menu_menuitem
+    FOR EACH STATEMENT EXECUTE FUNCTION menu_search_items_truncated()
+    """,
+    """
+    CREATE FUNCTION menu_search_ingredient_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM menu_search_refresh(OLD.item_id);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM menu_search_refresh(NEW.item_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER menu_search_ingredient AFTER INSERT OR UPDATE OR DELETE ON menu_ingredient
+    FOR EACH ROW EXECUTE FUNCTION menu_search_ingredient_changed()
+    """,
+    "SELECT menu_search_refresh(item_id) FROM menu_menuitem",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP TRIGGER IF EXISTS menu_search_ingredient ON menu_ingredient",
+    "DROP TRIGGER IF EXISTS menu_search_item_truncate ON menu_menuitem",
+    "DROP TRIGGER IF EXISTS menu_search_item ON menu_menuitem",
+    "DROP FUNCTION IF EXISTS menu_search_ingredient_changed()",
+    "DROP FUNCTION IF EXISTS menu_search_items_truncated()",
+    "DROP FUNCTION IF EXISTS menu_search_item_changed()",
+    "DROP FUNCTION IF EXISTS menu_search_refresh(uuid)",
+    "DROP TABLE IF EXISTS menu_search",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        vendor_statements = statements.get(schema_editor.connection.vendor)
+        if vendor_statements is None:
+            raise NotImplementedError(f"Menu search is not available on {schema_editor.connection.vendor}.")
+        for statement in vendor_statements:
+            schema_editor.execute(statement, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0004_menu_item_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# WAL lets readers run while a write is in progress. The journal mode is stored
+# in the database file, so it is switched once here rather than by every new
+# connection. It cannot change inside a transaction, hence atomic = False.
+
+
+def set_journal_mode(mode):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            schema_editor.execute(f"PRAGMA journal_mode={mode}", params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('menu', '0005_menu_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode('WAL'), set_journal_mode('DELETE')),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.db.models.functions import Lower
 
 class Restaurant(models.Model):
     restaurant_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -9,6 +10,13 @@ class Restaurant(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner_id']),  # Restaurants of an owner
+            models.Index(fields=['created_at', 'restaurant_id']),  # Listing, newest first
+            models.Index(Lower('name'), name='menu_restaurant_name_lower'),  # Name prefix search
+        ]
+
 class MenuItem(models.Model):
     """
     Represents a menu item in a restaurant's menu."
@@ -40,6 +48,13 @@ class MenuItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # Menu of a restaurant in item order. Unique, so that SQLite also reads the
+            # ingredients and nutrition facts joined to it in that order without sorting
+            models.UniqueConstraint(fields=['restaurant', 'item_id'], name='menu_menuitem_restaurant_item'),
+        ]
+
 class Ingredient(models.Model):
     ingredient_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
@@ -62,3 +77,24 @@ class NutritionFact(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'nutrition_id']),  # Facts of an item, first one first
+        ]
+
+class MenuItemTag(models.Model):
+    """
+    A normalized tag of a menu item, the inverted index over MenuItem.tags.
+    Rows are kept in sync with MenuItem.tags by menu.tags.
+    """
+    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='tag_index')
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='+')
+    tag = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'tag'], name='menu_menuitemtag_item_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'restaurant', 'item']),  # Items with a tag, globally or per restaurant
+        ]
@@ -0,0 +1,605 @@
+"""
+In-memory columnar index of the nutrition facts of every menu item.
+
+Each worker keeps one NumPy array per nutrient (plus price, restaurant and
+category codes), so a range search over hundreds of thousands of items is a
+handful of vectorized comparisons instead of a scan of the nullable decimal
+columns in SQL. Nutrients come from the item's first NutritionFact, like the
+menu item detail; missing values are NaN and never match a range.
+
+The index is built on first use and kept current from a change log in Redis
+(the nutrition:changes stream). Menu writes append the ids of the items they
+touched once the transaction commits; before answering, a worker reloads at
+most every SYNC_INTERVAL seconds the items added to the stream since it last
+looked. When its position in the stream was trimmed away the worker rebuilds
+the index from the database instead. Every index is also rebuilt after MAX_AGE
+seconds, which bounds how long changes that could not be announced while Redis
+was unavailable stay invisible to other workers.
+
+The index also keeps a posting list per ingredient word (see menu.ingredients):
+the sorted rows of the items having an ingredient with that word. Excluding an
+ingredient is then a few array lookups instead of a join over every
+Ingredient row. An exclusion must never show an item with the ingredient, so
+while the change log cannot be read the ingredients of the candidate items are
+read from the database instead. Changes this worker could not announce are
+announced again once Redis is back.
+"""
+
+import threading
+import time
+import uuid
+from functools import partial, reduce
+from itertools import chain, groupby
+from operator import itemgetter
+
+import numpy as np
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, FloatField
+from django.db.models.functions import Cast
+
+from nutrition_app.redis_client import get_redis
+from .ingredients import ingredient_words
+from .models import Ingredient, MenuItem
+from .queries import MENU_CHUNK_SIZE, NUTRIENTS
+
+CHANGES_KEY = 'nutrition:changes'
+# Filterable and sortable columns
+COLUMNS = NUTRIENTS + ('price',)
+CATEGORIES = [category for category, _ in MenuItem.CATEGORY_CHOICES]
+# Items reloaded per query when applying changes
+RELOAD_CHUNK_SIZE = 500
+
+
+class Columns:
+    """
+    Fixed capacity column arrays and the per row Python values.
+    """
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.removed = 0
+        self.values = {column: np.full(capacity, np.nan, dtype=np.float32) for column in COLUMNS}
+        self.restaurant = np.zeros(capacity, dtype=np.int32)
+        self.category = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.item_ids = []
+        self.names = []
+        # Ids are kept as hex strings
+        self.positions = {}  # item_id => row
+        self.restaurant_ids = []  # code => restaurant_id
+        self.restaurant_codes = {}  # restaurant_id => code
+        self.terms = []  # code => ingredient word
+        self.term_codes = {}  # ingredient word => code
+        self.postings = []  # code => sorted int32 rows of the items having the word
+        self.item_terms = []  # row => tuple of codes
+
+    @classmethod
+    def from_rows(cls, rows, terms=()):
+        """
+        Builds the columns of many rows at once, with room for as many more,
+        and the posting lists of their (item_id, words) terms.
+        """
+        columns = cls(max(1024, len(rows) * 2))
+        size = columns.size = len(rows)
+        if not size:
+            return columns
+        item_ids, restaurant_ids, names, categories, prices, nutrients = zip(*rows)
+        columns.item_ids = list(item_ids)
+        columns.names = list(names)
+        columns.positions = {item_id: position for position, item_id in enumerate(item_ids)}
+        # Words are coded in bulk, there are far fewer distinct words than items
+        term_positions, counts, words = [], [], []
+        for item_id, item_words in terms:
+            position = columns.positions.get(item_id)
+            if position is not None:
+                term_positions.append(position)
+                counts.append(len(item_words))
+                words += item_words
+        columns.terms = list(dict.fromkeys(words))
+        columns.term_codes = {word: code for code, word in enumerate(columns.terms)}
+        codes = list(map(columns.term_codes.__getitem__, words))
+        columns.item_terms = [()] * size
+        start = 0
+        for position, count in zip(term_positions, counts):
+            columns.item_terms[position] = tuple(codes[start:start + count])
+            start += count
+        columns.index_terms()
+        columns.restaurant[:size] = [columns.restaurant_code(restaurant_id) for restaurant_id in restaurant_ids]
+        codes = {category: code for code, category in enumerate(CATEGORIES)}
+        columns.category[:size] = [codes.get(category, -1) for category in categories]
+        columns.values['price'][:size] = prices
+        # None becomes NaN
+        table = np.array(nutrients, dtype=np.float32)
+        for index, nutrient in enumerate(NUTRIENTS):
+            columns.values[nutrient][:size] = table[:, index]
+        columns.alive[:size] = True
+        return columns
+
+    @property
+    def capacity(self):
+        return len(self.alive)
+
+    def restaurant_code(self, restaurant_id):
+        code = self.restaurant_codes.get(restaurant_id)
+        if code is None:
+            code = self.restaurant_codes[restaurant_id] = len(self.restaurant_ids)
+            self.restaurant_ids.append(restaurant_id)
+        return code
+
+    def term_code(self, word):
+        code = self.term_codes.get(word)
+        if code is None:
+            code = self.term_codes[word] = len(self.terms)
+            self.terms.append(word)
+            self.postings.append(np.zeros(0, dtype=np.int32))
+        return code
+
+    def index_terms(self):
+        """
+        Rebuilds every posting list from the terms of the rows.
+        """
+        counts = np.fromiter(map(len, self.item_terms), dtype=np.int64, count=len(self.item_terms))
+        rows = np.repeat(np.arange(len(self.item_terms), dtype=np.int32), counts)
+        codes = np.fromiter(chain.from_iterable(self.item_terms), dtype=np.int32, count=int(counts.sum()))
+        # Stable, so the rows of each code stay sorted
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(1, len(self.terms)))
+        self.postings = np.split(rows[order], bounds) if self.terms else []
+
+    def set_terms(self, words_by_position):
+        """
+        Replaces the terms of some rows, updating each affected posting list once.
+        """
+        added, removed = {}, {}
+        for position, words in words_by_position.items():
+            codes = tuple(self.term_code(word) for word in words)
+            old = set(self.item_terms[position])
+            for code in old.difference(codes):
+                removed.setdefault(code, []).append(position)
+            for code in set(codes).difference(old):
+                added.setdefault(code, []).append(position)
+            self.item_terms[position] = codes
+        for code in added.keys() | removed.keys():
+            posting = self.postings[code]
+            if code in removed:
+                posting = np.setdiff1d(posting, removed[code], assume_unique=True)
+            if code in added:
+                posting = np.union1d(posting, added[code])
+            self.postings[code] = posting.astype(np.int32, copy=False)
+
+    def containing(self, excluded):
+        """
+        Returns the mask of the rows whose ingredients contain every word of one
+        of the excluded word tuples.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        for words in excluded:
+            codes = [self.term_codes.get(word) for word in words]
+            if None not in codes:
+                mask[reduce(partial(np.intersect1d, assume_unique=True), (self.postings[code] for code in codes))] = True
+        return mask
+
+    def matching(self, ranges=None, restaurant_ids=None, category=None, exclude_ingredients=None):
+        """
+        Returns the mask of the alive rows matching the filters, see NutritionIndex.search.
+        """
+        size = self.size
+        mask = self.alive[:size].copy()
+        for column, (minimum, maximum) in (ranges or {}).items():
+            values = self.values[column][:size]
+            if minimum is not None:
+                mask &= values >= minimum
+            if maximum is not None:
+                mask &= values <= maximum
+        if restaurant_ids is not None:
+            restaurant_ids = (uuid.UUID(str(restaurant_id)).hex for restaurant_id in restaurant_ids)
+            codes = [self.restaurant_codes[r] for r in restaurant_ids if r in self.restaurant_codes]
+            mask &= np.isin(self.restaurant[:size], codes)
+        if category is not None:
+            mask &= self.category[:size] == (CATEGORIES.index(category) if category in CATEGORIES else -2)
+        if exclude_ingredients:
+            mask &= ~self.containing(exclude_ingredients)
+        return mask
+
+    def grow(self, capacity):
+        for column, values in self.values.items():
+            self.values[column] = np.concatenate([values, np.full(capacity - len(values), np.nan, dtype=np.float32)])
+        self.restaurant = np.resize(self.restaurant, capacity)
+        self.category = np.resize(self.category, capacity)
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+
+    def upsert(self, row):
+        """
+        Stores an (item_id, restaurant_id, name, category, price, nutrients) row
+        and returns its position. Its terms are set separately.
+        """
+        item_id, restaurant_id, name, category, price, nutrients = row
+        position = self.positions.get(item_id)
+        if position is None:
+            if self.size == self.capacity:
+                self.grow(max(1024, self.capacity * 2))
+            position = self.positions[item_id] = self.size
+            self.size += 1
+            self.item_ids.append(item_id)
+            self.names.append(name)
+            self.item_terms.append(())
+        else:
+            self.names[position] = name
+        self.restaurant[position] = self.restaurant_code(restaurant_id)
+        self.category[position] = CATEGORIES.index(category) if category in CATEGORIES else -1
+        self.values['price'][position] = price
+        for nutrient, value in zip(NUTRIENTS, nutrients):
+            self.values[nutrient][position] = np.nan if value is None else value
+        self.alive[position] = True
+        return position
+
+    def remove(self, item_id):
+        position = self.positions.pop(item_id, None)
+        if position is not None:
+            self.alive[position] = False
+            self.item_ids[position] = None
+            # Left in the posting lists until compaction, the row is no longer alive
+            self.item_terms[position] = ()
+            self.removed += 1
+
+
+def load_rows(item_ids=None):
+    """
+    Yields an index row for the given items (all items by default), with ids
+    as 32 digit hex strings. One query joins the items to their nutrition facts;
+    the casts skip the per value UUID and Decimal conversions, which would
+    otherwise dominate the time to build the index.
+    """
+    items = MenuItem.objects.all()
+    if item_ids is not None:
+        items = items.filter(item_id__in=item_ids)
+    rows = (
+        items
+        .order_by('item_id', 'nutrition_facts__nutrition_id')
+        .values_list(
+            Cast('item_id', CharField()), Cast('restaurant_id', CharField()), 'name', 'category',
+            Cast('price', FloatField()), *(Cast(f'nutrition_facts__{nutrient}', FloatField()) for nutrient in NUTRIENTS),
+        )
+        .iterator(chunk_size=MENU_CHUNK_SIZE)
+    )
+    # Only the first nutrition fact of an item counts
+    for _, (row, *_) in groupby(rows, key=itemgetter(0)):
+        # PostgreSQL casts UUIDs with dashes
+        yield row[0].replace('-', ''), row[1].replace('-', ''), row[2], row[3], row[4], row[5:]
+
+
+def load_terms(item_ids=None):
+    """
+    Yields (item_id, words) for the given items that have ingredients (all
+    items by default), with the normalized words of all their ingredients.
+    """
+    ingredients = Ingredient.objects.all()
+    if item_ids is not None:
+        ingredients = ingredients.filter(item_id__in=item_ids)
+    rows = (
+        ingredients
+        .order_by('item_id')
+        .values_list(Cast('item_id', CharField()), 'name')
+        .iterator(chunk_size=MENU_CHUNK_SIZE)
+    )
+    for item_id, group in groupby(rows, key=itemgetter(0)):
+        words = dict.fromkeys(chain.from_iterable(ingredient_words(name) for _, name in group))
+        yield item_id.replace('-', ''), tuple(words)
+
+
+def load_containing(item_ids, ingredients):
+    """
+    Returns the ids among the hex item_ids of the items having one of the
+    ingredients (word tuples), read from the database.
+    """
+    excluded = [set(words) for words in ingredients]
+    if len(item_ids) > 10 * RELOAD_CHUNK_SIZE:
+        # One pass over every ingredient is cheaper than that many chunks
+        item_ids = set(item_ids)
+        terms = (row for row in load_terms() if row[0] in item_ids)
+    else:
+        terms = chain.from_iterable(
+            load_terms(item_ids[start:start + RELOAD_CHUNK_SIZE])
+            for start in range(0, len(item_ids), RELOAD_CHUNK_SIZE)
+        )
+    return {item_id for item_id, words in terms if any(phrase.issubset(words) for phrase in excluded)}
+
+
+class NutritionIndex:
+    def __init__(self, client, sync_interval=1.0, max_age=3600, changelog_length=100000):
+        self.client = client
+        self.sync_interval = sync_interval
+        self.max_age = max_age
+        self.changelog_length = changelog_length
+        self.columns = None
+        self.built_at = 0.0
+        self.synced_at = 0.0
+        self.last_change = None  # Id of the last applied stream entry, None when unknown
+        self.pending = set()  # Items written by this worker, applied on the next sync
+        self.unpublished = set()  # Items written by this worker while the change log was unavailable
+        self.missed_changes = False  # The change log could not be read by the last sync
+        self.builds = 0
+        self.reloaded_items = 0
+        self._lock = threading.Lock()  # Swaps and mutations of the columns
+        self._sync_lock = threading.Lock()  # One thread builds or syncs at a time
+
+    @property
+    def complete(self):
+        """
+        Whether every change announced by other workers was read, as of the last sync.
+        """
+        return self.last_change is not None and not self.missed_changes
+
+    def _head(self):
+        """
+        Returns the id of the newest change, adding a marker to an empty stream,
+        or None when Redis is unavailable.
+        """
+        try:
+            newest = self.client.xrevrange(CHANGES_KEY, count=1)
+            if newest:
+                return newest[0][0]
+            return self.client.xadd(CHANGES_KEY, {'items': ''}, maxlen=self.changelog_length, approximate=True)
+        except redis.RedisError:
+            return None
+
+    def build(self):
+        """
+        Loads every menu item from the database into fresh columns.
+        """
+        # Taken first, so writes committed during the load are applied again by the next sync
+        head = self._head()
+        self.pending = set()
+        columns = Columns.from_rows(list(load_rows()), load_terms())
+        with self._lock:
+            self.columns = columns
+        self.last_change = head
+        self.missed_changes = False
+        self.built_at = self.synced_at = time.monotonic()
+        self.builds += 1
+
+    def reload(self, item_ids):
+        """
+        Reloads changed items from the database, removing the ones that were deleted.
+        """
+        item_ids = list(item_ids)
+        for start in range(0, len(item_ids), RELOAD_CHUNK_SIZE):
+            chunk = item_ids[start:start + RELOAD_CHUNK_SIZE]
+            rows = list(load_rows(chunk))
+            terms = dict(load_terms(chunk))
+            found = {row[0] for row in rows}
+            with self._lock:
+                self.columns.set_terms({self.columns.upsert(row): terms.get(row[0], ()) for row in rows})
+                for item_id in chunk:
+                    if item_id not in found:
+                        self.columns.remove(item_id)
+                if self.columns.removed > max(1024, self.columns.size // 2):
+                    self.columns = self._compacted(self.columns)
+        self.reloaded_items += len(item_ids)
+
+    @staticmethod
+    def _compacted(columns):
+        compact = Columns(max(1024, len(columns.positions) * 2))
+        keep = np.flatnonzero(columns.alive[:columns.size])
+        compact.size = len(keep)
+        for column, values in columns.values.items():
+            compact.values[column][:len(keep)] = values[keep]
+        compact.restaurant[:len(keep)] = columns.restaurant[keep]
+        compact.category[:len(keep)] = columns.category[keep]
+        compact.alive[:len(keep)] = True
+        compact.item_ids = [columns.item_ids[position] for position in keep]
+        compact.names = [columns.names[position] for position in keep]
+        compact.positions = {item_id: position for position, item_id in enumerate(compact.item_ids)}
+        compact.restaurant_ids = columns.restaurant_ids
+        compact.restaurant_codes = columns.restaurant_codes
+        compact.terms = columns.terms
+        compact.term_codes = columns.term_codes
+        compact.item_terms = [columns.item_terms[position] for position in keep]
+        compact.index_terms()
+        return compact
+
+    def sync(self):
+        """
+        Builds the index on first use and applies the changes of other workers.
+        """
+        if self.columns is None:
+            with self._sync_lock:
+                if self.columns is None:
+                    self.build()
+            return
+
+        now = time.monotonic()
+        if now - self.synced_at < self.sync_interval and not self.pending:
+            return
+        # Other threads answer from the current columns meanwhile
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.synced_at = now
+            if self.unpublished:
+                self._publish(self.unpublished)
+            if now - self.built_at >= self.max_age:
+                self.build()
+                return
+            if self.last_change is None and self._head() is not None:
+                # Built while Redis was unavailable, the changes made since then are unknown
+                self.build()
+                return
+            changed, self.pending = self.pending, set()
+            if self.last_change is not None:
+                try:
+                    # Starts at the last applied entry, which is gone when the stream was trimmed past it
+                    entries = self.client.xrange(CHANGES_KEY, min=self.last_change, count=self.changelog_length)
+                except redis.RedisError:
+                    entries = None
+                self.missed_changes = entries is None
+                if entries is not None:
+                    if not entries or entries[0][0] != self.last_change:
+                        self.build()
+                        return
+                    for _, fields in entries[1:]:
+                        changed.update(filter(None, fields['items'].split(',')))
+                    self.last_change = entries[-1][0]
+            if changed:
+                self.reload(changed)
+        finally:
+            self._sync_lock.release()
+
+    def mark_changed(self, item_ids):
+        """
+        Announces changed menu items to every worker once the transaction commits.
+        """
+        item_ids = [uuid.UUID(str(item_id)).hex for item_id in item_ids]
+        if not item_ids:
+            return
+
+        def publish():
+            self.pending.update(item_ids)
+            self._publish(item_ids)
+
+        transaction.on_commit(publish)
+
+    def _publish(self, item_ids):
+        try:
+            self.client.xadd(
+                CHANGES_KEY, {'items': ','.join(item_ids)}, maxlen=self.changelog_length, approximate=True
+            )
+        except redis.RedisError:
+            # Announced again by the next sync that reaches Redis
+            self.unpublished.update(item_ids)
+        else:
+            self.unpublished.difference_update(item_ids)
+
+    def _matching(self, ranges, restaurant_ids, category, exclude_ingredients):
+        """
+        Returns (columns, mask) of the rows matching the filters. Ingredients are
+        excluded using the database while the index may miss changes.
+        """
+        complete = self.complete
+        with self._lock:
+            columns = self.columns
+            mask = columns.matching(ranges, restaurant_ids, category, exclude_ingredients if complete else None)
+        if exclude_ingredients and not complete:
+            positions = np.flatnonzero(mask)
+            containing = load_containing([columns.item_ids[position] for position in positions], exclude_ingredients)
+            mask[positions] = [columns.item_ids[position] not in containing for position in positions]
+        return columns, mask
+
+    def search(self, ranges=None, restaurant_ids=None, category=None, sort=None, descending=False, offset=0, limit=20,
+               exclude_ingredients=None):
+        """
+        Returns (total, rows) of the items whose columns lie within the
+        {column: (minimum, maximum)} ranges (either bound may be None), sorted
+        by a column (items without a value last) or by insertion order.
+        exclude_ingredients are word tuples from menu.ingredients.parse_ingredients.
+        """
+        self.sync()
+        columns, mask = self._matching(ranges, restaurant_ids, category, exclude_ingredients)
+        with self._lock:
+            positions = np.flatnonzero(mask)
+            total = len(positions)
+            end = offset + limit
+            if sort is not None and total:
+                keys = columns.values[sort][positions]
+                keys = np.where(np.isnan(keys), np.inf, -keys if descending else keys)
+                if end < total:
+                    # Only the requested page needs to be ordered, with every row tied
+                    # with its last key so the position tiebreak below is the same on every page
+                    boundary = np.partition(keys, end - 1)[end - 1]
+                    top = keys <= boundary
+                    positions, keys = positions[top], keys[top]
+                # Ties in insertion order
+                positions = positions[np.lexsort((positions, keys))]
+            positions = positions[offset:end]
+
+            rows = [self._row(columns, position) for position in positions]
+        return total, rows
+
+    def select(self, column_names, ranges=None, restaurant_ids=None, category=None, exclude_ingredients=None):
+        """
+        Returns (table, rows) for the items matching the filters of search():
+        a float64 array of their column_names values, one row per item, and a
+        function returning the item rows (as in search results) of row numbers
+        of that table.
+        """
+        self.sync()
+        columns, mask = self._matching(ranges, restaurant_ids, category, exclude_ingredients)
+        with self._lock:
+            positions = np.flatnonzero(mask)
+            table = np.column_stack([columns.values[column][positions] for column in column_names]).astype(np.float64)
+
+        def rows(indices):
+            with self._lock:
+                return [self._row(columns, positions[index]) for index in indices]
+
+        return table, rows
+
+    @staticmethod
+    def _row(columns, position):
+        def value(column):
+            # float32 values are rounded back to the decimal places of the model fields
+            number = columns.values[column][position]
+            return None if np.isnan(number) else round(float(number), 2)
+
+        category = columns.category[position]
+        return {
+            "item_id": str(uuid.UUID(columns.item_ids[position])),
+            "restaurant_id": str(uuid.UUID(columns.restaurant_ids[columns.restaurant[position]])),
+            "name": columns.names[position],
+            "category": CATEGORIES[category] if category >= 0 else None,
+            "price": value('price'),
+            "nutrition_facts": {nutrient: value(nutrient) for nutrient in NUTRIENTS},
+        }
+
+    def items_containing(self, ingredients, item_ids):
+        """
+        Returns the set of the item_ids having one of the ingredients (word tuples
+        from menu.ingredients.parse_ingredients), for filtering database results.
+        Items this worker has not indexed yet are in it too, so an exclusion
+        never lets an unchecked item through.
+        """
+        self.sync()
+        hex_ids = {uuid.UUID(str(item_id)).hex: item_id for item_id in item_ids}
+        if not self.complete:
+            return {hex_ids[item_id] for item_id in load_containing(list(hex_ids), ingredients)}
+        with self._lock:
+            columns = self.columns
+            positions = [columns.positions.get(item_id) for item_id in hex_ids]
+            indexed = [position for position in positions if position is not None]
+            containing = dict(zip(indexed, columns.containing(ingredients)[indexed].tolist()))
+        return {
+            item_id for item_id, position in zip(hex_ids.values(), positions)
+            if position is None or containing[position]
+        }
+
+    def clear(self):
+        """
+        Drops the index, the next search rebuilds it.
+        """
+        with self._lock:
+            self.columns = None
+
+    def stats(self):
+        with self._lock:
+            columns = self.columns
+            return {
+                "items": len(columns.positions) if columns else 0,
+                "capacity": columns.capacity if columns else 0,
+                "memory_bytes": sum(
+                    values.nbytes for values in chain(columns.values.values(), columns.postings)
+                ) if columns else 0,
+                "ingredient_words": len(columns.terms) if columns else 0,
+                "builds": self.builds,
+                "reloaded_items": self.reloaded_items,
+                "last_change": self.last_change,
+            }
+
+
+nutrition_index = NutritionIndex(
+    get_redis(),
+    sync_interval=settings.NUTRITION_INDEX['SYNC_INTERVAL'],
+    max_age=settings.NUTRITION_INDEX['MAX_AGE'],
+    changelog_length=settings.NUTRITION_INDEX['CHANGELOG_LENGTH'],
+)
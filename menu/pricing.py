@@ -0,0 +1,116 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import MenuItem
+
+
+def _key(item_id):
+    """
+    Returns the canonical form of an item id, or None when it is malformed.
+    """
+    try:
+        return uuid.UUID(str(item_id)).hex
+    except ValueError:
+        return None
+
+
+def load_prices(item_ids):
+    """
+    Returns {item_id: Decimal price} for the given item ids, read from the
+    database with a single query. Unknown or malformed item ids map to None.
+    """
+    prices = dict.fromkeys(item_ids)
+    by_key = {}
+    for item_id in prices:
+        key = _key(item_id)
+        if key is not None:
+            by_key.setdefault(key, []).append(item_id)
+    if by_key:
+        for pk, price in MenuItem.objects.filter(item_id__in=list(by_key)).values_list('item_id', 'price'):
+            for item_id in by_key[pk.hex]:
+                prices[item_id] = price
+    return prices
+
+
+class PriceCache:
+    """
+    In-process cache of MenuItem prices for showing carts.
+
+    Prices missing from the cache are fetched for all requested items with a
+    single item_id__in query. Saving or deleting an item invalidates its entry
+    in this worker once the transaction commits (see signals); other workers
+    may show the old price for up to `ttl` seconds. Checkout charges prices
+    read from the database (see orders.checkout), never cached ones.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._prices = {}
+        self._lock = threading.Lock()
+
+    def get_prices(self, item_ids):
+        """
+        Returns {item_id: Decimal price} for the given item ids (as strings).
+        Unknown or malformed item ids map to None.
+        """
+        now = time.monotonic()
+        prices = {}
+        missing = []
+        with self._lock:
+            for item_id in item_ids:
+                entry = self._prices.get(_key(item_id))
+                if entry is not None and entry[1] > now:
+                    prices[item_id] = entry[0]
+                else:
+                    missing.append(item_id)
+
+        if missing:
+            loaded = load_prices(missing)
+            # Only real items are cached, so made-up ids in carts cannot grow the cache
+            expires = now + self.ttl
+            with self._lock:
+                for item_id, price in loaded.items():
+                    if price is not None:
+                        self._prices[_key(item_id)] = (price, expires)
+            prices.update(loaded)
+
+        return prices
+
+    def get_cached(self, item_ids):
+        """
+        Returns {item_id: price} when every item is cached, otherwise None.
+        Never queries the database, so async views can call it directly.
+        """
+        now = time.monotonic()
+        prices = {}
+        with self._lock:
+            for item_id in item_ids:
+                entry = self._prices.get(_key(item_id))
+                if entry is None or entry[1] <= now:
+                    return None
+                prices[item_id] = entry[0]
+        return prices
+
+    def invalidate(self, item_id):
+        """
+        Drops the price of an item once the transaction commits, so the old
+        price cannot be cached again from a read made before the commit.
+        """
+        key = _key(item_id)
+
+        def drop():
+            with self._lock:
+                self._prices.pop(key, None)
+
+        transaction.on_commit(drop)
+
+    def clear(self):
+        with self._lock:
+            self._prices.clear()
+
+
+price_cache = PriceCache(ttl=settings.PRICE_CACHE_TTL)
@@ -0,0 +1,206 @@
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models.functions import Lower
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .models import Restaurant, MenuItem, Ingredient
+
+NUTRIENTS = ('calories', 'protein', 'carbohydrates', 'fat', 'fiber', 'sugar', 'sodium')
+MENU_ITEM_FIELDS = ('item_id', 'name', 'description', 'category', 'price', 'image_url', 'tags')
+EXPAND_OPTIONS = ('ingredients', 'nutrition')
+
+# Rows fetched per database round-trip and items serialized per streamed chunk
+MENU_CHUNK_SIZE = 500
+ITEMS_PER_CHUNK = 100
+
+
+def filter_name_prefix(queryset, prefix):
+    """
+    Filters restaurants whose name starts with prefix, ignoring case. On SQLite,
+    LOWER() only folds ASCII letters, so other letters have to match in case
+    ("Écl" finds "Éclair", "écl" does not).
+    """
+    if connections[queryset.db].vendor == 'sqlite':
+        prefix = ''.join(char.lower() if char.isascii() else char for char in prefix)
+    else:
+        prefix = prefix.lower()
+    # A range on LOWER(name) can use the expression index on SQLite and PostgreSQL alike,
+    # unlike ILIKE / LIKE; startswith only rechecks the rows within the range.
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return queryset.annotate(name_lower=Lower('name')).filter(
+        name_lower__gte=prefix, name_lower__lt=upper, name_lower__startswith=prefix,
+    )
+
+
+def _float_or_none(value):
+    return float(value) if value is not None else None
+
+
+def _menu_item_dict(row):
+    return {
+        "item_id": str(row['item_id']),
+        "name": row['name'],
+        "description": row['description'],
+        "category": row['category'],
+        "price": float(row['price']),
+        "image_url": row['image_url'],
+        "tags": row['tags'],
+    }
+
+
+def _ingredient_dict(row, prefix=''):
+    return {
+        "name": row[f'{prefix}name'],
+        "quantity": float(row[f'{prefix}quantity']),
+        "unit": row[f'{prefix}unit']
+    }
+
+
+def _nutrition_dict(row, prefix=''):
+    """
+    Serializes a NutritionFact row; a missing row yields all None values.
+    """
+    return {
+        nutrient: _float_or_none(row[f'{prefix}{nutrient}']) if row else None
+        for nutrient in NUTRIENTS
+    }
+
+
+def get_menu_item_detail(restaurant_id, item_id):
+    """
+    Returns a menu item with its ingredients and first nutrition fact flattened
+    into one dict, using two queries:
+        1. the item LEFT JOINed to its nutrition facts (restaurant scoped)
+        2. the item's ingredients
+    Raises Http404 when the restaurant or the item does not exist.
+    """
+    # Step 1: Item and its first NutritionFact (ordered by pk, like .first())
+    row = (
+        MenuItem.objects
+        .filter(restaurant_id=restaurant_id, item_id=item_id)
+        .order_by('nutrition_facts__nutrition_id')
+        .values(*MENU_ITEM_FIELDS, *(f'nutrition_facts__{nutrient}' for nutrient in NUTRIENTS))
+        .first()
+    )
+    if row is None:
+        # Only the error path pays for telling a missing restaurant from a missing item
+        get_object_or_404(Restaurant, restaurant_id=restaurant_id)
+        raise Http404("No MenuItem matches the given query.")
+
+    # Step 2: Ingredients
+    ingredients = Ingredient.objects.filter(item_id=item_id).values('name', 'quantity', 'unit')
+
+    data = _menu_item_dict(row)
+    data["ingredients"] = [_ingredient_dict(ingredient) for ingredient in ingredients]
+    data["nutrition_facts"] = _nutrition_dict(row, prefix='nutrition_facts__')
+    return data
+
+
+def parse_expand(value):
+    """
+    Parses the ?expand= query parameter into a set of EXPAND_OPTIONS.
+    Raises ValueError on unknown options.
+    """
+    if not value:
+        return set()
+    expand = {option.strip() for option in value.split(',') if option.strip()}
+    unknown = expand.difference(EXPAND_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown expand option(s): {', '.join(sorted(unknown))}")
+    return expand
+
+
+def _merge_lookup(rows):
+    """
+    Groups rows ordered by item_id and returns lookup(item_id) -> [rows].
+    lookup must be called with increasing item ids, which lets the menu be
+    merge-joined with its ingredients/nutrition facts without loading them all.
+    """
+    groups = groupby(rows, key=itemgetter('item_id'))
+    current = next(groups, None)
+
+    def lookup(item_id):
+        nonlocal current
+        while current is not None and current[0] < item_id:
+            current = next(groups, None)
+        if current is None or current[0] != item_id:
+            return []
+        group = list(current[1])
+        current = next(groups, None)
+        return group
+
+    return lookup
+
+
+def menu_item_rows(restaurant_id):
+    return MenuItem.objects.filter(restaurant_id=restaurant_id).order_by('item_id').values(*MENU_ITEM_FIELDS)
+
+
+# The ingredients and nutrition facts are read through the menu item, so they come in the
+# order of the (restaurant, item_id) index; ordering by their own item_id column needs a sort.
+
+def menu_ingredient_rows(restaurant_id):
+    return (
+        MenuItem.objects
+        .filter(restaurant_id=restaurant_id, ingredients__isnull=False)
+        .order_by('item_id')
+        .values('item_id', *(f'ingredients__{field}' for field in ('name', 'quantity', 'unit')))
+    )
+
+
+def menu_nutrition_rows(restaurant_id):
+    return (
+        MenuItem.objects
+        .filter(restaurant_id=restaurant_id, nutrition_facts__isnull=False)
+        .order_by('item_id', 'nutrition_facts__nutrition_id')
+        .values('item_id', *(f'nutrition_facts__{nutrient}' for nutrient in NUTRIENTS))
+    )
+
+
+def iter_menu_json(restaurant_id, expand=(), exclude=None):
+    """
+    Yields the {"menu_items": [...]} document of a restaurant as bytes chunks,
+    leaving out the items that exclude, a function of a list of item ids,
+    returns.
+
+    Items, ingredients and nutrition facts are each read with a single query
+    ordered by item_id and merge-joined while streaming, so a menu costs at most
+    three queries and constant memory regardless of its size. The queries walk
+    the (restaurant, item_id) index in order rather than sorting the menu.
+    """
+    items = menu_item_rows(restaurant_id).iterator(chunk_size=MENU_CHUNK_SIZE)
+    ingredients_for = nutrition_for = None
+    if 'ingredients' in expand:
+        ingredients_for = _merge_lookup(menu_ingredient_rows(restaurant_id).iterator(chunk_size=MENU_CHUNK_SIZE))
+    if 'nutrition' in expand:
+        nutrition_for = _merge_lookup(menu_nutrition_rows(restaurant_id).iterator(chunk_size=MENU_CHUNK_SIZE))
+
+    yield b'{"menu_items": ['
+    encoder = DjangoJSONEncoder()
+    batch = []
+    separator = ''
+    while rows := list(islice(items, MENU_CHUNK_SIZE)):
+        excluded = exclude([row['item_id'] for row in rows]) if exclude is not None else ()
+        for row in rows:
+            if row['item_id'] in excluded:
+                continue
+            data = _menu_item_dict(row)
+            if ingredients_for is not None:
+                data["ingredients"] = [
+                    _ingredient_dict(ingredient, prefix='ingredients__') for ingredient in ingredients_for(row['item_id'])
+                ]
+            if nutrition_for is not None:
+                facts = nutrition_for(row['item_id'])
+                data["nutrition_facts"] = _nutrition_dict(facts[0] if facts else None, prefix='nutrition_facts__')
+            batch.append(separator + encoder.encode(data))
+            separator = ', '
+            if len(batch) == ITEMS_PER_CHUNK:
+                yield ''.join(batch).encode()
+                batch = []
+    if batch:
+        yield ''.join(batch).encode()
+    yield b']}'
@@ -0,0 +1,105 @@
+"""
+Full-text search over menu item names, descriptions and ingredient names.
+
+The index is maintained by database triggers (see migration 0005_menu_search):
+an FTS5 table on SQLite and a tsvector column with a GIN index on PostgreSQL.
+Every word of the query must match, as a prefix ("chick" finds "chickpea"),
+after stemming ("cooking" finds "cooked"). Matches in the name rank above the
+description, which ranks above the ingredients.
+"""
+
+import re
+
+from django.db import connections, router
+
+from .models import MenuItem
+from .queries import MENU_ITEM_FIELDS, _menu_item_dict
+
+MAX_TERMS = 10
+
+SQLITE_SEARCH = """
+    SELECT d.item_id
+    FROM menu_search
+    JOIN menu_search_doc d ON d.id = menu_search.rowid
+    {restaurant_join}
+    WHERE menu_search MATCH %s
+    ORDER BY bm25(menu_search, 10.0, 4.0, 2.0), d.item_id
+    LIMIT %s OFFSET %s
+"""
+
+POSTGRESQL_SEARCH = """
+    SELECT s.item_id
+    FROM menu_search s
+    {restaurant_join}
+    CROSS JOIN to_tsquery('english', %s) query
+    WHERE s.document @@ query
+    ORDER BY ts_rank_cd(s.document, query, 32) DESC, s.item_id
+    LIMIT %s OFFSET %s
+"""
+
+
+def parse_terms(text):
+    """
+    Returns the words of a search query, which are all the syntax it supports.
+    """
+    return re.findall(r'\w+', (text or '').lower())[:MAX_TERMS]
+
+
+def search_items(terms, restaurant_id=None, offset=0, limit=20):
+    """
+    Returns the ids of the menu items matching every term, best match first.
+    """
+    connection = connections[router.db_for_read(MenuItem)]
+    item_id_field = MenuItem._meta.pk
+    if connection.vendor == 'sqlite':
+        sql = SQLITE_SEARCH
+        query = ' '.join(f'"{term}"*' for term in terms)
+        restaurant_join = "JOIN menu_menuitem m ON m.item_id = d.item_id AND m.restaurant_id = %s"
+    elif connection.vendor == 'postgresql':
+        sql = POSTGRESQL_SEARCH
+        query = ' & '.join(f'{term}:*' for term in terms)
+        restaurant_join = "JOIN menu_menuitem m ON m.item_id = s.item_id AND m.restaurant_id = %s"
+    else:
+        raise NotImplementedError(f"Menu search is not available on {connection.vendor}.")
+
+    params = []
+    if restaurant_id is not None:
+        params.append(MenuItem._meta.get_field('restaurant').get_db_prep_value(restaurant_id, connection))
+    else:
+        restaurant_join = ''
+    params += [query, limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(restaurant_join=restaurant_join), params)
+        return [item_id_field.to_python(item_id) for item_id, in cursor.fetchall()]
+
+
+def search_menu(terms, restaurant_id=None, offset=0, limit=20, exclude=None):
+    """
+    Returns (items, next_offset): the page of matching menu items, best match
+    first, leaving out the items that exclude, a function of a list of item
+    ids, returns, and the offset of the next page (None on the last one).
+    """
+    # Excluded items leave gaps, so more matches are fetched until the page is full
+    batch_size = limit + 1 if exclude is None else max(limit * 2, 100)
+    found = []  # (offset, item_id)
+    while len(found) <= limit:
+        batch = search_items(terms, restaurant_id, offset, batch_size)
+        excluded = exclude(batch) if exclude is not None else ()
+        found += [(offset + index, item_id) for index, item_id in enumerate(batch) if item_id not in excluded]
+        offset += len(batch)
+        if len(batch) < batch_size:
+            break
+    next_offset = found[limit - 1][0] + 1 if len(found) > limit else None
+    item_ids = [item_id for _, item_id in found[:limit]]
+
+    rows = {
+        row['item_id']: row
+        for row in MenuItem.objects.filter(item_id__in=item_ids).values(*MENU_ITEM_FIELDS, 'restaurant_id')
+    }
+    items = []
+    for item_id in item_ids:
+        # Deleted since the search, which ran outside of this query's snapshot
+        if item_id in rows:
+            items.append(dict(_menu_item_dict(rows[item_id]), restaurant_id=str(rows[item_id]['restaurant_id'])))
+    return items, next_offset
@@ -0,0 +1,62 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from nutrition_app.db_router import RESTAURANTS_SCOPE, pin_to_primary, restaurant_scope
+from .cache import menu_cache, restaurant_list_version
+from .models import Ingredient, MenuItem, NutritionFact, Restaurant
+from .nutrition_index import nutrition_index
+from .pricing import price_cache
+from .tags import sync_item_tags
+
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_changed(sender, instance, **kwargs):
+    # Pinned first, a reader that sees the new version must not read a lagging replica
+    pin_to_primary(RESTAURANTS_SCOPE, restaurant_scope(instance.restaurant_id))
+    restaurant_list_version.bump()
+
+
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurant_menu(sender, instance, **kwargs):
+    pin_to_primary(RESTAURANTS_SCOPE, restaurant_scope(instance.restaurant_id))
+    menu_cache.invalidate(instance.restaurant_id)
+    restaurant_list_version.bump()
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def invalidate_menu_item(sender, instance, **kwargs):
+    # Pinned first, a reader that sees the new menu version must not read a lagging replica
+    pin_to_primary(restaurant_scope(instance.restaurant_id))
+    menu_cache.invalidate(instance.restaurant_id)
+    nutrition_index.mark_changed([instance.item_id])
+    price_cache.invalidate(instance.item_id)
+
+
+@receiver(post_save, sender=MenuItem)
+def update_tag_index(sender, instance, raw=False, **kwargs):
+    # Deleted items lose their tags through the cascade
+    if not raw:
+        sync_item_tags(instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=NutritionFact)
+@receiver(post_delete, sender=NutritionFact)
+def update_nutrition_index(sender, instance, **kwargs):
+    nutrition_index.mark_changed([instance.item_id])
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=NutritionFact)
+@receiver(post_delete, sender=NutritionFact)
+def invalidate_menu_item_detail(sender, instance, **kwargs):
+    try:
+        restaurant_id = instance.item.restaurant_id
+    except MenuItem.DoesNotExist:
+        # The item itself is being deleted and invalidates the menu on its own.
+        return
+    pin_to_primary(restaurant_scope(restaurant_id))
+    menu_cache.invalidate(restaurant_id)
@@ -0,0 +1,73 @@
+"""
+Inverted index over MenuItem.tags.
+
+MenuItem.tags is free-form JSON, which the database cannot index. Every tag of
+an item is therefore also stored normalized ("Gluten Free" => "gluten-free")
+as a MenuItemTag row, so tag queries are index lookups on (tag, restaurant,
+item) instead of decoding the JSON of every row.
+"""
+
+import re
+
+from .models import MenuItemTag
+
+MAX_TAG_LENGTH = MenuItemTag._meta.get_field('tag').max_length
+
+
+def normalize_tag(tag):
+    return re.sub(r'[\s_]+', '-', tag.strip().lower())[:MAX_TAG_LENGTH]
+
+
+def normalize_tags(tags):
+    """
+    Returns the set of normalized tags of a MenuItem.tags value, ignoring non-strings.
+    """
+    if not isinstance(tags, list):
+        return set()
+    return {normalize_tag(tag) for tag in tags if isinstance(tag, str) and tag.strip()}
+
+
+def tag_rows(item):
+    """
+    Returns the unsaved MenuItemTag rows of a new item, for bulk inserts.
+    """
+    return [MenuItemTag(item=item, restaurant_id=item.restaurant_id, tag=tag) for tag in sorted(normalize_tags(item.tags))]
+
+
+def sync_item_tags(item):
+    """
+    Updates the MenuItemTag rows of a saved item to match its tags.
+    """
+    tags = normalize_tags(item.tags)
+    existing = set(MenuItemTag.objects.filter(item=item).values_list('tag', flat=True))
+    if existing - tags:
+        MenuItemTag.objects.filter(item=item, tag__in=existing - tags).delete()
+    if tags - existing:
+        MenuItemTag.objects.bulk_create([
+            MenuItemTag(item=item, restaurant_id=item.restaurant_id, tag=tag) for tag in sorted(tags - existing)
+        ])
+
+
+def parse_tags(value):
+    """
+    Parses a comma separated tag query parameter into normalized tags.
+    """
+    return normalize_tags((value or '').split(','))
+
+
+def filter_by_tags(items, all_tags=(), any_tags=(), no_tags=(), restaurant_id=None):
+    """
+    Filters a MenuItem queryset to the items having every tag of all_tags, at
+    least one of any_tags and none of no_tags. Each condition is a semi-join
+    on the tag index, so the database intersects the posting lists.
+    """
+    postings = MenuItemTag.objects.all()
+    if restaurant_id is not None:
+        postings = postings.filter(restaurant_id=restaurant_id)
+    for tag in all_tags:
+        items = items.filter(item_id__in=postings.filter(tag=tag).values('item_id'))
+    if any_tags:
+        items = items.filter(item_id__in=postings.filter(tag__in=any_tags).values('item_id'))
+    if no_tags:
+        items = items.exclude(item_id__in=postings.filter(tag__in=no_tags).values('item_id'))
+    return items
@@ -1,3 +1,813 @@
+import itertools
+import json
+import tempfile
+import uuid
+from decimal import Decimal
+from io import StringIO
+
+from unittest import skipUnless
+
+import numpy as np
+import redis
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from nutrition_app.testing import QueryPlanAssertions
+from users.authentication import issue_token
+from users.models import User
+
+from .cache import menu_cache, restaurant_list_version
+from .models import Restaurant, MenuItem, MenuItemTag, Ingredient, NutritionFact
+from .ingredients import ingredient_words, parse_ingredients
+from .meal_planner import best_combination
+from .nutrition_index import Columns, NutritionIndex, nutrition_index
+from .pricing import price_cache
+from .queries import NUTRIENTS, filter_name_prefix, menu_ingredient_rows, menu_item_rows, menu_nutrition_rows
+from .tags import filter_by_tags
+
+
+class MenuItemDetailTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.item = MenuItem.objects.create(
+            restaurant=self.restaurant, name="Falafel Wrap", category="Lunch", price="8.50", tags=["vegan"]
+        )
+        Ingredient.objects.create(item=self.item, name="Chickpeas", quantity="120", unit="g")
+        Ingredient.objects.create(item=self.item, name="Tahini", quantity="15", unit="g")
+        NutritionFact.objects.create(item=self.item, calories="540", protein="21.5", fat=None)
+
+    def detail_url(self, restaurant_id, item_id):
+        return f"/restaurants/{restaurant_id}/menu/{item_id}/"
+
+    def test_detail_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url(self.restaurant.restaurant_id, self.item.item_id))
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content)
+        self.assertEqual(data["name"], "Falafel Wrap")
+        self.assertEqual(data["price"], 8.5)
+        self.assertEqual(data["tags"], ["vegan"])
+        self.assertCountEqual([i["name"] for i in data["ingredients"]], ["Chickpeas", "Tahini"])
+        self.assertEqual(data["nutrition_facts"]["calories"], 540.0)
+        self.assertEqual(data["nutrition_facts"]["protein"], 21.5)
+        self.assertIsNone(data["nutrition_facts"]["fat"])
+
+    def test_detail_without_nutrition_facts(self):
+        self.item.nutrition_facts.all().delete()
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url(self.restaurant.restaurant_id, self.item.item_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(json.loads(response.content)["nutrition_facts"]["calories"])
+
+    def test_detail_not_found(self):
+        other = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Other")
+        response = self.client.get(self.detail_url(other.restaurant_id, self.item.item_id))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(self.detail_url(uuid.uuid4(), self.item.item_id))
+        self.assertEqual(response.status_code, 404)
+
+
+class MenuListExpandTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+
+    def add_items(self, count):
+        for n in range(count):
+            item = MenuItem.objects.create(
+                restaurant=self.restaurant, name=f"Bowl {n}", category="Lunch", price="9.00"
+            )
+            Ingredient.objects.create(item=item, name="Rice", quantity="150", unit="g")
+            Ingredient.objects.create(item=item, name="Tofu", quantity="80", unit="g")
+            if n % 2 == 0:
+                NutritionFact.objects.create(item=item, calories=400 + n, protein="25")
+
+    def get_menu(self, query=""):
+        response = self.client.get(f"/restaurants/{self.restaurant.restaurant_id}/menu{query}")
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_expanded_menu(self):
+        self.add_items(3)
+        response, content = self.get_menu("?expand=ingredients,nutrition")
+        self.assertEqual(response.status_code, 200)
+
+        items = json.loads(content)["menu_items"]
+        self.assertEqual(len(items), 3)
+        for item in items:
+            self.assertCountEqual([i["name"] for i in item["ingredients"]], ["Rice", "Tofu"])
+        calories = sorted(item["nutrition_facts"]["calories"] for item in items if item["nutrition_facts"]["calories"])
+        self.assertEqual(calories, [400.0, 402.0])
+
+    def test_expanded_menu_query_count_is_constant(self):
+        self.add_items(2)
+        with self.assertNumQueries(4):
+            self.get_menu("?expand=ingredients,nutrition")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_items(25)
+        with self.assertNumQueries(4):
+            response, content = self.get_menu("?expand=ingredients,nutrition")
+        self.assertEqual(len(json.loads(content)["menu_items"]), 27)
+
+    def test_plain_menu_has_no_expansions(self):
+        self.add_items(1)
+        response, content = self.get_menu()
+        item = json.loads(content)["menu_items"][0]
+        self.assertNotIn("ingredients", item)
+        self.assertNotIn("nutrition_facts", item)
+
+    def test_unknown_expand_option(self):
+        response, content = self.get_menu("?expand=reviews")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_restaurant(self):
+        response = self.client.get(f"/restaurants/{uuid.uuid4()}/menu?expand=nutrition")
+        self.assertEqual(response.status_code, 404)
+
+
+
+class MenuCacheTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.url = f"/restaurants/{self.restaurant.restaurant_id}/menu"
+        MenuItem.objects.create(restaurant=self.restaurant, name="Tofu Bowl", category="Lunch", price="9.00")
+        if menu_cache.version(self.restaurant.restaurant_id) is None:
+            self.skipTest("The menu cache needs Redis")
+
+    def names(self):
+        response = self.client.get(self.url)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return [item["name"] for item in json.loads(content)["menu_items"]]
+
+    def test_cache_hits_do_not_query(self):
+        self.assertEqual(self.names(), ["Tofu Bowl"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ["Tofu Bowl"])
+
+    def test_writes_invalidate_once_committed(self):
+        self.names()
+        version = menu_cache.version(self.restaurant.restaurant_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(restaurant=self.restaurant, name="Chili", category="Dinner", price="8.00")
+            # Until the commit, readers keep caching the committed menu under the old version
+            self.assertEqual(menu_cache.version(self.restaurant.restaurant_id), version)
+        self.assertEqual(menu_cache.version(self.restaurant.restaurant_id), version + 1)
+        self.assertEqual(sorted(self.names()), ["Chili", "Tofu Bowl"])
+
+    def test_stale_versions_are_never_served(self):
+        restaurant_id = self.restaurant.restaurant_id
+        version = menu_cache.version(restaurant_id)
+        menu_cache.set(menu_cache._payload_key(restaurant_id, version, "list:"), b'{"menu_items": []}')
+        self.assertEqual(self.names(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_cache.invalidate(restaurant_id)
+        self.assertEqual(self.names(), ["Tofu Bowl"])
+
+    def test_stats_are_for_admins(self):
+        self.assertIn(self.client.get("/restaurants/cache/stats").status_code, (401, 403))
+        admin = User.objects.create_superuser("admin@example.com", "Admin", "secret")
+        self.names()
+        response = self.client.get(
+            "/restaurants/cache/stats", HTTP_AUTHORIZATION=f"Bearer {issue_token(admin.user_id, 'access')}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()["misses"], 1)
+
+class MenuImportTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.url = f"/restaurants/{self.restaurant.restaurant_id}/menu/import"
+
+    def test_import_json_lines(self):
+        body = "\n".join([
+            json.dumps({"name": "Wrap", "category": "Lunch", "price": "8.50",
+                        "ingredients": [{"name": "Chickpeas", "quantity": 120, "unit": "g"}],
+                        "nutrition_facts": {"calories": 540}}),
+            json.dumps({"name": "Toast", "category": "Breakfast", "price": 4}),
+            json.dumps({"name": "Soup", "category": "Brunch", "price": "6"}),
+            "{not json",
+        ])
+        response = self.client.post(self.url, data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+
+        result = json.loads(response.content)
+        self.assertEqual(result["imported"], 2)
+        self.assertEqual(result["rejected"], 2)
+        self.assertEqual([e["row"] for e in result["errors"]], [3, 4])
+        self.assertEqual(MenuItem.objects.filter(restaurant=self.restaurant).count(), 2)
+        self.assertEqual(Ingredient.objects.get().name, "Chickpeas")
+        self.assertEqual(NutritionFact.objects.get().calories, 540)
+
+    def test_import_csv(self):
+        body = (
+            "name,category,price,tags,ingredients,calories,protein\n"
+            "Bowl,Dinner,11.00,vegan|gluten-free,Rice:150:g|Tofu:80:g,610,32\n"
+            "Fries,Snacks,3.50,,,,\n"
+        )
+        response = self.client.post(self.url, data=body, content_type="text/csv")
+        self.assertEqual(json.loads(response.content)["imported"], 2)
+
+        bowl = MenuItem.objects.get(name="Bowl")
+        self.assertEqual(bowl.tags, ["vegan", "gluten-free"])
+        self.assertEqual(bowl.ingredients.count(), 2)
+        self.assertEqual(bowl.nutrition_facts.get().protein, 32)
+        self.assertFalse(MenuItem.objects.get(name="Fries").nutrition_facts.exists())
+
+    def test_content_type_parameters_are_ignored(self):
+        body = "name,category,price\nFries,Snacks,3.50\n"
+        response = self.client.post(self.url, data=body, content_type="text/csv; charset=utf-8")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["imported"], 1)
+
+    def test_undecodable_line_stops_the_import(self):
+        body = b"\n".join([
+            json.dumps({"name": "Wrap", "category": "Lunch", "price": "8.50"}).encode(),
+            json.dumps({"name": "Cr\u00eape", "category": "Lunch", "price": "6"}, ensure_ascii=False).encode("latin-1"),
+            json.dumps({"name": "Toast", "category": "Breakfast", "price": 4}).encode(),
+        ])
+        response = self.client.post(self.url, data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 400)
+        result = json.loads(response.content)
+        self.assertEqual(result["error"], "Line 2 is not valid UTF-8.")
+        self.assertEqual(result["imported"], 1)
+        self.assertEqual(list(MenuItem.objects.values_list("name", flat=True)), ["Wrap"])
+
+    def test_import_batches_use_bulk_inserts(self):
+        body = "\n".join(
+            json.dumps({"name": f"Item {n}", "category": "Lunch", "price": "5",
+                        "ingredients": [{"name": "Salt", "quantity": 1}], "nutrition_facts": {"calories": 10}})
+            for n in range(50)
+        )
+        # Restaurant lookup, then one savepoint around a single insert per table
+        with self.assertNumQueries(1 + 5):
+            self.client.post(self.url, data=body, content_type="application/x-ndjson")
+        self.assertEqual(MenuItem.objects.count(), 50)
+
+    def test_unsupported_content_type(self):
+        response = self.client.post(self.url, data="{}", content_type="application/xml")
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_rejects_invalid_item(self):
+        url = f"/restaurants/{self.restaurant.restaurant_id}/menu"
+        response = self.client.post(url, data=json.dumps({"name": "Wrap", "price": "1"}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MenuItem.objects.exists())
+
+    def test_import_menu_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+            f.write(json.dumps({"name": "Wrap", "category": "Lunch", "price": "8.50"}) + "\n")
+            f.flush()
+            out = StringIO()
+            call_command("import_menu", str(self.restaurant.restaurant_id), f.name, stdout=out)
+        self.assertIn("Imported 1 items (0 rejected)", out.getvalue())
+        self.assertTrue(MenuItem.objects.filter(name="Wrap").exists())
+
+
+@skipUnless(connection.vendor == "sqlite", "Asserts on SQLite's EXPLAIN QUERY PLAN output")
+class MenuQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_menu_listing(self):
+        restaurant_id = uuid.uuid4()
+        for rows in (menu_item_rows, menu_ingredient_rows, menu_nutrition_rows):
+            with self.subTest(rows.__name__):
+                self.assertIndexSearch(rows(restaurant_id))
+
+    def test_restaurants_by_owner(self):
+        self.assertIndexSearch(Restaurant.objects.filter(owner_id=uuid.uuid4()))
+
+    def test_restaurant_listing_newest_first(self):
+        plan = Restaurant.objects.order_by("-created_at", "-restaurant_id").explain()
+        self.assertNotRegex(plan, r"TEMP B-TREE")
+
+    def test_items_by_tags(self):
+        plan = filter_by_tags(MenuItem.objects.all(), ["vegan", "spicy"], no_tags=["nuts"]).explain()
+        self.assertIn("menu_menuit_tag_f2df7e_idx", plan)
+        self.assertNotRegex(plan, r"SCAN menu_menuitemtag")
+
+    def test_restaurant_name_prefix(self):
+        self.assertIndexSearch(filter_name_prefix(Restaurant.objects.all(), "Gre"))
+
+
+class RestaurantListTests(TestCase):
+    def setUp(self):
+        owner = uuid.uuid4()
+        self.restaurants = [
+            Restaurant.objects.create(owner_id=owner, name=name)
+            for name in ("Green Bowl", "green garden", "Grill House", "Pasta Place", "Greek Corner")
+        ]
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        seen, cursor = [], ""
+        while True:
+            response = self.client.get("/restaurants/", {"limit": 2, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen += [restaurant["name"] for restaurant in data["restaurants"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, [restaurant.name for restaurant in reversed(self.restaurants)])
+
+    def test_name_prefix_search_ignores_case(self):
+        response = self.client.get("/restaurants/", {"q": "GREE"})
+        names = [restaurant["name"] for restaurant in response.json()["restaurants"]]
+        self.assertEqual(names, ["Greek Corner", "green garden", "Green Bowl"])
+
+    def test_name_prefix_with_non_ascii_letters(self):
+        Restaurant.objects.create(owner_id=uuid.uuid4(), name="Éclair Café")
+        for prefix in ("Écl", "ÉCL", "Éclair café"):
+            response = self.client.get("/restaurants/", {"q": prefix})
+            self.assertEqual([restaurant["name"] for restaurant in response.json()["restaurants"]], ["Éclair Café"])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get("/restaurants/", {"cursor": "garbage"}).status_code, 400)
+        self.assertEqual(self.client.get("/restaurants/", {"limit": "0"}).status_code, 400)
+
+    def test_unchanged_listing_is_not_modified(self):
+        if restaurant_list_version.get() is None:
+            self.skipTest("The ETag needs Redis")
+        etag = self.client.get("/restaurants/")["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/restaurants/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f"/restaurants/{self.restaurants[0].restaurant_id}/",
+                            data=json.dumps({"name": "Blue Bowl"}), content_type="application/json")
+        response = self.client.get("/restaurants/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class NutritionSearchTests(TestCase):
+    url = "/restaurants/nutrition/search"
+
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.other = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Pasta Place")
+        self.items = {}
+        for restaurant, name, category, calories, protein in (
+            (self.restaurant, "Chicken Bowl", "Lunch", 450, 38),
+            (self.restaurant, "Tofu Bowl", "Lunch", 420, 24),
+            (self.restaurant, "Steak Plate", "Dinner", 720, 52),
+            (self.other, "Protein Pasta", "Dinner", 480, 31),
+        ):
+            item = MenuItem.objects.create(restaurant=restaurant, name=name, category=category, price="9.50")
+            NutritionFact.objects.create(item=item, calories=calories, protein=protein)
+            self.items[name] = item
+        MenuItem.objects.create(restaurant=self.restaurant, name="Water", category="Snacks", price="1.00")
+        nutrition_index.clear()
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [item["name"] for item in response.json()["items"]]
+
+    def test_range_filters_and_sort(self):
+        self.assertEqual(self.search(calories_max=500, protein_min=30, sort="-protein"), ["Chicken Bowl", "Protein Pasta"])
+        self.assertEqual(self.search(sort="calories", limit=2, offset=1), ["Chicken Bowl", "Protein Pasta"])
+        # Items without nutrition facts never match a nutrient range and sort last
+        self.assertEqual(self.search(sort="-protein")[-1], "Water")
+        self.assertNotIn("Water", self.search(calories_max=10000))
+
+    def test_pages_of_tied_keys_cover_every_item_once(self):
+        for n in range(40):
+            item = MenuItem.objects.create(restaurant=self.other, name=f"Side {n}", category="Snacks", price="2.00")
+            if n % 2:
+                NutritionFact.objects.create(item=item, calories=100 * (n % 3))
+        nutrition_index.clear()
+        for sort in ("calories", "-calories", "price"):
+            seen = []
+            for offset in range(0, 45, 7):
+                data = self.client.get(self.url, {"sort": sort, "limit": 7, "offset": offset}).json()
+                seen += [item["item_id"] for item in data["items"]]
+            self.assertEqual(len(seen), 45)
+            self.assertEqual(len(set(seen)), 45)
+
+    def test_restaurant_and_category_filters(self):
+        self.assertEqual(self.search(restaurant_id=str(self.other.restaurant_id)), ["Protein Pasta"])
+        self.assertEqual(self.search(category="Dinner", sort="protein"), ["Protein Pasta", "Steak Plate"])
+
+    def test_searches_do_not_query_once_built(self):
+        self.search()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"protein_min": 30})
+        self.assertEqual(response.json()["total"], 3)
+        item = response.json()["items"][0]
+        self.assertEqual(set(item["nutrition_facts"]), set(NUTRIENTS))
+
+    def test_writes_update_the_index(self):
+        self.search()
+        with self.captureOnCommitCallbacks(execute=True):
+            fact = NutritionFact.objects.get(item=self.items["Tofu Bowl"])
+            fact.protein = 35
+            fact.save()
+            self.items["Steak Plate"].delete()
+        self.assertEqual(self.search(protein_min=30, sort="protein"), ["Protein Pasta", "Tofu Bowl", "Chicken Bowl"])
+
+    def test_other_workers_apply_changes_from_the_stream(self):
+        worker = NutritionIndex(nutrition_index.client, sync_interval=0)
+        worker.sync()
+        if worker.last_change is None:
+            self.skipTest("The change log needs Redis")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items["Chicken Bowl"].delete()
+        total, _ = worker.search({"protein": (30, None)})
+        self.assertEqual(total, 2)
+
+    def test_invalid_parameters(self):
+        for params in ({"protein_min": "lots"}, {"sort": "taste"}, {"offset": "-1"}, {"restaurant_id": "nope"}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class TagSearchTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.other = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Pasta Place")
+        self.items = {}
+        for restaurant, name, tags in (
+            (self.restaurant, "Tofu Bowl", ["Vegan", "Gluten Free", "spicy"]),
+            (self.restaurant, "Falafel Wrap", ["vegan", "contains_nuts"]),
+            (self.restaurant, "Chicken Bowl", ["gluten-free"]),
+            (self.other, "Vegan Pasta", ["vegan"]),
+        ):
+            self.items[name] = MenuItem.objects.create(
+                restaurant=restaurant, name=name, category="Lunch", price="9.50", tags=tags
+            )
+
+    def names(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        ids = response.json()["item_ids"]
+        return sorted(name for name, item in self.items.items() if str(item.item_id) in ids)
+
+    def test_tags_are_normalized(self):
+        self.assertEqual(
+            sorted(MenuItemTag.objects.filter(item=self.items["Tofu Bowl"]).values_list("tag", flat=True)),
+            ["gluten-free", "spicy", "vegan"],
+        )
+
+    def test_and_or_not_queries(self):
+        url = "/restaurants/tags/items"
+        self.assertEqual(self.names(url, all="vegan"), ["Falafel Wrap", "Tofu Bowl", "Vegan Pasta"])
+        self.assertEqual(self.names(url, all="VEGAN,gluten free"), ["Tofu Bowl"])
+        self.assertEqual(self.names(url, any="spicy,contains-nuts"), ["Falafel Wrap", "Tofu Bowl"])
+        self.assertEqual(self.names(url, all="vegan", none="contains-nuts,spicy"), ["Vegan Pasta"])
+        self.assertEqual(self.client.get(url, {"none": "vegan"}).status_code, 400)
+
+    def test_restaurant_scope(self):
+        url = f"/restaurants/{self.restaurant.restaurant_id}/menu/tags"
+        self.assertEqual(self.names(url, all="vegan"), ["Falafel Wrap", "Tofu Bowl"])
+
+    def test_pages_follow_the_cursor(self):
+        seen, cursor = [], ""
+        while True:
+            data = self.client.get("/restaurants/tags/items", {"any": "vegan,gluten-free", "limit": 2, "cursor": cursor}).json()
+            seen += data["item_ids"]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+
+    def test_writes_update_the_index(self):
+        item = self.items["Chicken Bowl"]
+        url = f"/restaurants/{self.restaurant.restaurant_id}/menu/{item.item_id}/"
+        self.client.put(url, data=json.dumps({"tags": ["spicy"]}), content_type="application/json")
+        self.assertEqual(self.names("/restaurants/tags/items", all="spicy"), ["Chicken Bowl", "Tofu Bowl"])
+        self.assertEqual(self.names("/restaurants/tags/items", all="gluten-free"), ["Tofu Bowl"])
+
+        self.client.delete(url)
+        self.assertFalse(MenuItemTag.objects.filter(item_id=item.item_id).exists())
+
+        response = self.client.post(
+            f"/restaurants/{self.restaurant.restaurant_id}/menu",
+            data=json.dumps({"name": "Chili", "category": "Dinner", "price": "8.00", "tags": ["Spicy"]}),
+            content_type="application/json",
+        )
+        self.assertTrue(MenuItemTag.objects.filter(item_id=response.json()["item_id"], tag="spicy").exists())
+
+
+
+class MenuSearchTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.other = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Pasta Place")
+        self.items = {}
+        for restaurant, name, description, ingredients in (
+            (self.restaurant, "Chickpea Curry", "Slow cooked with spices", ["Chickpeas", "Tomato"]),
+            (self.restaurant, "Falafel Wrap", "Crispy falafel, tahini", ["Chickpeas", "Flatbread"]),
+            (self.restaurant, "Spicy Tofu", "Tofu in a chili sauce", ["Tofu", "Chili"]),
+            (self.other, "Pasta e Ceci", "Pasta with chickpeas", ["Pasta", "Chickpeas"]),
+        ):
+            item = MenuItem.objects.create(
+                restaurant=restaurant, name=name, description=description, category="Dinner", price="9.00"
+            )
+            for ingredient in ingredients:
+                Ingredient.objects.create(item=item, name=ingredient, quantity=100, unit="g")
+            self.items[name] = item
+
+    def search(self, url="/restaurants/search", **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [item["name"] for item in response.json()["items"]]
+
+    def test_prefix_and_stemmed_matches(self):
+        self.assertEqual(self.search(q="chick")[0], "Chickpea Curry")
+        self.assertEqual(sorted(self.search(q="chick")), ["Chickpea Curry", "Falafel Wrap", "Pasta e Ceci"])
+        self.assertEqual(self.search(q="cooking spice"), ["Chickpea Curry"])
+        self.assertEqual(self.search(q="CHILI tofu"), ["Spicy Tofu"])
+        self.assertEqual(self.search(q="sushi"), [])
+        self.assertEqual(self.client.get("/restaurants/search", {"q": " ?! "}).status_code, 400)
+
+    def test_name_ranks_above_description_and_ingredients(self):
+        self.assertEqual(self.search(q="pasta"), ["Pasta e Ceci"])
+        self.assertEqual(self.search(q="falafel")[0], "Falafel Wrap")
+        self.assertEqual(self.search(q="chickpea")[0], "Chickpea Curry")
+
+    def test_restaurant_scope_and_pages(self):
+        url = f"/restaurants/{self.restaurant.restaurant_id}/menu/search"
+        self.assertEqual(sorted(self.search(url, q="chickpeas")), ["Chickpea Curry", "Falafel Wrap"])
+
+        data = self.client.get("/restaurants/search", {"q": "chickpeas", "limit": 2}).json()
+        self.assertEqual(data["next_offset"], 2)
+        rest = self.client.get("/restaurants/search", {"q": "chickpeas", "limit": 2, "offset": 2}).json()
+        self.assertIsNone(rest["next_offset"])
+        names = [item["name"] for item in data["items"] + rest["items"]]
+        self.assertEqual(sorted(names), ["Chickpea Curry", "Falafel Wrap", "Pasta e Ceci"])
+
+    def test_writes_update_the_index(self):
+        item = self.items["Spicy Tofu"]
+        item.name = "Mapo Tofu"
+        item.save()
+        self.assertEqual(self.search(q="mapo"), ["Mapo Tofu"])
+
+        Ingredient.objects.filter(item=item, name="Chili").update(name="Sichuan pepper")
+        self.assertEqual(self.search(q="sichuan"), ["Mapo Tofu"])
+        Ingredient.objects.filter(item=item).delete()
+        self.assertEqual(self.search(q="sichuan"), [])
+
+        item.delete()
+        self.assertEqual(self.search(q="tofu"), [])
+
+        body = json.dumps({"name": "Hummus Plate", "category": "Lunch", "price": "7.00",
+                           "ingredients": [{"name": "Tahini", "quantity": 20, "unit": "g"}]})
+        self.client.post(f"/restaurants/{self.restaurant.restaurant_id}/menu/import",
+                         data=body, content_type="application/x-ndjson")
+        self.assertEqual(sorted(self.search(q="tahini")), ["Falafel Wrap", "Hummus Plate"])
+
+
+class IngredientExclusionTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.items = {}
+        for name, ingredients in (
+            ("Satay Bowl", ["Rice", "Roasted Peanuts"]),
+            ("Peanut Butter Toast", ["Bread", "peanut butter"]),
+            ("Shrimp Bowl", ["Rice", "Shrimp"]),
+            ("Tofu Bowl", ["Rice", "Tofu", "Butter"]),
+            ("Green Salad", []),
+        ):
+            item = MenuItem.objects.create(restaurant=self.restaurant, name=name, category="Lunch", price="9.00")
+            for ingredient in ingredients:
+                Ingredient.objects.create(item=item, name=ingredient, quantity=100, unit="g")
+            NutritionFact.objects.create(item=item, calories=500)
+            self.items[name] = item
+        self.menu_url = f"/restaurants/{self.restaurant.restaurant_id}/menu"
+        nutrition_index.clear()
+
+    def menu(self, exclude):
+        response = self.client.get(self.menu_url, {"exclude_ingredients": exclude})
+        self.assertEqual(response.status_code, 200)
+        return sorted(item["name"] for item in json.loads(b"".join(response.streaming_content))["menu_items"])
+
+    def test_ingredient_words(self):
+        self.assertEqual(ingredient_words("Roasted Peanuts"), ("roasted", "peanut"))
+        self.assertEqual(ingredient_words("Cherry tomatoes, berries & hummus"), ("cherry", "tomato", "berry", "hummus"))
+        self.assertEqual(parse_ingredients(" Peanuts, ,peanut,shellfish"), [("peanut",), ("shellfish",)])
+
+    def test_menu_excludes_items_with_the_ingredients(self):
+        self.assertEqual(self.menu("peanuts"), ["Green Salad", "Shrimp Bowl", "Tofu Bowl"])
+        self.assertEqual(self.menu("Peanut, shrimp"), ["Green Salad", "Tofu Bowl"])
+        # Every word of an excluded ingredient has to be among the item's ingredients
+        self.assertEqual(self.menu("peanut butter"), ["Green Salad", "Satay Bowl", "Shrimp Bowl", "Tofu Bowl"])
+        self.assertEqual(len(self.menu("")), 5)
+
+    def test_search_endpoints_exclude_items(self):
+        response = self.client.get("/restaurants/nutrition/search", {"exclude_ingredients": "rice"})
+        self.assertEqual(sorted(item["name"] for item in response.json()["items"]), ["Green Salad", "Peanut Butter Toast"])
+
+        names, offset = [], 0
+        while offset is not None:
+            data = self.client.get(
+                "/restaurants/search", {"q": "bowl", "exclude_ingredients": "peanut", "limit": 1, "offset": offset}
+            ).json()
+            names += [item["name"] for item in data["items"]]
+            offset = data["next_offset"]
+        self.assertEqual(sorted(names), ["Shrimp Bowl", "Tofu Bowl"])
+
+    def test_writes_update_the_postings(self):
+        self.menu("shrimp")
+        with self.captureOnCommitCallbacks(execute=True):
+            shrimp = Ingredient.objects.get(name="Shrimp")
+            shrimp.name = "Prawns"
+            shrimp.save()
+            Ingredient.objects.create(item=self.items["Green Salad"], name="Shrimp", quantity=50, unit="g")
+            Ingredient.objects.create(item=self.items["Tofu Bowl"], name="Peanuts", quantity=20, unit="g")
+        self.assertEqual(self.menu("shrimp"), ["Peanut Butter Toast", "Satay Bowl", "Shrimp Bowl", "Tofu Bowl"])
+        self.assertEqual(self.menu("prawn"), ["Green Salad", "Peanut Butter Toast", "Satay Bowl", "Tofu Bowl"])
+        self.assertEqual(self.menu("peanut"), ["Green Salad", "Shrimp Bowl"])
+
+    def test_items_not_indexed_yet_are_excluded(self):
+        self.menu("shrimp")
+        if not nutrition_index.complete:
+            self.skipTest("Without the change log the ingredients are read from the database")
+        # Committed by another worker, whose change has not been applied here yet
+        MenuItem.objects.create(restaurant=self.restaurant, name="Fries", category="Snacks", price="3.00")
+        self.assertNotIn("Fries", self.menu("shrimp"))
+
+    def test_exclusions_use_the_database_without_the_change_log(self):
+        unavailable = redis.Redis(unix_socket_path="/nonexistent/redis.sock")
+        worker = NutritionIndex(nutrition_index.client, sync_interval=0)
+        worker.sync()
+        # Added by another worker, and the change log becomes unreadable before it is applied
+        Ingredient.objects.create(item=self.items["Green Salad"], name="Shrimp", quantity=50, unit="g")
+        worker.client = unavailable
+        total, rows = worker.search(exclude_ingredients=[("shrimp",)])
+        self.assertEqual(sorted(row["name"] for row in rows), ["Peanut Butter Toast", "Satay Bowl", "Tofu Bowl"])
+        item_ids = [item.item_id for item in self.items.values()]
+        self.assertEqual(
+            worker.items_containing([("shrimp",)], item_ids),
+            {self.items["Green Salad"].item_id, self.items["Shrimp Bowl"].item_id},
+        )
+        # Built without Redis
+        worker = NutritionIndex(unavailable, sync_interval=0)
+        table, _ = worker.select(("calories",), exclude_ingredients=[("rice",)])
+        self.assertEqual(len(table), 2)
+
+    def test_unannounced_changes_are_announced_again(self):
+        worker = NutritionIndex(nutrition_index.client, sync_interval=0)
+        worker.sync()
+        if worker.last_change is None:
+            self.skipTest("The change log needs Redis")
+        writer = NutritionIndex(redis.Redis(unix_socket_path="/nonexistent/redis.sock"), sync_interval=0)
+        writer.sync()
+        Ingredient.objects.create(item=self.items["Green Salad"], name="Shrimp", quantity=50, unit="g")
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.mark_changed([self.items["Green Salad"].item_id])
+        self.assertEqual(writer.unpublished, {self.items["Green Salad"].item_id.hex})
+        # Redis is back
+        writer.client = nutrition_index.client
+        writer.sync()
+        self.assertEqual(writer.unpublished, set())
+        _, rows = worker.search(exclude_ingredients=[("shrimp",)])
+        self.assertNotIn("Green Salad", [row["name"] for row in rows])
+
+    def test_compaction_keeps_the_postings(self):
+        columns = Columns.from_rows(
+            [(f"{n:032x}", "r", f"Item {n}", "Lunch", 1.0, (None,) * len(NUTRIENTS)) for n in range(4)],
+            [(f"{n:032x}", ("rice", "egg") if n % 2 else ("rice",)) for n in range(4)],
+        )
+        columns.remove(f"{1:032x}")
+        columns = NutritionIndex._compacted(columns)
+        self.assertEqual([columns.item_ids[row] for row in np.flatnonzero(columns.containing([("egg",)]))], [f"{3:032x}"])
+        self.assertEqual(int(columns.containing([("rice",)]).sum()), 3)
+
+
+class MealPlanTests(TestCase):
+    url = "/restaurants/meals/plan"
+
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.other = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Pasta Place")
+        for restaurant, name, price, calories, protein, carbohydrates, fat in (
+            (self.restaurant, "Chicken Breast", "9.00", 300, 50, 0, 8),
+            (self.restaurant, "Rice", "3.00", 300, 6, 65, 1),
+            (self.restaurant, "Salmon", "14.00", 400, 40, 0, 25),
+            (self.restaurant, "Brownie", "4.00", 450, 5, 60, 22),
+            (self.restaurant, "Salad", "5.00", 100, 3, 10, 5),
+            (self.other, "Lasagna", "12.00", 800, 45, 70, 35),
+        ):
+            item = MenuItem.objects.create(restaurant=restaurant, name=name, category="Lunch", price=price)
+            NutritionFact.objects.create(
+                item=item, calories=calories, protein=protein, carbohydrates=carbohydrates, fat=fat
+            )
+        self.salmon = MenuItem.objects.get(name="Salmon")
+        Ingredient.objects.create(item=self.salmon, name="Salmon", quantity=150, unit="g")
+        MenuItem.objects.create(restaurant=self.restaurant, name="Water", category="Snacks", price="1.00")
+        nutrition_index.clear()
+
+    def plan(self, **params):
+        params.setdefault("restaurant_id", str(self.restaurant.restaurant_id))
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_plans_the_closest_meal(self):
+        plan = self.plan(calories=700, protein=60, carbohydrates=75, fat=15)
+        self.assertEqual(sorted(item["name"] for item in plan["items"]), ["Chicken Breast", "Rice", "Salad"])
+        self.assertEqual(plan["totals"], {"calories": 700, "protein": 59, "carbohydrates": 75, "fat": 14, "price": 17})
+        self.assertTrue(plan["exhaustive"])
+
+        plan = self.plan(calories=700, protein=60, carbohydrates=75, fat=15, max_items=2)
+        self.assertEqual(sorted(item["name"] for item in plan["items"]), ["Chicken Breast", "Rice"])
+
+    def test_budget_exclusions_and_restaurants(self):
+        plan = self.plan(calories=700, protein=45, fat=26)
+        self.assertEqual(sorted(item["name"] for item in plan["items"]), ["Rice", "Salmon"])
+        plan = self.plan(calories=700, protein=45, fat=26, budget=15)
+        self.assertNotIn("Salmon", [item["name"] for item in plan["items"]])
+        self.assertLessEqual(plan["totals"]["price"], 15)
+        plan = self.plan(calories=700, protein=45, fat=26, exclude_ingredients="salmon")
+        self.assertNotIn("Salmon", [item["name"] for item in plan["items"]])
+
+        plan = self.plan(calories=800, protein=45, restaurant_id=f"{self.restaurant.restaurant_id},{self.other.restaurant_id}")
+        self.assertEqual([item["name"] for item in plan["items"]], ["Lasagna"])
+        self.assertEqual(self.plan(calories=800, budget=1)["items"], [])
+
+    def test_matches_an_exhaustive_search(self):
+        rng = np.random.default_rng(7)
+        values = rng.uniform([100, 0, 0, 0], [1200, 80, 150, 60], size=(30, 4))
+        prices = rng.uniform(2, 20, 30)
+        goal = np.array([900, 50, 100, 30])
+        best = min(
+            (combo for size in (1, 2, 3) for combo in itertools.combinations(range(30), size)
+             if prices[list(combo)].sum() <= 25),
+            key=lambda combo: (((values[list(combo)].sum(axis=0) - goal) / goal) ** 2).sum(),
+        )
+        indices, _, exhaustive, _ = best_combination(values, prices, goal, budget=25, max_items=3, beam_width=4096)
+        self.assertEqual(indices, best)
+        self.assertTrue(exhaustive)
+        indices, _, exhaustive, _ = best_combination(values, prices, goal, budget=25, max_items=3, beam_width=4)
+        self.assertFalse(exhaustive)
+
+    def test_invalid_parameters(self):
+        restaurant_id = str(self.restaurant.restaurant_id)
+        for params in (
+            {"restaurant_id": restaurant_id},
+            {"calories": "lots", "restaurant_id": restaurant_id},
+            {"calories": "-5", "restaurant_id": restaurant_id},
+            {"calories": "500", "max_items": "9", "restaurant_id": restaurant_id},
+            {"calories": "500", "restaurant_id": "nope"},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        response = self.client.get(self.url, {"calories": "500"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "restaurant_id is required."})
+
+class PriceCacheTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.items = [
+            MenuItem.objects.create(restaurant=self.restaurant, name=f"Item {n}", category="Lunch", price=f"{n}.50")
+            for n in range(5)
+        ]
+        self.ids = [str(item.item_id) for item in self.items]
+        price_cache.clear()
+
+    def test_prices_are_batch_loaded_then_cached(self):
+        with self.assertNumQueries(1):
+            prices = price_cache.get_prices(self.ids + ["not-a-uuid", str(uuid.uuid4())])
+        self.assertEqual(prices[self.ids[3]], Decimal("3.50"))
+        self.assertIsNone(prices["not-a-uuid"])
+        with self.assertNumQueries(0):
+            price_cache.get_prices(self.ids)
+
+    def test_get_cached_only_answers_when_every_price_is_cached(self):
+        self.assertIsNone(price_cache.get_cached(self.ids))
+        price_cache.get_prices(self.ids[:2])
+        with self.assertNumQueries(0):
+            self.assertIsNone(price_cache.get_cached(self.ids))
+            self.assertEqual(price_cache.get_cached(self.ids[:2]), {self.ids[0]: Decimal("0.50"), self.ids[1]: Decimal("1.50")})
+
+    def test_put_invalidates_the_price(self):
+        price_cache.get_prices(self.ids)
+        url = f"/restaurants/{self.restaurant.restaurant_id}/menu/{self.ids[0]}/"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(url, data=json.dumps({"price": "12.00"}), content_type="application/json")
+        self.assertEqual(price_cache.get_prices(self.ids[:1])[self.ids[0]], Decimal("12.00"))
+
+    def test_any_write_invalidates_the_price_once_committed(self):
+        price_cache.get_prices(self.ids)
+        item = self.items[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            item.price = "7.00"
+            item.save()
+            # Not committed yet
+            self.assertEqual(price_cache.get_cached(self.ids[1:2]), {self.ids[1]: Decimal("1.50")})
+        self.assertIsNone(price_cache.get_cached(self.ids[1:2]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[2].delete()
+        self.assertIsNone(price_cache.get_prices(self.ids[2:3])[self.ids[2]])
+
+    def test_item_ids_are_normalized(self):
+        price_cache.get_prices(self.ids[:1])
+        with self.assertNumQueries(0):
+            prices = price_cache.get_prices([self.ids[0].upper(), uuid.UUID(self.ids[0]).hex])
+        self.assertEqual(set(prices.values()), {Decimal("0.50")})
+        with self.captureOnCommitCallbacks(execute=True):
+            price_cache.invalidate(self.ids[0].upper())
+        self.assertIsNone(price_cache.get_cached(self.ids[:1]))
@@ -1,5 +1,8 @@
 from django.urls import path
-from .views import RestaurantView, MenuItemView
+from .views import (
+    RestaurantView, MenuItemView, MenuImportView, MenuCacheStatsView, NutritionSearchView, NutritionIndexStatsView,
+    TagSearchView, MenuSearchView, MealPlanView,
+)
 
 urlpatterns = [
     # Restaurant-related endpoints
@@ -8,4 +11,13 @@ urlpatterns = [
     # MenuItem-related endpoints
     path('<uuid:id>/menu', MenuItemView.as_view(), name='menu-item-list'),  # List all menu items for a specific restaurant
     path('<uuid:id>/menu/<uuid:item_id>/', MenuItemView.as_view(), name='menu-item-detail'),  # Get, update, or delete a specific menu item
+    path('<uuid:id>/menu/tags', TagSearchView.as_view(), name='menu-item-tags'),  # Item ids of a restaurant by tag query
+    path('<uuid:id>/menu/search', MenuSearchView.as_view(), name='menu-search'),  # Full-text search of a restaurant's menu
+    path('<uuid:id>/menu/import', MenuImportView.as_view(), name='menu-import'),  # Bulk import menu items (JSON Lines or CSV)
+    path('cache/stats', MenuCacheStatsView.as_view(), name='menu-cache-stats'),  # Menu cache counters of this worker
+    path('tags/items', TagSearchView.as_view(), name='tag-search'),  # Item ids of all restaurants by tag query
+    path('search', MenuSearchView.as_view(), name='menu-search-all'),  # Full-text search of all menus
+    path('nutrition/search', NutritionSearchView.as_view(), name='nutrition-search'),  # Items of all restaurants by nutrient ranges
+    path('meals/plan', MealPlanView.as_view(), name='meal-plan'),  # Items closest to nutrition targets within a budget
+    path('nutrition/stats', NutritionIndexStatsView.as_view(), name='nutrition-index-stats'),  # Nutrition index size of this worker
 ]
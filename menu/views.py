@@ -1,14 +1,31 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, parse_header_parameters
 from rest_framework.views import APIView
 from django.utils.decorators import method_decorator
 import json
 import uuid
-from .models import Restaurant, MenuItem, Ingredient, NutritionFact
+from functools import partial
+from nutrition_app.db_router import (
+    RESTAURANTS_SCOPE, iterate_on, pin_to_primary, read_from_replica, restaurant_scope,
+)
+from nutrition_app.pagination import paginate_keyset, parse_limit
+from .cache import menu_cache, restaurant_list_version
+from .models import Restaurant, MenuItem
+from .nutrition_index import COLUMNS as NUTRITION_COLUMNS, nutrition_index
+from .importer import decode_lines, import_menu, parse_menu_item, read_rows, save_menu_items
+from .ingredients import parse_ingredients
+from .meal_planner import TARGETS as MEAL_TARGETS, plan_meal
+from .queries import filter_name_prefix, get_menu_item_detail, iter_menu_json, parse_expand
+from .search import parse_terms, search_menu
 from .serializers import MenuItemSerializer
+from .tags import filter_by_tags, parse_tags
 from rest_framework import viewsets
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 from django.views.decorators.csrf import csrf_exempt
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
@@ -48,15 +65,61 @@ class RestaurantView(APIView):
 
     def get(self, request, id=None):
         if id:
-            restaurant = get_object_or_404(Restaurant, restaurant_id=id)
+            with read_from_replica(restaurant_scope(id)):
+                restaurant = get_object_or_404(Restaurant, restaurant_id=id)
             return JsonResponse({
                 "restaurant_id": str(restaurant.restaurant_id),
                 "name": restaurant.name,
                 "description": restaurant.description
             })
-        else:
-            restaurants = list(Restaurant.objects.values('restaurant_id', 'name', 'description'))
-            return JsonResponse(restaurants, safe=False)
+        return self.list_restaurants(request)
+
+    def list_restaurants(self, request):
+        """
+        GET /restaurants/
+        Lists restaurants newest first, one page at a time.
+        Query parameters:
+            limit: restaurants per page (default 20, max 100)
+            cursor: next_cursor of the previous page
+            q: only restaurants whose name starts with q, ignoring case (of ASCII letters only on SQLite)
+        The ETag is the version of the restaurant table, so a matching
+        If-None-Match is answered with 304 before any query runs.
+        """
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+        except ValueError:
+            return JsonResponse({"error": "limit must be a positive integer."}, status=400)
+
+        # Step 1: Answer revalidations from the table version alone
+        version = restaurant_list_version.get()
+        etag = f'"restaurants-{version}"' if version is not None else None
+        if etag is not None:
+            if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+            if etag in if_none_match or '*' in if_none_match:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+        # Step 2: Fetch one page
+        restaurants = Restaurant.objects.all()
+        prefix = request.GET.get('q', '').strip()
+        if prefix:
+            restaurants = filter_name_prefix(restaurants, prefix)
+        with read_from_replica(RESTAURANTS_SCOPE):
+            try:
+                page, next_cursor = paginate_keyset(
+                    restaurants.values('restaurant_id', 'name', 'description', 'created_at'),
+                    fields=('created_at', 'restaurant_id'),
+                    cursor=request.GET.get('cursor'),
+                    limit=limit,
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+        response = JsonResponse({"restaurants": page, "next_cursor": next_cursor})
+        if etag is not None:
+            response['ETag'] = etag
+        return response
 
     def put(self, request, id):
         data = json.loads(request.body)
@@ -85,43 +148,15 @@ class MenuItemView(APIView):
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON format"}, status=400)
 
-        # Step 1: Create Menu Item
-        menu_item = MenuItem.objects.create(
-            item_id=uuid.uuid4(),
-            restaurant=restaurant,
-            name=data['name'],
-            description=data.get('description', ''),
-            category=data['category'],
-            price=data['price'],
-            image_url=data.get('image_url', ''),
-            tags=data.get('tags', [])
-        )
-
-        # Step 2: Add Ingredients
-        ingredients = data.get('ingredients', [])
-        for ingredient in ingredients:
-            Ingredient.objects.create(
-                ingredient_id=uuid.uuid4(),
-                item=menu_item,
-                name=ingredient['name'],
-                quantity=ingredient['quantity'],
-                unit=ingredient.get('unit', '')
-            )
-
-        # Step 3: Add Nutrition Facts
-        nutrition_data = data.get('nutrition_facts', {})
-        if nutrition_data:
-            NutritionFact.objects.create(
-                nutrition_id=uuid.uuid4(),
-                item=menu_item,
-                calories=nutrition_data.get('calories'),
-                protein=nutrition_data.get('protein'),
-                carbohydrates=nutrition_data.get('carbohydrates'),
-                fat=nutrition_data.get('fat'),
-                fiber=nutrition_data.get('fiber'),
-                sugar=nutrition_data.get('sugar'),
-                sodium=nutrition_data.get('sodium')
-            )
+        # Validate the item, its ingredients and nutrition facts, then insert them together
+        try:
+            rows = parse_menu_item(restaurant, data)
+        except ValidationError as e:
+            return JsonResponse({"error": ' '.join(e.messages)}, status=400)
+        save_menu_items([rows])
+        pin_to_primary(restaurant_scope(restaurant.restaurant_id))
+        menu_cache.invalidate(restaurant.restaurant_id)
+        menu_item = rows.item
 
         return JsonResponse({
             "message": "Menu item added successfully.",
@@ -129,56 +164,35 @@ class MenuItemView(APIView):
         }, status=201)
 
     def get(self, request, id, item_id=None):
-        restaurant = get_object_or_404(Restaurant, restaurant_id=id)
-
-        #  Get ALL items (Without ingredients & nutrition_facts)
+        #  Get ALL items, optionally with ?expand=ingredients,nutrition embedded per item.
+        #  Served from the menu cache, or streamed (and cached when small enough).
+        #  ?exclude_ingredients=peanut,shellfish leaves out items with those ingredients (never cached).
         if item_id is None:
-            menu_items = MenuItem.objects.filter(restaurant=restaurant)
-            data = [
-                {
-                    "item_id": str(item.item_id),
-                    "name": item.name,
-                    "description": item.description,
-                    "category": item.category,
-                    "price": float(item.price),
-                    "image_url": item.image_url,
-                    "tags": item.tags,
-                }
-                for item in menu_items
-            ]
-            return JsonResponse({"menu_items": data}, status=200)
-
-        item = get_object_or_404(MenuItem.objects.prefetch_related("ingredients", "nutrition_facts"), item_id=item_id, restaurant=restaurant)
-
-        # Fetch first NutritionFact (if exists)
-        nutrition = item.nutrition_facts.first()
-
-        data = {
-            "item_id": str(item.item_id),
-            "name": item.name,
-            "description": item.description,
-            "category": item.category,
-            "price": float(item.price),
-            "image_url": item.image_url,
-            "tags": item.tags,
-            "ingredients": [
-                {
-                    "name": ingredient.name,
-                    "quantity": float(ingredient.quantity),
-                    "unit": ingredient.unit
-                } for ingredient in item.ingredients.all()
-            ],
-            "nutrition_facts": {
-                "calories": float(nutrition.calories) if nutrition else None,
-                "protein": float(nutrition.protein) if nutrition else None,
-                "carbohydrates": float(nutrition.carbohydrates) if nutrition else None,
-                "fat": float(nutrition.fat) if nutrition else None,
-                "fiber": float(nutrition.fiber) if nutrition else None,
-                "sugar": float(nutrition.sugar) if nutrition else None,
-                "sodium": float(nutrition.sodium) if nutrition else None
-            }
-        }
+            try:
+                expand = parse_expand(request.GET.get('expand'))
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            excluded = parse_ingredients(request.GET.get('exclude_ingredients'))
+
+            cache_key = 'list:' + ','.join(sorted(expand))
+            payload = menu_cache.get(id, cache_key) if not excluded else None
+            if payload is not None:
+                return HttpResponse(payload, content_type='application/json', status=200)
 
+            # The body is streamed after the view returns, so it keeps reading from the same database
+            with read_from_replica(restaurant_scope(id)) as alias:
+                get_object_or_404(Restaurant, restaurant_id=id)
+            if excluded:
+                exclude = partial(nutrition_index.items_containing, excluded)
+                chunks = iterate_on(alias, iter_menu_json(id, expand, exclude))
+            else:
+                chunks = iterate_on(alias, iter_menu_json(id, expand))
+                chunks = menu_cache.stream_through(id, cache_key, chunks)
+            return StreamingHttpResponse(chunks, content_type='application/json', status=200)
+
+        # Single item with ingredients & nutrition_facts, in two queries
+        with read_from_replica(restaurant_scope(id)):
+            data = get_menu_item_detail(id, item_id)
         return JsonResponse(data, status=200)
 
     def put(self, request, id, item_id):
@@ -202,3 +216,240 @@ class MenuItemView(APIView):
         menu_item.delete()
         return JsonResponse({"message": "Menu item deleted successfully."}, status=status.HTTP_200_OK)
 
+
+class MenuImportView(APIView):
+    """
+    POST /restaurants/{id}/menu/import
+    Bulk imports menu items from a JSON Lines (application/x-ndjson) or CSV (text/csv) body.
+    Each JSON line uses the same format as the menu item POST body.
+    """
+    CONTENT_TYPES = {
+        'application/x-ndjson': 'jsonl',
+        'application/jsonl': 'jsonl',
+        'application/json-lines': 'jsonl',
+        'text/csv': 'csv',
+    }
+
+    @method_decorator(csrf_exempt)  # Disable CSRF
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def post(self, request, id):
+        restaurant = get_object_or_404(Restaurant, restaurant_id=id)
+
+        # DRF keeps the parameters, e.g. "text/csv; charset=utf-8"
+        media_type, _ = parse_header_parameters(request.content_type)
+        fmt = self.CONTENT_TYPES.get(media_type)
+        if fmt is None:
+            return JsonResponse({"error": f"Unsupported content type. Use one of {', '.join(self.CONTENT_TYPES)}."}, status=400)
+        if request.stream is None:
+            return JsonResponse({"error": "Request body is empty."}, status=400)
+
+        # Read the body line by line rather than loading it into memory at once
+        result = import_menu(restaurant, read_rows(decode_lines(request.stream), fmt))
+        # The rows before an undecodable line are imported, the rest is not
+        return JsonResponse(result, status=400 if "error" in result else status.HTTP_200_OK)
+
+
+class MenuCacheStatsView(APIView):
+    """
+    GET /restaurants/cache/stats
+    Returns the hit/miss/eviction counters of this worker's menu cache.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return JsonResponse(menu_cache.stats(), status=status.HTTP_200_OK)
+
+
+class NutritionSearchView(APIView):
+    """
+    GET /restaurants/nutrition/search
+    Searches the menu items of every restaurant by nutrition, answered from
+    this worker's in-memory nutrition index (see menu.nutrition_index).
+    Query parameters:
+        <column>_min / <column>_max: inclusive bounds, for calories, protein,
+            carbohydrates, fat, fiber, sugar, sodium and price
+        restaurant_id: only items of these restaurants (comma separated)
+        category: only items of this category
+        exclude_ingredients: leave out items with any of these ingredients (comma separated)
+        sort: column to sort by, prefixed with "-" for descending
+        limit: items per page (default 20, max 100)
+        offset: items to skip
+    """
+    def get(self, request):
+        # Step 1: Parse the filters
+        ranges = {}
+        try:
+            for column in NUTRITION_COLUMNS:
+                minimum, maximum = (request.GET.get(f'{column}_{bound}') or None for bound in ('min', 'max'))
+                if minimum is not None or maximum is not None:
+                    ranges[column] = (
+                        float(minimum) if minimum is not None else None,
+                        float(maximum) if maximum is not None else None,
+                    )
+        except ValueError:
+            return JsonResponse({"error": "Nutrition and price bounds must be numbers."}, status=400)
+
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+            offset = int(request.GET.get('offset') or 0)
+            if offset < 0:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({"error": "limit and offset must be positive integers."}, status=400)
+
+        sort = request.GET.get('sort') or None
+        descending = sort is not None and sort.startswith('-')
+        if sort is not None:
+            sort = sort.lstrip('-')
+            if sort not in NUTRITION_COLUMNS:
+                return JsonResponse({"error": f"sort must be one of {', '.join(NUTRITION_COLUMNS)}."}, status=400)
+
+        restaurant_ids = None
+        if request.GET.get('restaurant_id'):
+            try:
+                restaurant_ids = [str(uuid.UUID(value.strip())) for value in request.GET['restaurant_id'].split(',')]
+            except ValueError:
+                return JsonResponse({"error": "restaurant_id must be a comma separated list of UUIDs."}, status=400)
+
+        # Step 2: Search the index
+        total, items = nutrition_index.search(
+            ranges, restaurant_ids=restaurant_ids, category=request.GET.get('category') or None,
+            sort=sort, descending=descending, offset=offset, limit=limit,
+            exclude_ingredients=parse_ingredients(request.GET.get('exclude_ingredients')),
+        )
+        return JsonResponse({"total": total, "offset": offset, "limit": limit, "items": items}, status=status.HTTP_200_OK)
+
+
+class NutritionIndexStatsView(APIView):
+    """
+    GET /restaurants/nutrition/stats
+    Returns the size and rebuild counters of this worker's nutrition index.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return JsonResponse(nutrition_index.stats(), status=status.HTTP_200_OK)
+
+
+class TagSearchView(APIView):
+    """
+    GET /restaurants/tags/items
+    GET /restaurants/{id}/menu/tags
+    Returns the ids of the menu items matching a tag query, across all
+    restaurants or within one, answered from the tag index (see menu.tags).
+    Query parameters (comma separated, matched case-insensitively):
+        all: items having every one of these tags
+        any: items having at least one of these tags
+        none: items having none of these tags
+        limit: item ids per page (default 20, max 100)
+        cursor: next_cursor of the previous page
+    """
+    def get(self, request, id=None):
+        all_tags, any_tags, no_tags = (parse_tags(request.GET.get(param)) for param in ('all', 'any', 'none'))
+        if not all_tags and not any_tags:
+            return JsonResponse({"error": "Provide tags in all or any."}, status=400)
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+        except ValueError:
+            return JsonResponse({"error": "limit must be a positive integer."}, status=400)
+
+        items = MenuItem.objects.all()
+        if id is not None:
+            items = items.filter(restaurant_id=id)
+        items = filter_by_tags(items, all_tags, any_tags, no_tags, restaurant_id=id)
+
+        with read_from_replica(*([restaurant_scope(id)] if id is not None else [])):
+            try:
+                page, next_cursor = paginate_keyset(
+                    items.values('item_id'), fields=('item_id',), cursor=request.GET.get('cursor'), limit=limit,
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse(
+            {"item_ids": [str(row['item_id']) for row in page], "next_cursor": next_cursor}, status=status.HTTP_200_OK
+        )
+
+
+class MenuSearchView(APIView):
+    """
+    GET /restaurants/search
+    GET /restaurants/{id}/menu/search
+    Full-text search of menu item names, descriptions and ingredients, across
+    all restaurants or within one (see menu.search).
+    Query parameters:
+        q: words that must all match, the last letters of each may be left out
+        exclude_ingredients: leave out items with any of these ingredients (comma separated)
+        limit: items per page (default 20, max 100)
+        offset: items to skip
+    """
+    def get(self, request, id=None):
+        # Step 1: Parse the query
+        terms = parse_terms(request.GET.get('q'))
+        if not terms:
+            return JsonResponse({"error": "Provide words to search for in q."}, status=400)
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+            offset = int(request.GET.get('offset') or 0)
+            if offset < 0:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({"error": "limit and offset must be positive integers."}, status=400)
+
+        excluded = parse_ingredients(request.GET.get('exclude_ingredients'))
+        exclude = partial(nutrition_index.items_containing, excluded) if excluded else None
+
+        # Step 2: Search the index
+        with read_from_replica(*([restaurant_scope(id)] if id is not None else [])):
+            items, next_offset = search_menu(terms, restaurant_id=id, offset=offset, limit=limit, exclude=exclude)
+        return JsonResponse({"items": items, "next_offset": next_offset}, status=status.HTTP_200_OK)
+
+
+class MealPlanView(APIView):
+    """
+    GET /restaurants/meals/plan
+    Returns the combination of menu items closest to nutrition targets, within
+    a budget, answered from this worker's nutrition index (see menu.meal_planner).
+    Query parameters:
+        calories, protein, carbohydrates, fat: targets, at least one of them
+        budget: most the meal may cost
+        restaurant_id: plan with the items of these restaurants (comma separated), required
+        max_items: most items in the meal (default 3)
+        exclude_ingredients: leave out items with any of these ingredients (comma separated)
+    """
+    def get(self, request):
+        # Step 1: Parse the targets
+        try:
+            targets = {
+                nutrient: float(request.GET[nutrient]) for nutrient in MEAL_TARGETS if request.GET.get(nutrient)
+            }
+            budget = float(request.GET['budget']) if request.GET.get('budget') else None
+        except ValueError:
+            return JsonResponse({"error": "Targets and budget must be numbers."}, status=400)
+        if not targets:
+            return JsonResponse({"error": f"Provide at least one target of {', '.join(MEAL_TARGETS)}."}, status=400)
+        if any(target <= 0 for target in targets.values()) or (budget is not None and budget <= 0):
+            return JsonResponse({"error": "Targets and budget must be positive."}, status=400)
+
+        max_items_limit = settings.MEAL_PLANNER['MAX_ITEMS']
+        try:
+            max_items = int(request.GET.get('max_items') or 3)
+            if not 1 <= max_items <= max_items_limit:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({"error": f"max_items must be between 1 and {max_items_limit}."}, status=400)
+
+        if not request.GET.get('restaurant_id'):
+            return JsonResponse({"error": "restaurant_id is required."}, status=400)
+        try:
+            restaurant_ids = [str(uuid.UUID(value.strip())) for value in request.GET['restaurant_id'].split(',')]
+        except ValueError:
+            return JsonResponse({"error": "restaurant_id must be a comma separated list of UUIDs."}, status=400)
+
+        # Step 2: Search the index
+        plan = plan_meal(
+            targets, budget=budget, max_items=max_items, restaurant_ids=restaurant_ids,
+            exclude_ingredients=parse_ingredients(request.GET.get('exclude_ingredients')),
+        )
+        return JsonResponse(plan, status=status.HTTP_200_OK)
@@ -0,0 +1,147 @@
+"""
+Read replica routing.
+
+Writes always go to the primary ('default'). Reads go to the primary too,
+unless a view opts in with read_from_replica(), which picks one replica alias
+round-robin for the whole block. Its queries all go to that replica, but they
+run in autocommit, so a later query of the block may see more of the
+replication stream than an earlier one.
+
+Replicas lag behind the primary, so writes pin the scope they touched
+(e.g. "user:{id}" after an order, "restaurant:{id}" after a menu change) to
+the primary for READ_REPLICAS['PIN_SECONDS'] once the transaction commits.
+Pins live in Redis (db:pin:{scope}) and are shared by every worker; while
+Redis is unavailable reads stay on the primary.
+"""
+
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from nutrition_app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Alias chosen by the innermost read_from_replica() block, None outside of one
+_replica = ContextVar('replica', default=None)
+
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+
+def replica_aliases():
+    return settings.READ_REPLICAS['ALIASES']
+
+
+# Scopes pinned by writes and checked by reads
+RESTAURANTS_SCOPE = 'restaurants'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def restaurant_scope(restaurant_id):
+    return f'restaurant:{restaurant_id}'
+
+
+def pin_key(scope):
+    return f'db:pin:{scope}'
+
+
+def pin_to_primary(*scopes):
+    """
+    Sends reads of the given scopes to the primary for PIN_SECONDS after the
+    current transaction commits (or right away outside of a transaction).
+    """
+    if not replica_aliases():
+        return
+
+    def pin():
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for scope in scopes:
+                pipe.setex(pin_key(scope), settings.READ_REPLICAS['PIN_SECONDS'], 1)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Cannot pin %s to the primary database", ', '.join(scopes))
+
+    transaction.on_commit(pin)
+
+
+def is_pinned(scopes):
+    if not scopes:
+        return False
+    try:
+        return any(get_redis().mget([pin_key(scope) for scope in scopes]))
+    except redis.RedisError:
+        # A recent write could not be ruled out
+        return True
+
+
+def choose_replica(*scopes):
+    """
+    Returns the next replica alias, or None when the primary has to serve the read.
+    """
+    aliases = replica_aliases()
+    if not aliases or is_pinned(scopes):
+        return None
+    with _counter_lock:
+        index = next(_counter)
+    return aliases[index % len(aliases)]
+
+
+@contextmanager
+def read_from_replica(*scopes):
+    """
+    Routes the reads of the block to a replica unless one of the scopes was written recently.
+    Yields the chosen alias, or None for the primary. The reads share the replica, not a transaction.
+    """
+    alias = choose_replica(*scopes)
+    token = _replica.set(alias)
+    try:
+        yield alias
+    finally:
+        _replica.reset(token)
+
+
+def iterate_on(alias, iterable):
+    """
+    Consumes a lazy iterable (e.g. a streamed response body) with its reads routed to alias.
+    """
+    iterator = iter(iterable)
+    while True:
+        token = _replica.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _replica.reset(token)
+        yield chunk
+
+
+class ReplicaRouter:
+    """
+    Listed in DATABASE_ROUTERS. Replicas are read-only copies of the primary,
+    they get their schema through replication rather than migrate.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for instances that were loaded from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
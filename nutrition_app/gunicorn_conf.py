@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration for production.
+
+    gunicorn -c python:nutrition_app.gunicorn_conf nutrition_app.wsgi
+
+Every value can be overridden through the environment, e.g. from the systemd
+unit. Set GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker and serve
+nutrition_app.asgi to run the async views under uvicorn workers.
+"""
+
+import multiprocessing
+import os
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# One process per core: with Redis and SQLite local, views spend most of their
+# time in Python, so more processes than cores only adds context switches (see
+# README). The threads cover the time spent waiting on I/O.
+workers = int(os.environ.get('GUNICORN_WORKERS', cores))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+
+# Import Django once in the master and fork the workers from it, which starts
+# them faster and shares the imported code between them
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Requests in flight get graceful_timeout seconds to finish on reload or stop
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so slow leaks cannot build up, jittered so they do not restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+def post_fork(server, worker):
+    # Connections opened while preloading must not be shared by the forked workers
+    from django.db import connections
+    connections.close_all()
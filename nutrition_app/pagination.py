@@ -0,0 +1,94 @@
+"""
+Keyset (cursor) pagination shared by the list endpoints.
+
+Pages are read with WHERE (a, b) < (last_a, last_b) ORDER BY a DESC, b DESC
+LIMIT n, so every page costs the same index range scan no matter how deep
+the client has paged, unlike OFFSET pagination.
+"""
+
+import base64
+import datetime
+import json
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """
+    Parses the ?limit= query parameter. Raises ValueError when invalid.
+    """
+    if value in (None, ''):
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer.")
+    return min(limit, maximum)
+
+
+def parse_datetime_param(value):
+    """
+    Parses an ISO datetime, or a date meaning its midnight, into an aware
+    datetime for range filters. Returns None when invalid.
+    """
+    try:
+        bound = parse_datetime(value)
+        if bound is None:
+            day = parse_date(value)
+            bound = datetime.datetime.combine(day, datetime.time()) if day else None
+    except ValueError:
+        return None
+    if bound is not None and timezone.is_naive(bound):
+        bound = timezone.make_aware(bound)
+    return bound
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps([str(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(cursor, model, fields):
+    """
+    Decodes a cursor into the python values of the given model fields.
+    Raises ValueError when the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def paginate_keyset(queryset, fields, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    Returns (rows, next_cursor) for the page after `cursor`, ordered by `fields`
+    descending. The last field must be unique (the primary key) to break ties.
+    Rows may be model instances or .values() dicts containing the fields;
+    next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by(*(f'-{field}' for field in fields))
+
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, fields)
+        # Lexicographic (f1, f2, ...) < (v1, v2, ...)
+        after = Q()
+        for i, field in enumerate(fields):
+            equal = {fields[j]: values[j] for j in range(i)}
+            after |= Q(**equal, **{f'{field}__lt': values[i]})
+        queryset = queryset.filter(after)
+
+    # One extra row tells whether there is a next page
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    get = last.get if isinstance(last, dict) else lambda field: getattr(last, field)
+    return rows, encode_cursor(get(field) for field in fields)
@@ -0,0 +1,202 @@
+"""
+Shared Redis clients for every app that talks to Redis.
+
+Clients are created lazily from settings.REDIS and share one blocking
+connection pool per decode mode, so each worker holds at most MAX_CONNECTIONS
+sockets and waits POOL_TIMEOUT seconds for a free one instead of opening more.
+Every command and pipeline is timed into per-command latency metrics.
+
+Async views use get_async_redis(). Async connections belong to an event loop,
+so each loop gets its own client and pool with the same limits; an ASGI
+worker runs a single loop and therefore a single pool.
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.client import Pipeline
+from redis.retry import Retry
+
+
+class CommandMetrics:
+    """
+    Per-command call counts, errors and latencies of this worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def record(self, command, seconds, failed=False):
+        with self._lock:
+            stats = self._commands.get(command)
+            if stats is None:
+                stats = self._commands[command] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            stats["calls"] += 1
+            stats["errors"] += int(failed)
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                command: {
+                    **stats,
+                    "total_ms": round(stats["total_ms"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 3),
+                }
+                for command, stats in self._commands.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+
+
+metrics = CommandMetrics()
+
+
+class _Timed:
+    def __init__(self, command):
+        self.command = command
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics.record(self.command, time.perf_counter() - self.started, failed=exc_type is not None)
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        command = "MULTI" if self.transaction else "PIPELINE"
+        with _Timed(command):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        with _Timed(str(args[0]).upper()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncInstrumentedPipeline(AsyncPipeline):
+    async def execute(self, raise_on_error=True):
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        with _Timed(command):
+            return await super().execute(raise_on_error)
+
+
+class AsyncInstrumentedRedis(redis.asyncio.Redis):
+    async def execute_command(self, *args, **options):
+        with _Timed(str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncInstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _pool_kwargs(decode_responses, is_async=False):
+    config = settings.REDIS
+    retry_class = AsyncRetry if is_async else Retry
+    kwargs = {
+        "db": config['DB'],
+        "password": config.get('PASSWORD'),
+        "max_connections": config['MAX_CONNECTIONS'],
+        "timeout": config['POOL_TIMEOUT'],
+        "socket_timeout": config['SOCKET_TIMEOUT'],
+        "health_check_interval": config['HEALTH_CHECK_INTERVAL'],
+        "retry": retry_class(ExponentialBackoff(cap=0.1, base=0.01), config['RETRIES']),
+        "decode_responses": decode_responses,
+    }
+    if config.get('UNIX_SOCKET_PATH'):
+        connection_class = (redis.asyncio if is_async else redis).UnixDomainSocketConnection
+        kwargs.update(connection_class=connection_class, path=config['UNIX_SOCKET_PATH'])
+    else:
+        kwargs.update(
+            host=config['HOST'],
+            port=config['PORT'],
+            socket_connect_timeout=config['SOCKET_CONNECT_TIMEOUT'],
+        )
+    return kwargs
+
+
+def get_redis(decode_responses=True):
+    """
+    Returns the shared client of this process. decode_responses=False returns
+    a client for raw bytes values, backed by its own pool.
+    """
+    client = _clients.get(decode_responses)
+    if client is None:
+        with _lock:
+            client = _clients.get(decode_responses)
+            if client is None:
+                pool = redis.BlockingConnectionPool(**_pool_kwargs(decode_responses))
+                client = _clients[decode_responses] = InstrumentedRedis(connection_pool=pool)
+    return client
+
+
+def create_redis(decode_responses=True, **options):
+    """
+    Returns a new client with a pool of its own, for long blocking commands
+    that would hold a shared connection or outlast SOCKET_TIMEOUT. options
+    override the pool settings, e.g. socket_timeout.
+    """
+    pool = redis.BlockingConnectionPool(**{**_pool_kwargs(decode_responses), **options})
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_async_redis(decode_responses=True):
+    """
+    Returns the async client of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    client = clients.get(decode_responses)
+    if client is None:
+        pool = redis.asyncio.BlockingConnectionPool(**_pool_kwargs(decode_responses, is_async=True))
+        client = clients[decode_responses] = AsyncInstrumentedRedis(connection_pool=pool)
+    return client
+
+
+def check_health():
+    """
+    Pings Redis and returns its status, round-trip latency, pool usage and
+    the command metrics of this worker.
+    """
+    client = get_redis()
+    started = time.perf_counter()
+    try:
+        client.ping()
+        health = {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 3)}
+    except redis.RedisError as e:
+        health = {"status": "unavailable", "error": str(e)}
+
+    health["pools"] = {
+        "text" if decode else "bytes": {
+            "max_connections": pool_client.connection_pool.max_connections,
+            "open_connections": len(getattr(pool_client.connection_pool, '_connections', ())),
+        }
+        for decode, pool_client in list(_clients.items())
+    }
+    health["commands"] = metrics.snapshot()
+    return health
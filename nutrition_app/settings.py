@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import copy
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,13 +26,23 @@ STATIC_ROOT = "/home/ubuntu/app/nutrition-app/static/"
 SECRET_KEY = 'django-insecure-(svdn=3ge=0^2licp&#r^myk6gfry01*)x*o9=s043pr@vph=e'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Set DJANGO_DEBUG=1 for local development with runserver
+DEBUG = os.environ.get('DJANGO_DEBUG', '0') == '1'
 
 ALLOWED_HOSTS = ["18.118.149.210", "nutrition.com", "www.nutrition.com", "127.0.0.1"]
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Mail is queued in Redis and sent by `manage.py mail_worker`, see users.mail_queue
+EMAIL_BACKEND = 'users.mail_queue.QueuedEmailBackend'
+MAIL_QUEUE = {
+    # How the worker sends, e.g. django.core.mail.backends.console.EmailBackend locally
+    'DELIVERY_BACKEND': os.environ.get('MAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'),
+    'MAX_ATTEMPTS': 5,  # Failed sends before a message is moved to mail:dead
+    'RETRY_DELAY': 30,  # Seconds before the first retry, doubled on every further failure
+    'MAX_RETRY_DELAY': 3600,
+}
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', BASE_DIR / 'sent_mail')  # Used by the file delivery backend
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587  # 587 for TLS, 465 for SSL
 EMAIL_USE_TLS = True  # Use TLS for secure connection
@@ -96,6 +108,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',  # For session-based auth
         'rest_framework.authentication.TokenAuthentication',  # For token-based auth
+        'users.authentication.JWTAuthentication',  # Tokens issued by users.views.LoginView
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -144,11 +157,130 @@ WSGI_APPLICATION = 'nutrition_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql uses PostgreSQL (requires psycopg), otherwise the SQLite file is used
+
+if os.environ.get('DB_ENGINE', 'sqlite3') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'nutrition'),
+            'USER': os.environ.get('DB_USER', 'nutrition'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),  # Seconds a worker keeps its connection
+            'CONN_HEALTH_CHECKS': True,  # Reconnect instead of failing a request on a connection the server closed
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL') == '1':
+        # psycopg's connection pool (requires psycopg[pool]) replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),  # Seconds to wait for a free connection
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the write lock before "database is locked"
+                'timeout': float(os.environ.get('DB_BUSY_TIMEOUT', 20)),
+                # Take the write lock when a transaction starts, a deferred transaction that
+                # later needs it fails immediately instead of waiting for the timeout
+                'transaction_mode': 'IMMEDIATE',
+                # Safe in WAL mode, which migration menu.0006_sqlite_wal sets once in the database file
+                'init_command': 'PRAGMA synchronous=NORMAL;',
+            },
+        }
     }
+
+# Read replicas, see nutrition_app.db_router
+# DB_REPLICAS is a comma separated list of replica hosts (PostgreSQL) or files (SQLite),
+# configured like the primary under the aliases replica_1, replica_2, ...
+
+for index, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    replica = copy.deepcopy(DATABASES['default'])
+    replica['HOST' if replica['ENGINE'] == 'django.db.backends.postgresql' else 'NAME'] = location.strip()
+    replica['TEST'] = {'MIRROR': 'default'}  # Tests read their own writes from the test database
+    DATABASES[f'replica_{index}'] = replica
+
+DATABASE_ROUTERS = ['nutrition_app.db_router.ReplicaRouter']
+
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],  # Used round-robin by read_from_replica()
+    'PIN_SECONDS': int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5)),  # Reads after a write stay on the primary, keep above the replication lag
+}
+
+
+# Redis
+# Shared by every app through nutrition_app.redis_client.get_redis()
+
+REDIS = {
+    'HOST': os.environ.get('REDIS_HOST', 'localhost'),
+    'PORT': int(os.environ.get('REDIS_PORT', 6379)),
+    'DB': int(os.environ.get('REDIS_DB', 0)),
+    'PASSWORD': os.environ.get('REDIS_PASSWORD') or None,
+    'UNIX_SOCKET_PATH': os.environ.get('REDIS_UNIX_SOCKET_PATH') or None,  # Used instead of HOST/PORT when set
+    'MAX_CONNECTIONS': int(os.environ.get('REDIS_MAX_CONNECTIONS', 50)),  # Per worker process and decode mode
+    'POOL_TIMEOUT': float(os.environ.get('REDIS_POOL_TIMEOUT', 5)),  # Seconds to wait for a free connection
+    'SOCKET_TIMEOUT': float(os.environ.get('REDIS_SOCKET_TIMEOUT', 1)),
+    'SOCKET_CONNECT_TIMEOUT': float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', 1)),
+    'HEALTH_CHECK_INTERVAL': int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30)),  # PING idle connections before reuse
+    'RETRIES': int(os.environ.get('REDIS_RETRIES', 1)),
+}
+
+
+# Menu cache
+# Serialized menus are cached per restaurant in a local LRU backed by Redis.
+
+MENU_CACHE = {
+    'MAX_ENTRIES': 1024,  # Payloads kept in the in-process LRU
+    'TTL': 3600,  # Seconds a payload lives in Redis
+    'MAX_PAYLOAD_BYTES': 1024 * 1024,  # Larger menus are streamed without being cached
+}
+
+# Per worker NumPy index behind /restaurants/nutrition/search, see menu.nutrition_index
+NUTRITION_INDEX = {
+    'SYNC_INTERVAL': 1.0,  # Seconds between checks for menu changes made by other workers
+    'MAX_AGE': 3600,  # Seconds before the index is rebuilt from the database
+    'CHANGELOG_LENGTH': 100000,  # Changes kept in Redis, a worker further behind rebuilds
+}
+
+# Search limits of /restaurants/meals/plan, see menu.meal_planner
+MEAL_PLANNER = {
+    'BEAM_WIDTH': 16,  # Partial meals kept per level by the first search, each further search keeps four times more
+    'TIME_BUDGET': 0.08,  # Seconds after which the best meal found so far is returned
+    'MAX_ITEMS': 5,  # Largest max_items a request may ask for
+}
+
+# Seconds a worker keeps menu item prices for showing carts, checkout reads them from the database
+PRICE_CACHE_TTL = 60
+
+# Users resolved by users.authentication.JWTAuthentication
+USER_CACHE = {
+    'TTL': 300,  # Seconds a user is kept in Redis
+    'LOCAL_TTL': 30,  # Seconds a worker keeps a user, bounds how long other workers see stale profiles
+    'MAX_ENTRIES': 10000,  # Users kept in the in-process LRU
+}
+
+# Email verification OTPs, see users.otp
+OTP = {
+    'BACKEND': os.environ.get('OTP_BACKEND', 'redis'),  # 'redis', or 'db' for the OTPVerification table
+    'TTL': 300,  # Seconds an OTP is valid
+    'MAX_ATTEMPTS': 5,  # Wrong codes before the OTP is burned
+}
+
+# Checkout retries (Idempotency-Key header) and per-cart checkout lock
+CHECKOUT_IDEMPOTENCY = {
+    'TTL': 600,  # Seconds a placed order's response is replayed to retries
+    'LOCK_TIMEOUT': 30,  # Seconds before a crashed checkout releases the cart lock
+    'LOCK_WAIT': 10,  # Seconds a concurrent checkout waits for the lock before a 409
 }
 
 
@@ -170,6 +302,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing, see users.hashing
+PASSWORD_HASHERS = [
+    'users.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+PASSWORD_HASHING = {
+    # Changing this rehashes passwords on their next login
+    'PBKDF2_ITERATIONS': int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 1_000_000)),
+    'WORKERS': int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),  # Pool processes per web worker, 0 hashes on the request thread
+    'MAX_QUEUE': int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 16)),  # Hashes waiting for a pool process before 503s
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -0,0 +1,14 @@
+"""
+Helpers shared by the test suites of the apps.
+"""
+
+
+class QueryPlanAssertions:
+    """
+    TestCase mixin asserting on SQLite's EXPLAIN QUERY PLAN output.
+    """
+
+    def assertIndexSearch(self, queryset):
+        plan = queryset.explain()
+        self.assertIn("SEARCH", plan)
+        self.assertNotRegex(plan, r"\bSCAN\b|TEMP B-TREE")
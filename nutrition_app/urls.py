@@ -1,11 +1,14 @@
 from django.contrib import admin
 from django.urls import include, path, re_path
 from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect
+from django.http import JsonResponse
+from nutrition_app.redis_client import check_health
 from users.models import User
 
 
@@ -43,6 +46,19 @@ urlpatterns = [
 def swagger_access(request):
     return redirect('schema-swagger-ui')
 
+# Redis health check. Admins also get the pool usage and command latencies of the serving
+# worker, like the other stats endpoints; anyone else (e.g. a load balancer) only the status.
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def redis_health(request):
+    health = check_health()
+    status = 200 if health["status"] == "ok" else 503
+    if not permissions.IsAdminUser().has_permission(request, None):
+        health = {"status": health["status"]}
+    return JsonResponse(health, status=status)
+
 urlpatterns += [
     path('swagger-access/', swagger_access, name='swagger-access'),
+    path('health/redis', redis_health, name='redis-health'),
 ]
@@ -0,0 +1,124 @@
+"""
+Cart service backed by Redis.
+
+Cart table - Redis hash per user: cart:{user_id} => { item_id: quantity }
+The hash expires CART_TTL seconds after the last change.
+
+Every operation changes the cart, refreshes its TTL and reads back the whole
+cart in a single round-trip (a MULTI/EXEC pipeline or a Lua script), so
+concurrent updates from several devices can neither interleave nor lose writes.
+
+The a-prefixed coroutines do the same through redis.asyncio for the async views.
+"""
+
+from redis.exceptions import NoScriptError
+
+from nutrition_app.redis_client import get_async_redis, get_redis
+
+r = get_redis()
+
+CART_TTL = 1800  # 30 minutes
+
+# Increments an item's quantity, dropping the item once it reaches zero.
+# KEYS[1] = cart key, ARGV = item_id, quantity delta, ttl
+_ADD_ITEM_SCRIPT = """
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if quantity <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('HGETALL', KEYS[1])
+"""
+_add_item = r.register_script(_ADD_ITEM_SCRIPT)
+
+
+def cart_key(user_id):
+    return f'cart:{user_id}'
+
+
+def _to_cart(values):
+    """
+    Converts a HGETALL reply (dict, or flat list from Lua) to {item_id: quantity}.
+    """
+    if isinstance(values, list):
+        values = dict(zip(values[::2], values[1::2]))
+    return {item_id: int(quantity) for item_id, quantity in values.items()}
+
+
+def get_cart(user_id):
+    return _to_cart(r.hgetall(cart_key(user_id)))
+
+
+def add_item(user_id, item_id, quantity):
+    """
+    Adds quantity (may be negative) of an item and returns the new cart.
+    """
+    return _to_cart(_add_item(keys=[cart_key(user_id)], args=[item_id, quantity, CART_TTL]))
+
+
+def set_quantity(user_id, item_id, quantity):
+    """
+    Sets the quantity of an item, removing it when quantity <= 0, and returns the new cart.
+    """
+    if quantity <= 0:
+        return remove_item(user_id, item_id)[1]
+    key = cart_key(user_id)
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(key, item_id, quantity)
+    pipe.expire(key, CART_TTL)
+    pipe.hgetall(key)
+    return _to_cart(pipe.execute()[-1])
+
+
+def remove_item(user_id, item_id):
+    """
+    Removes an item from the cart and returns (removed, new cart).
+    """
+    key = cart_key(user_id)
+    pipe = r.pipeline(transaction=True)
+    pipe.hdel(key, item_id)
+    pipe.expire(key, CART_TTL)
+    pipe.hgetall(key)
+    removed, _, cart = pipe.execute()
+    return bool(removed), _to_cart(cart)
+
+
+def clear_cart(user_id):
+    r.delete(cart_key(user_id))
+
+
+async def aget_cart(user_id):
+    return _to_cart(await get_async_redis().hgetall(cart_key(user_id)))
+
+
+async def aadd_item(user_id, item_id, quantity):
+    # Async clients are per event loop, so the script registered above is run by its hash
+    client = get_async_redis()
+    args = (1, cart_key(user_id), item_id, quantity, CART_TTL)
+    try:
+        values = await client.evalsha(_add_item.sha, *args)
+    except NoScriptError:
+        # Not in the script cache of the server yet, or flushed since
+        values = await client.eval(_ADD_ITEM_SCRIPT, *args)
+    return _to_cart(values)
+
+
+async def aset_quantity(user_id, item_id, quantity):
+    if quantity <= 0:
+        return (await aremove_item(user_id, item_id))[1]
+    key = cart_key(user_id)
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.hset(key, item_id, quantity)
+    pipe.expire(key, CART_TTL)
+    pipe.hgetall(key)
+    return _to_cart((await pipe.execute())[-1])
+
+
+async def aremove_item(user_id, item_id):
+    key = cart_key(user_id)
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.hdel(key, item_id)
+    pipe.expire(key, CART_TTL)
+    pipe.hgetall(key)
+    removed, _, cart = await pipe.execute()
+    return bool(removed), _to_cart(cart)
@@ -0,0 +1,122 @@
+"""
+Checkout pipeline.
+
+Everything that only reads (user check, prices, totals, payment details and
+the lookup of a reusable address/payment) runs before the transaction. The
+transaction then only inserts: the address and payment when they are new, the
+order, and all order items in a single bulk insert. This keeps write locks,
+which serialize all writers on SQLite, held for as short as possible.
+"""
+
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+
+from menu.pricing import load_prices
+from users.models import User
+from .models import Order, OrderItem, Address, Payment
+
+PROMO_CODES = {
+    "DISCOUNT10": Decimal('0.10'),
+}
+
+
+class CheckoutError(Exception):
+    """
+    Raised for checkouts rejected because of the request or cart contents.
+    """
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+
+def price_cart(cart, promo_code=None):
+    """
+    Returns (prices, total_price, discount) for a {item_id: quantity} cart.
+    Prices are read from the database, the price cache may lag behind a change.
+    """
+    prices = load_prices(cart)
+    unavailable = [item_id for item_id, price in prices.items() if price is None]
+    if unavailable:
+        raise CheckoutError("Cart contains unavailable items.", item_ids=unavailable)
+    total_price = sum(prices[item_id] * quantity for item_id, quantity in cart.items())
+
+    # Apply promo code discount if valid
+    discount = Decimal('0.00')
+    if promo_code in PROMO_CODES:
+        discount = (total_price * PROMO_CODES[promo_code]).quantize(Decimal('0.01'))
+        total_price -= discount
+    return prices, total_price, discount
+
+
+def parse_card(card_number, expiry_date):
+    """
+    Returns (card_last4, exp_month, exp_year) from a card number and a MM/YY expiry date.
+    """
+    if not card_number or not expiry_date:
+        raise CheckoutError("card_number and expiry_date are required for card payments.")
+    try:
+        exp_month, exp_year = map(int, expiry_date.split('/'))
+    except ValueError:
+        raise CheckoutError("expiry_date must be in MM/YY format.")
+    return card_number[-4:], exp_month, exp_year
+
+
+def place_order(user_id, cart, address, payment_method, card_number=None, expiry_date=None, promo_code=None):
+    """
+    Creates an order for a {item_id: quantity} cart and returns it.
+    `address` holds street, city, state, zip_code and country.
+    Raises CheckoutError when the checkout is rejected.
+    """
+    # Step 1: Validate and price everything outside of the transaction
+    try:
+        user_id = uuid.UUID(str(user_id))
+    except ValueError:
+        raise CheckoutError("Invalid user ID.")
+    if not User.objects.filter(user_id=user_id).exists():
+        raise CheckoutError("Invalid user ID.")
+    prices, total_price, discount = price_cart(cart, promo_code)
+    card = parse_card(card_number, expiry_date) if payment_method == 'card' else None
+
+    # Step 2: Reuse the user's matching address and card instead of inserting them on every order
+    saved_address = Address.objects.filter(user_id=user_id, **address).first()
+    saved_payment = None
+    if card:
+        card_last4, exp_month, exp_year = card
+        saved_payment = Payment.objects.filter(
+            user_id=user_id, card_last4=card_last4, exp_month=exp_month, exp_year=exp_year
+        ).order_by('-is_default').first()
+
+    # Step 3: Short transaction that only inserts
+    with transaction.atomic():
+        if saved_address is None:
+            Address.objects.create(user_id_id=user_id, is_default=True, **address)
+
+        # Cash and other methods have no card to store
+        if card and saved_payment is None:
+            Payment.objects.create(
+                user_id_id=user_id,
+                card_last4=card_last4,
+                card_type='Other',  # Default card type, can be updated based on card validation logic
+                exp_month=exp_month,
+                exp_year=exp_year,
+                is_default=True
+            )
+
+        order = Order.objects.create(
+            user_id_id=user_id,
+            total_price=total_price,
+            discount=discount,
+            payment_status='pending',
+            order_status='processing'
+        )
+
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, item_id=item_id, quantity=quantity, price=prices[item_id])
+            for item_id, quantity in cart.items()
+        ])
+
+    return order
@@ -0,0 +1,89 @@
+"""
+Checkout retry protection backed by Redis.
+
+A successful checkout response is stored under the client's Idempotency-Key
+for a short TTL, so a retried request gets the original response back without
+running the checkout again. Checkouts of the same cart also hold a Redis lock,
+so concurrent duplicates wait for the first one instead of racing it to the
+database (and then find its stored response, or an empty cart).
+
+The stored response carries a hash of the request it answered. Reusing a key
+with a different request is rejected instead of replaying an unrelated order.
+"""
+
+import hashlib
+import json
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+from redis.exceptions import LockError
+
+from nutrition_app.redis_client import get_redis
+
+r = get_redis()
+
+MAX_KEY_LENGTH = 255
+
+
+class CheckoutInProgress(Exception):
+    """
+    Raised when the cart lock could not be acquired within LOCK_WAIT seconds.
+    """
+
+
+class KeyReused(Exception):
+    """
+    Raised when an Idempotency-Key is sent again with a different request.
+    """
+
+
+def request_hash(data):
+    """
+    Returns a hash of the request data that does not depend on the key order.
+    """
+    if hasattr(data, 'lists'):
+        # Form data, a QueryDict
+        data = dict(data.lists())
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _response_key(user_id, idempotency_key):
+    return f'idempotency:checkout:{user_id}:{idempotency_key}'
+
+
+@contextmanager
+def cart_lock(user_id):
+    config = settings.CHECKOUT_IDEMPOTENCY
+    lock = r.lock(f'lock:cart:{user_id}', timeout=config['LOCK_TIMEOUT'], blocking_timeout=config['LOCK_WAIT'])
+    if not lock.acquire():
+        raise CheckoutInProgress()
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # The lock expired while checking out, another request may hold it now
+            pass
+
+
+def get_response(user_id, idempotency_key, fingerprint):
+    """
+    Returns the stored response of an earlier request with this key, or None.
+    Raises KeyReused when that request had another fingerprint (see request_hash).
+    """
+    stored = r.get(_response_key(user_id, idempotency_key))
+    if stored is None:
+        return None
+    stored = json.loads(stored)
+    if stored.get('request') != fingerprint:
+        raise KeyReused()
+    response = HttpResponse(stored['body'], status=stored['status'], content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def save_response(user_id, idempotency_key, fingerprint, response):
+    stored = json.dumps({"request": fingerprint, "status": response.status_code, "body": response.content.decode()})
+    r.setex(_response_key(user_id, idempotency_key), settings.CHECKOUT_IDEMPOTENCY['TTL'], stored)
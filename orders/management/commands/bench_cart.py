@@ -0,0 +1,105 @@
+import asyncio
+import json
+import resource
+import threading
+import time
+import uuid
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+
+from nutrition_app.redis_client import get_async_redis
+from orders.cart import cart_key
+
+
+async def asgi_request(application, method, path, body=b''):
+    """
+    Sends one request to the ASGI application the way an ASGI server would and returns the status.
+    """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [
+            (b"host", b"127.0.0.1"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Keep the connection open, the handler stops listening once it responded
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await application(scope, receive, send)
+    return response["status"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the async cart endpoints through the ASGI handler with an "
+        "increasing number of concurrent clients on one event loop, and reports "
+        "throughput, latency, peak memory, threads and Redis connections per level. "
+        "Uses the configured Redis; the carts it creates are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='10,100,500,1000', help="Comma separated concurrent clients")
+        parser.add_argument('--requests', type=int, default=4, help="Add/view request pairs per client")
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        self.stdout.write(
+            f"{'clients':>8} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'peak RSS MB':>12} {'threads':>8} {'redis conns':>12} {'errors':>7}"
+        )
+        asyncio.run(self.run(levels, options['requests']))
+
+    async def run(self, levels, requests):
+        application = get_asgi_application()
+        item_id = str(uuid.uuid4())
+        user_ids = []
+
+        async def cart_client(user_id, timings, errors):
+            body = json.dumps({"user_id": user_id, "item_id": item_id, "quantity": 1}).encode()
+            for _ in range(requests):
+                for method, path, request_body in (
+                    ('POST', '/orders/cart/add', body),
+                    ('GET', f'/orders/cart/{user_id}/view', b''),
+                ):
+                    started = time.perf_counter()
+                    status = await asgi_request(application, method, path, request_body)
+                    timings.append(time.perf_counter() - started)
+                    errors.append(status != 200)
+
+        try:
+            for level in levels:
+                users = [f'bench-{uuid.uuid4()}' for _ in range(level)]
+                user_ids += users
+                timings, errors = [], []
+                started = time.perf_counter()
+                await asyncio.gather(*(cart_client(user_id, timings, errors) for user_id in users))
+                seconds = time.perf_counter() - started
+
+                timings.sort()
+                pool = get_async_redis().connection_pool
+                peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                self.stdout.write(
+                    f"{level:>8} {len(timings):>9} {len(timings) / seconds:>8.0f} "
+                    f"{timings[len(timings) // 2] * 1000:>8.1f} {timings[int(len(timings) * 0.99)] * 1000:>8.1f} "
+                    f"{peak_rss_mb:>12.1f} {threading.active_count():>8} {len(pool._available_connections) + len(pool._in_use_connections):>12} "
+                    f"{sum(errors):>7}"
+                )
+        finally:
+            redis_client = get_async_redis()
+            for start in range(0, len(user_ids), 1000):
+                await redis_client.delete(*(cart_key(user_id) for user_id in user_ids[start:start + 1000]))
+            await redis_client.aclose()
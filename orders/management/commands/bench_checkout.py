@@ -0,0 +1,72 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from menu.models import Restaurant, MenuItem
+from orders.checkout import place_order
+from orders.models import OrderItem
+from users.models import User
+
+ADDRESS = {"street": "1 Bench St", "city": "Austin", "state": "TX", "zip_code": "73301", "country": "US"}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks checkout latency versus cart size. All rows are created inside "
+        "a transaction that is rolled back, so the database is left unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,100,250', help="Comma separated cart sizes")
+        parser.add_argument('--runs', type=int, default=20, help="Checkouts per cart size")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'items':>6} {'queries':>8} {'median ms':>10} {'p95 ms':>8} {'per-row insert ms':>18}")
+        try:
+            with transaction.atomic():
+                self.run(sizes, options['runs'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, runs):
+        user = User.objects.create(full_name="Bench", email=f"bench-{uuid.uuid4()}@example.com")
+        restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Bench")
+        items = MenuItem.objects.bulk_create([
+            MenuItem(restaurant=restaurant, name=f"Item {n}", category="Lunch", price="9.99")
+            for n in range(max(sizes))
+        ])
+
+        for size in sizes:
+            cart = {str(item.item_id): 2 for item in items[:size]}
+            place_order(user.user_id, cart, ADDRESS, 'card', '4111111111111111', '12/30')  # warm up
+
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    place_order(user.user_id, cart, ADDRESS, 'card', '4111111111111111', '12/30')
+                timings.append((time.perf_counter() - started) * 1000)
+
+            # The previous checkout inserted order items one row at a time
+            order = OrderItem.objects.filter(order__user_id=user).first().order
+            started = time.perf_counter()
+            with transaction.atomic():
+                for item_id, quantity in cart.items():
+                    OrderItem.objects.create(order=order, item_id=item_id, quantity=quantity, price="9.99")
+            per_row_ms = (time.perf_counter() - started) * 1000
+
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"{size:>6} {len(queries):>8} {statistics.median(timings):>10.2f} {p95:>8.2f} {per_row_ms:>18.2f}"
+            )
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_rename_id_address_address_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_id', 'created_at', 'order_id'], name='orders_orde_user_id_96779f_idx'),
+        ),
+    ]
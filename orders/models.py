@@ -19,6 +19,11 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'created_at', 'order_id']),  # Order history of a user, newest first
+        ]
+
     def __str__(self):
         return f"Order {self.order_id}"
 
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from nutrition_app.db_router import pin_to_primary, user_scope
+from .models import Order
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def pin_order_history(sender, instance, **kwargs):
+    # The user sees the new order in their history even before the replicas have it
+    pin_to_primary(user_scope(instance.user_id_id))
@@ -1,3 +1,357 @@
-from django.test import TestCase
+import copy
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+import redis
+from asgiref.sync import sync_to_async
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from menu.models import Restaurant, MenuItem
+from menu.pricing import price_cache
+from nutrition_app.db_router import ReplicaRouter, pin_key, read_from_replica, user_scope
+from nutrition_app.redis_client import get_redis
+from nutrition_app.testing import QueryPlanAssertions
+from users.models import User
+from . import cart as cart_service
+from .checkout import CheckoutError, place_order
+from .models import Order, OrderItem, Address, Payment
+
+
+@skipUnless(connection.vendor == "sqlite", "Asserts on SQLite's EXPLAIN QUERY PLAN output")
+class OrderQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_order_history_by_user_newest_first(self):
+        self.assertIndexSearch(Order.objects.filter(user_id=uuid.uuid4()).order_by("-created_at", "-order_id"))
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(full_name="Ada", email="ada@example.com")
+        base = timezone.now() - datetime.timedelta(days=30)
+        self.orders = []
+        for n in range(7):
+            order = Order.objects.create(user_id=self.user, total_price=10 + n,
+                                         order_status="delivered" if n % 2 else "processing")
+            # created_at is auto_now_add, spread the orders over days
+            Order.objects.filter(pk=order.pk).update(created_at=base + datetime.timedelta(days=n))
+            OrderItem.objects.create(order=order, item_id=uuid.uuid4(), quantity=n + 1, price="10.00")
+            self.orders.append(order)
+        self.url = f"/orders/{self.user.user_id}/history"
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        seen = []
+        cursor = ""
+        while True:
+            response = self.client.get(self.url, {"limit": 3, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            seen += [order["order_id"] for order in response.data["orders"]]
+            cursor = response.data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, [order.order_id for order in reversed(self.orders)])
+
+    def test_filters(self):
+        response = self.client.get(self.url, {"status": "delivered"})
+        self.assertEqual(len(response.data["orders"]), 3)
+
+        after = (timezone.now() - datetime.timedelta(days=26)).date().isoformat()
+        response = self.client.get(self.url, {"created_after": after})
+        self.assertEqual(len(response.data["orders"]), 3)
+
+        response = self.client.get(self.url, {"created_before": "not-a-date"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_include_items_loads_the_page_in_one_query(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"limit": 2, "include_items": "true"})
+        orders = response.data["orders"]
+        self.assertEqual([len(order["items"]) for order in orders], [1, 1])
+        self.assertEqual(orders[0]["items"][0]["quantity"], 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHECKOUT_IDEMPOTENCY={'TTL': 600, 'LOCK_TIMEOUT': 30, 'LOCK_WAIT': 0.1})
+class CheckoutIdempotencyTests(TestCase):
+    ADDRESS = {"street": "1 Main St", "city": "Austin", "state": "TX", "zip_code": "73301", "country": "US"}
+
+    def setUp(self):
+        self.user = User.objects.create(full_name="Ada", email="ada@example.com")
+        restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.item = MenuItem.objects.create(restaurant=restaurant, name="Tofu Bowl", category="Lunch", price="9.00")
+        self.user_id = str(self.user.user_id)
+        try:
+            cart_service.add_item(self.user_id, str(self.item.item_id), 2)
+        except redis.RedisError:
+            self.skipTest("Carts need Redis")
+        self.addCleanup(cart_service.clear_cart, self.user_id)
+        self.url = f"/orders/{self.user_id}/checkout"
+
+    def checkout(self, key, **data):
+        self.addCleanup(get_redis().delete, f"idempotency:checkout:{self.user_id}:{key}")
+        return self.client.post(
+            self.url, dict(self.ADDRESS, user_id=self.user_id, payment_method="cash", **data),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retries_replay_the_stored_response(self):
+        first = self.checkout("order-1")
+        self.assertEqual(first.status_code, 201)
+        # The cart is empty now, only the stored response can answer
+        retry = self.checkout("order-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.filter(user_id=self.user).count(), 1)
+
+    def test_key_reuse_with_another_request_is_rejected(self):
+        self.assertEqual(self.checkout("order-1").status_code, 201)
+        self.assertEqual(self.checkout("order-1", promo_code="DISCOUNT10").status_code, 422)
+        self.assertEqual(Order.objects.filter(user_id=self.user).count(), 1)
+
+    def test_concurrent_checkouts_of_the_cart_conflict(self):
+        lock = get_redis().lock(f"lock:cart:{self.user_id}", timeout=5)
+        self.assertTrue(lock.acquire())
+        try:
+            response = self.checkout("order-1")
+        finally:
+            lock.release()
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        # Not stored, so the retry places the order
+        self.assertEqual(self.checkout("order-1").status_code, 201)
+        self.assertEqual(Order.objects.filter(user_id=self.user).count(), 1)
+
+
+class CartServiceTests(TestCase):
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        try:
+            cart_service.clear_cart(self.user_id)
+        except redis.RedisError:
+            self.skipTest("Carts need Redis")
+        self.addCleanup(cart_service.clear_cart, self.user_id)
+        self.key = cart_service.cart_key(self.user_id)
+
+    def test_add_item_increments_and_drops_items_at_zero(self):
+        self.assertEqual(cart_service.add_item(self.user_id, "a", 2), {"a": 2})
+        self.assertEqual(cart_service.add_item(self.user_id, "b", 1), {"a": 2, "b": 1})
+        self.assertEqual(cart_service.add_item(self.user_id, "a", -1), {"a": 1, "b": 1})
+        self.assertEqual(cart_service.add_item(self.user_id, "a", -5), {"b": 1})
+        self.assertGreater(get_redis().ttl(self.key), cart_service.CART_TTL - 5)
+
+    def test_set_quantity_and_remove_item(self):
+        cart_service.add_item(self.user_id, "a", 2)
+        get_redis().expire(self.key, 10)
+        self.assertEqual(cart_service.set_quantity(self.user_id, "a", 7), {"a": 7})
+        self.assertEqual(cart_service.set_quantity(self.user_id, "b", 1), {"a": 7, "b": 1})
+        # Every change refreshes the TTL
+        self.assertGreater(get_redis().ttl(self.key), cart_service.CART_TTL - 5)
+        self.assertEqual(cart_service.set_quantity(self.user_id, "b", 0), {"a": 7})
+        self.assertEqual(cart_service.remove_item(self.user_id, "a"), (True, {}))
+        self.assertEqual(cart_service.remove_item(self.user_id, "a"), (False, {}))
+        self.assertEqual(cart_service.get_cart(self.user_id), {})
+
+    def test_update_cart_item_view(self):
+        # Served over WSGI, so the view runs the sync operations
+        cart_service.add_item(self.user_id, "a", 2)
+        url = f"/orders/cart/{self.user_id}/update/a"
+        response = self.client.put(url, {"quantity": "5"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["cart"], {"a": 5})
+        response = self.client.put(url, "quantity=0", content_type="application/x-www-form-urlencoded")
+        self.assertEqual(response.json()["cart"], {})
+        for body in ({"quantity": "five"}, {"quantity": {"n": 1}}):
+            response = self.client.put(url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(cart_service.get_cart(self.user_id), {})
+
+
+class AsyncCartViewTests(TestCase):
+    """
+    The async client serves the cart views over ASGI, so they use the async Redis client.
+    """
+
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.item_id = str(
+            MenuItem.objects.create(restaurant=restaurant, name="Tofu Bowl", category="Lunch", price="9.00").item_id
+        )
+        try:
+            cart_service.clear_cart(self.user_id)
+        except redis.RedisError:
+            self.skipTest("Carts need Redis")
+        self.addCleanup(cart_service.clear_cart, self.user_id)
+        price_cache.clear()
+
+    async def add(self, data, content_type="application/json"):
+        return await self.async_client.post("/orders/cart/add", data, content_type=content_type)
+
+    async def test_add_update_remove_and_view(self):
+        # The add script is loaded into the script cache by its first run
+        await sync_to_async(get_redis().script_flush)()
+        response = await self.add({"user_id": self.user_id, "item_id": self.item_id, "quantity": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["cart"], {self.item_id: 2})
+        response = await self.add({"user_id": self.user_id, "item_id": self.item_id, "quantity": "3"})
+        self.assertEqual(response.json()["cart"], {self.item_id: 5})
+
+        url = f"/orders/cart/{self.user_id}/update/{self.item_id}"
+        response = await self.async_client.put(url, {"quantity": 4}, content_type="application/json")
+        self.assertEqual(response.json()["cart"], {self.item_id: 4})
+
+        response = await self.async_client.get(f"/orders/cart/{self.user_id}/view")
+        self.assertEqual(response.json(), {
+            "cart": [{"item_id": self.item_id, "quantity": 4, "price": 9.0}], "total_price": 36.0,
+        })
+
+        url = f"/orders/cart/{self.user_id}/remove/{self.item_id}"
+        self.assertEqual((await self.async_client.delete(url)).status_code, 200)
+        self.assertEqual((await self.async_client.delete(url)).status_code, 404)
+        response = await self.async_client.get(f"/orders/cart/{self.user_id}/view")
+        self.assertEqual(response.json(), {"message": "Cart is empty."})
+
+    async def test_invalid_quantities_and_bodies(self):
+        for quantity in ("two", [2], {"n": 2}):
+            response = await self.add({"user_id": self.user_id, "item_id": self.item_id, "quantity": quantity})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"error": "Invalid quantity value"})
+        self.assertEqual((await self.add([1, 2])).json(), {"error": "Invalid request body"})
+
+        url = f"/orders/cart/{self.user_id}/update/{self.item_id}"
+        for body, error in (
+            ([{"quantity": 1}], "Invalid request body"),
+            ("not json", "Invalid request body"),
+            ({}, "quantity is required"),
+            ({"quantity": None}, "quantity is required"),
+            ({"quantity": [1]}, "Invalid quantity value"),
+        ):
+            response = await self.async_client.put(url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"error": error})
+        self.assertEqual(await cart_service.aget_cart(self.user_id), {})
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica_1', 'replica_2'], 'PIN_SECONDS': 5})
+class ReplicaRoutingTests(TestCase):
+    def test_reads_opt_in_and_alternate_between_replicas(self):
+        self.assertEqual(Order.objects.all().db, "default")
+        aliases = []
+        for _ in range(4):
+            with read_from_replica() as alias:
+                self.assertEqual(Order.objects.all().db, alias)
+                self.assertEqual(ReplicaRouter().db_for_write(Order), "default")
+                aliases.append(alias)
+        self.assertEqual(sorted(aliases), ["replica_1", "replica_1", "replica_2", "replica_2"])
+        self.assertNotEqual(aliases[0], aliases[1])
+        self.assertEqual(Order.objects.all().db, "default")
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica_test'], 'PIN_SECONDS': 5})
+class ReplicaReadTests(TransactionTestCase):
+    """
+    Reads through a real connection configured as a test mirror of the primary,
+    like the replicas of DB_REPLICAS. The mirror is a separate connection, so
+    the data has to be committed, hence TransactionTestCase.
+    """
+
+    alias = "replica_test"
+    # Resolved when the class is set up, once the replica alias exists
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        replica = copy.deepcopy(connections["default"].settings_dict)
+        replica["TEST"]["MIRROR"] = "default"
+        connections.settings[cls.alias] = replica
+        cls.addClassCleanup(cls.remove_replica)
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+
+    def setUp(self):
+        self.user = User.objects.create(full_name="Ada", email="ada@example.com")
+
+    def test_reads_run_on_the_replica(self):
+        Order.objects.create(user_id=self.user, total_price=10)
+        with read_from_replica() as alias:
+            self.assertEqual(alias, self.alias)
+            with CaptureQueriesContext(connections[alias]) as replica_queries:
+                with CaptureQueriesContext(connections["default"]) as primary_queries:
+                    self.assertEqual(Order.objects.filter(user_id=self.user).count(), 1)
+        self.assertEqual(len(replica_queries), 1)
+        self.assertEqual(len(primary_queries), 0)
+
+    def test_own_orders_are_read_from_the_primary(self):
+        try:
+            get_redis().ping()
+        except redis.RedisError:
+            self.skipTest("Pins need Redis, without it every read goes to the primary")
+        # Committed right away, which pins the user
+        Order.objects.create(user_id=self.user, total_price=10)
+        self.addCleanup(get_redis().delete, pin_key(user_scope(self.user.user_id)))
+        with read_from_replica(user_scope(self.user.user_id)) as alias:
+            self.assertIsNone(alias)
+            self.assertEqual(Order.objects.all().db, "default")
+
+
+class CheckoutPipelineTests(TestCase):
+    ADDRESS = {"street": "1 Main St", "city": "Austin", "state": "TX", "zip_code": "73301", "country": "US"}
+
+    def setUp(self):
+        self.user = User.objects.create(full_name="Ada", email="ada@example.com")
+        restaurant = Restaurant.objects.create(owner_id=uuid.uuid4(), name="Green Bowl")
+        self.items = [
+            MenuItem.objects.create(restaurant=restaurant, name=f"Item {n}", category="Lunch", price="4.00")
+            for n in range(20)
+        ]
+        price_cache.clear()
+
+    def cart(self, size):
+        return {str(item.item_id): 2 for item in self.items[:size]}
+
+    def test_order_items_are_bulk_inserted(self):
+        order = place_order(self.user.user_id, self.cart(20), self.ADDRESS, "card", "4111111111111111", "12/30",
+                            promo_code="DISCOUNT10")
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.discount, Decimal("16.00"))
+        self.assertEqual(order.total_price, Decimal("144.00"))
+
+        # user, prices, address and card lookups, then a savepoint around the order and items inserts
+        with self.assertNumQueries(4 + 4):
+            place_order(self.user.user_id, self.cart(20), self.ADDRESS, "card", "4111111111111111", "12/30")
+
+    def test_address_and_card_are_reused(self):
+        place_order(self.user.user_id, self.cart(1), self.ADDRESS, "card", "4111111111111111", "12/30")
+        place_order(self.user.user_id, self.cart(2), self.ADDRESS, "card", "4111111111111111", "12/30")
+        place_order(self.user.user_id, self.cart(2), dict(self.ADDRESS, street="2 Side St"), "cash")
+        self.assertEqual(Address.objects.filter(user_id=self.user).count(), 2)
+        self.assertEqual(Payment.objects.filter(user_id=self.user).count(), 1)
+        self.assertEqual(Order.objects.filter(user_id=self.user).count(), 3)
+
+    def test_checkout_charges_the_current_price(self):
+        price_cache.get_prices(self.cart(1))
+        # Changed by another worker, whose invalidation does not reach this one
+        MenuItem.objects.filter(item_id=self.items[0].item_id).update(price="6.00")
+        order = place_order(self.user.user_id, self.cart(1), self.ADDRESS, "cash")
+        self.assertEqual(order.total_price, Decimal("12.00"))
+
+    def test_rejected_checkouts(self):
+        with self.assertRaises(CheckoutError):
+            place_order(uuid.uuid4(), self.cart(1), self.ADDRESS, "cash")
+        with self.assertRaises(CheckoutError):
+            place_order(self.user.user_id, {str(uuid.uuid4()): 1}, self.ADDRESS, "cash")
+        with self.assertRaises(CheckoutError):
+            place_order(self.user.user_id, self.cart(1), self.ADDRESS, "card", "4111111111111111", "December")
+        self.assertFalse(Order.objects.exists())
@@ -1,8 +1,11 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from .models import Order, OrderItem, Address, Payment
-from django.db import transaction
-import redis
+from django.http import JsonResponse, QueryDict
+from .models import Order, OrderItem
+from . import cart as cart_service
+from . import idempotency
+from .checkout import CheckoutError, place_order
+from menu.pricing import price_cache
+from decimal import Decimal
 import uuid
 from django.conf import settings
 from rest_framework.views import APIView
@@ -10,95 +13,86 @@ from rest_framework.response import Response
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from users.models import User
+from nutrition_app.db_router import read_from_replica, user_scope
+from nutrition_app.pagination import paginate_keyset, parse_datetime_param, parse_limit
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+import json
 
-# Redis connection setup (Example configuration)
-r = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
 
-class CartView(APIView):
+async def _cart_call(request, operation, *args):
+    """
+    Runs a cart operation natively on the event loop when served over ASGI.
+    Under WSGI every request runs on a new event loop that an async Redis pool
+    could not outlive, so the sync operation runs on the request thread instead.
+    """
+    if isinstance(request, ASGIRequest):
+        return await getattr(cart_service, f'a{operation}')(*args)
+    return await sync_to_async(getattr(cart_service, operation))(*args)
+
+
+def _request_data(request):
+    """
+    Parses a JSON or form encoded request body, like DRF's request.data.
+    Returns None when the body is not valid JSON or not a JSON object.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    if request.method == 'POST':
+        return request.POST
+    return QueryDict(request.body)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CartView(View):
     """
     POST /api/cart/add
     Adds an item to the cart for a user.
     """
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'user_id': openapi.Schema(type=openapi.TYPE_STRING, description='User ID'),
-                'item_id': openapi.Schema(type=openapi.TYPE_STRING, description='Item ID'),
-                'quantity': openapi.Schema(type=openapi.TYPE_INTEGER, description='Quantity to add'),
-            },
-        ),
-        responses={
-            200: openapi.Response('Item added to cart successfully', openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'message': openapi.Schema(type=openapi.TYPE_STRING),
-                    'cart': openapi.Schema(type=openapi.TYPE_OBJECT),
-                }
-            )),
-            400: "Invalid input",
-            500: "Internal server error"
-        }
-    )
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         POST /api/cart/add
         Adds an item to the cart.
         """
         # Get the data from the request
-        user_id = request.data.get('user_id')
-        item_id = request.data.get('item_id')
-        quantity = request.data.get('quantity')
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"error": "Invalid request body"}, status=status.HTTP_400_BAD_REQUEST)
+        user_id = data.get('user_id')
+        item_id = data.get('item_id')
+        quantity = data.get('quantity')
 
         # Validate the inputs
         if not user_id or not item_id or quantity is None:
-            return Response({"error": "Missing required parameters"}, status=status.HTTP_400_BAD_REQUEST)
-        
+            return JsonResponse({"error": "Missing required parameters"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
             # Convert quantity to an integer
             quantity = int(quantity)
-        except ValueError:
-            return Response({"error": "Invalid quantity value"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Generate cart key for Redis
-        cart_key = f'cart:{user_id}'
-
-        # Fetch current cart items
-        cart = r.hgetall(cart_key)
-
-        # Add or update item in the cart
-        current_quantity = int(cart.get(item_id, 0))
-        updated_quantity = current_quantity + quantity
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "Invalid quantity value"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Set new quantity and reset TTL to 30 minutes
-        r.hset(cart_key, item_id, updated_quantity)
-        r.expire(cart_key, 1800)  # Set TTL for 30 minutes
+        # Add the item and reset the 30 minute TTL, atomically and in one round-trip
+        cart = await _cart_call(request, 'add_item', user_id, item_id, quantity)
 
-        # Return a success response
-        return JsonResponse({"message": "Item added to cart successfully.", "cart": {item_id: updated_quantity}}, status=status.HTTP_200_OK)
+        # Return a success response with the new cart state
+        return JsonResponse({"message": "Item added to cart successfully.", "cart": cart}, status=status.HTTP_200_OK)
 
 
-
-class RemoveFromCart(APIView):
+@method_decorator(csrf_exempt, name='dispatch')
+class RemoveFromCart(View):
     """
     DELETE /api/cart/remove/{item_id}
     Removes an item from the cart for a user.
     """
-    @swagger_auto_schema(
-        responses={
-            200: openapi.Response('Item removed from cart successfully', openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'message': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )),
-            400: "Invalid input",
-            404: "Item not found in cart",
-            500: "Internal server error"
-        }
-    )
-    def delete(self, request, *args, **kwargs):
+    async def delete(self, request, *args, **kwargs):
         """
         DELETE /api/cart/user_id/remove/{item_id}
         Removes an item from the cart for a user.
@@ -109,29 +103,49 @@ class RemoveFromCart(APIView):
 
         # If user_id is missing, return a bad request error
         if not user_id:
-            return Response({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
-
-        cart_key = f'cart:{user_id}'
+            return JsonResponse({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Remove item from the cart in Redis
-        item_removed = r.hdel(cart_key, item_id)
+        # Remove item from the cart in Redis and reset its TTL
+        item_removed, cart = await _cart_call(request, 'remove_item', user_id, item_id)
 
         # If the item was not found in the cart
-        if item_removed == 0:
+        if not item_removed:
             return JsonResponse({"message": "Item not found in the cart."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Reset TTL (Time-to-Live) for the cart key
-        r.expire(cart_key, 1800)  # Set TTL for 30 minutes
+        return JsonResponse({"message": "Item removed from cart successfully.", "cart": cart}, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UpdateCartItem(View):
+    """
+    PUT /api/cart/{user_id}/update/{item_id}
+    Sets the quantity of an item in the cart for a user.
+    """
+    async def put(self, request, *args, **kwargs):
+        user_id = kwargs.get('user_id')
+        item_id = kwargs.get('item_id')
+        data = _request_data(request)
+        if data is None:
+            return JsonResponse({"error": "Invalid request body"}, status=status.HTTP_400_BAD_REQUEST)
+        quantity = data.get('quantity')
+
+        if quantity is None:
+            return JsonResponse({"error": "quantity is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "Invalid quantity value"}, status=status.HTTP_400_BAD_REQUEST)
 
-        return JsonResponse({"message": "Item removed from cart successfully."}, status=status.HTTP_200_OK)
+        cart = await _cart_call(request, 'set_quantity', user_id, item_id, quantity)
+        return JsonResponse({"message": "Cart updated successfully.", "cart": cart}, status=status.HTTP_200_OK)
 
 
-class ViewCart(APIView):
+class ViewCart(View):
     """
     GET /api/cart/view
     Views the items in the cart for a user.
     """
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         """
         GET /api/cart
     def get(self, request):
@@ -141,30 +155,33 @@ class ViewCart(APIView):
 
         # If user_id is missing, return a bad request error
         if not user_id:
-            return Response({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_key = f'cart:{user_id}'
-        
         # Fetch cart details from Redis
-        cart = r.hgetall(cart_key)
+        cart = await _cart_call(request, 'get_cart', user_id)
 
         # Check if the cart is not empty
         if cart:
-            total_price = 0
+            total_price = Decimal('0.00')
             cart_details = []
 
-            # Assuming price for each item is retrieved from an inventory system or DB
+            # Resolve the prices of all cart items at once, items no longer on a menu have no price.
+            # Only prices missing from the price cache need a database query off the event loop.
+            prices = price_cache.get_cached(cart)
+            if prices is None:
+                prices = await sync_to_async(price_cache.get_prices)(cart)
             for item_id, quantity in cart.items():
-                price = 10.99  # Example fixed price for demonstration
-                total_price += price * int(quantity)
+                price = prices[item_id]
+                if price is not None:
+                    total_price += price * quantity
                 cart_details.append({
                     'item_id': item_id,
-                    'quantity': int(quantity),
-                    'price': price
+                    'quantity': quantity,
+                    'price': float(price) if price is not None else None
                 })
 
             # Return the cart details with the total price
-            return JsonResponse({"cart": cart_details, "total_price": total_price}, status=status.HTTP_200_OK)
+            return JsonResponse({"cart": cart_details, "total_price": float(total_price)}, status=status.HTTP_200_OK)
         else:
             # If the cart is empty, return a message
             return JsonResponse({"message": "Cart is empty."}, status=status.HTTP_200_OK)
@@ -204,13 +221,52 @@ class Checkout(APIView):
                 }
             )),
             400: "Invalid input",
+            409: "A checkout for this cart is already in progress",
+            422: "Idempotency-Key reused for a different request",
             500: "Internal server error"
         }
     )
     def post(self, request, *args, **kwargs):
         """
         Handles the checkout process, including saving addresses, payments, and creating an order.
+        Requests carrying an Idempotency-Key header are replayed from Redis when retried.
         """
+        user_id = request.data.get('user_id')
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not user_id:
+            return self.checkout(request)
+
+        fingerprint = idempotency.request_hash(request.data)
+        try:
+            if idempotency_key:
+                if len(idempotency_key) > idempotency.MAX_KEY_LENGTH:
+                    return Response({"error": "Idempotency-Key is too long."}, status=status.HTTP_400_BAD_REQUEST)
+                replay = idempotency.get_response(user_id, idempotency_key, fingerprint)
+                if replay is not None:
+                    return replay
+
+            # Concurrent checkouts of the same cart run one at a time
+            with idempotency.cart_lock(user_id):
+                if idempotency_key:
+                    replay = idempotency.get_response(user_id, idempotency_key, fingerprint)
+                    if replay is not None:
+                        return replay
+
+                response = self.checkout(request)
+
+                # Only placed orders are stored, failed checkouts may be retried
+                if idempotency_key and response.status_code == status.HTTP_201_CREATED:
+                    idempotency.save_response(user_id, idempotency_key, fingerprint, response)
+                return response
+        except idempotency.KeyReused:
+            return JsonResponse(
+                {"message": "Idempotency-Key was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        except idempotency.CheckoutInProgress:
+            return JsonResponse({"message": "A checkout for this cart is already in progress."}, status=status.HTTP_409_CONFLICT)
+
+    def checkout(self, request):
         user_id = request.data.get('user_id')
         street = request.data.get('street')
         city = request.data.get('city')
@@ -220,108 +276,45 @@ class Checkout(APIView):
         payment_method = request.data.get('payment_method')
         card_number = request.data.get('card_number', None)
         expiry_date = request.data.get('expiry_date', None)
-        cvv = request.data.get('cvv', None)
         promo_code = request.data.get('promo_code', None)
 
         # Ensure required fields are provided
         if not user_id or not street or not city or not state or not zip_code or not country or not payment_method:
             return Response({"error": "user_id, street, city, state, zip_code, country, and payment_method are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Validate user exists
-        # try:
-        #     user = User.objects.get(user_id=user_id)
-        # except User.DoesNotExist:
-        #     return Response({"error": "Invalid user ID."}, status=status.HTTP_400_BAD_REQUEST)
-
-        cart_key = f'cart:{user_id}'
-        cart = r.hgetall(cart_key)
+        cart = cart_service.get_cart(user_id)
 
         # Check if the cart is empty
         if not cart:
             return JsonResponse({"message": "Cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Calculate total price
-        total_price = sum(10.99 * int(quantity) for item_id, quantity in cart.items())
-
-        # Apply promo code discount if valid
-        discount = 0.00
-        if promo_code == "DISCOUNT10":
-            discount = total_price * 0.10
-            total_price -= discount
-
-        # Use transaction to ensure atomicity
+        # Price the cart, save address & payment and create the order in one short transaction
         try:
-            with transaction.atomic():
-                # Save address
-                user = User.objects.get(user_id=user_id)  # Fetch the User instance
-                address = Address.objects.create(
-                    user_id=user,
-                    street=street,
-                    city=city,
-                    state=state,
-                    zip_code=zip_code,
-                    country=country,
-                    is_default=True  # Mark the address as default if needed
-                )
-
-                # Create order
-                order = Order.objects.create(
-                    user_id=user,
-                    total_price=total_price,
-                    discount=discount,
-                    payment_status='pending',
-                    order_status='processing'
-                )
-
-                # Save order items
-                for item_id, quantity in cart.items():
-                    OrderItem.objects.create(
-                        order_id=order.order_id,
-                        item_id=item_id,
-                        quantity=int(quantity),
-                        price=10.99
-                    )
-
-                # Save payment details
-                if payment_method == 'card':
-                    # Extract card details
-                    card_last4 = card_number[-4:] if card_number else None
-                    card_type = 'Other'  # Default card type, can be updated based on card validation logic
-                    exp_month, exp_year = map(int, expiry_date.split('/')) if expiry_date else (None, None)
-
-                    # Save payment details
-                    payment = Payment.objects.create(
-                        user_id=user,
-                        card_last4=card_last4,
-                        card_type=card_type,
-                        exp_month=exp_month,
-                        exp_year=exp_year,
-                        is_default=True  # Mark as default if needed
-                    )
-                else:
-                    payment = Payment.objects.create(
-                        user_id=user,
-                        card_last4=None,
-                        card_type='Other',
-                        exp_month=None,
-                        exp_year=None,
-                        is_default=False
-                    )
-
-            # Remove cart from Redis after successful order placement
-            r.delete(cart_key)
-
-            return JsonResponse({
-                "message": "Order placed successfully.",
-                "order_id": order.order_id,
-                "total_price": total_price,
-                "payment_status": order.payment_status,
-                "order_status": order.order_status
-            }, status=status.HTTP_201_CREATED)
-
+            order = place_order(
+                user_id,
+                cart,
+                address={"street": street, "city": city, "state": state, "zip_code": zip_code, "country": country},
+                payment_method=payment_method,
+                card_number=card_number,
+                expiry_date=expiry_date,
+                promo_code=promo_code,
+            )
+        except CheckoutError as e:
+            return JsonResponse({"message": e.message, **e.details}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return JsonResponse({"message": f"Error occurred while placing the order: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # Remove cart from Redis after successful order placement
+        cart_service.clear_cart(user_id)
+
+        return JsonResponse({
+            "message": "Order placed successfully.",
+            "order_id": order.order_id,
+            "total_price": float(order.total_price),
+            "payment_status": order.payment_status,
+            "order_status": order.order_status
+        }, status=status.HTTP_201_CREATED)
+
 class PaymentPrcessing(APIView):
     """
     POST /api/order/payment
@@ -376,7 +369,13 @@ class PaymentPrcessing(APIView):
 class OrderHistory(APIView):
     """
     GET /api/order/history
-    Retrieves the order history for a given user.
+    Retrieves the order history for a given user, newest first, one page at a time.
+    Query parameters:
+        limit: orders per page (default 20, max 100)
+        cursor: next_cursor of the previous page
+        status: only orders with this order_status
+        created_after / created_before: ISO date or datetime bounds on created_at
+        include_items: "true" to embed the order items of the page
     """
     def get(self, request, **kwargs):
         user_id_str = kwargs.get('user_id')
@@ -392,9 +391,45 @@ class OrderHistory(APIView):
             return Response({"error": f"Invalid user_id format: {user_id_str}. Ensure it's a valid UUID."}, 
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Fetch order history
-        orders = Order.objects.filter(user_id=user_id).values(
-            "order_id", "total_price", "order_status", "created_at"
-        )
-
-        return Response({"orders": list(orders)}, status=status.HTTP_200_OK)
\ No newline at end of file
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+        except ValueError:
+            return Response({"error": "limit must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        orders = Order.objects.filter(user_id=user_id)
+
+        # Apply filters
+        order_status = request.query_params.get('status')
+        if order_status:
+            orders = orders.filter(order_status=order_status)
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            bound = parse_datetime_param(value)
+            if bound is None:
+                return Response({"error": f"Invalid {param}: {value}. Use an ISO date or datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            orders = orders.filter(**{lookup: bound})
+
+        # Served by a replica unless the user placed or changed an order moments ago
+        with read_from_replica(user_scope(user_id)):
+            # Fetch one page of order history
+            try:
+                page, next_cursor = paginate_keyset(
+                    orders.values("order_id", "total_price", "order_status", "created_at"),
+                    fields=("created_at", "order_id"),
+                    cursor=request.query_params.get('cursor'),
+                    limit=limit,
+                )
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Batch load the items of this page only
+            if request.query_params.get('include_items', '').lower() in ('1', 'true', 'yes'):
+                items = {order["order_id"]: [] for order in page}
+                for item in OrderItem.objects.filter(order_id__in=items).values("order_id", "item_id", "quantity", "price"):
+                    items[item.pop("order_id")].append(item)
+                for order in page:
+                    order["items"] = items[order["order_id"]]
+
+        return Response({"orders": page, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
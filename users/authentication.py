@@ -0,0 +1,226 @@
+"""
+Stateless JWT authentication.
+
+Tokens are validated locally, checked against revocations in Redis and the
+user is resolved from a two level cache (in-process, then Redis), so an
+authenticated request does no SQL in the common case.
+
+Revocation keys in Redis:
+- auth:revoked:{jti} - a single token, revoked on logout until it expires.
+- auth:revoked_before:{user_id} - unix time before which all tokens of a user
+  are revoked, set when the password changes. iat has microsecond resolution,
+  so a token issued right after the change is not revoked.
+"""
+
+import datetime
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import jwt
+import redis
+from django.conf import settings
+from rest_framework import status
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import APIException, AuthenticationFailed
+
+from nutrition_app.redis_client import get_redis
+from .models import User
+
+ACCESS_TOKEN_LIFETIME = datetime.timedelta(minutes=15)
+REFRESH_TOKEN_LIFETIME = datetime.timedelta(days=7)
+
+# Everything authentication and permission checks need, the password hash stays out of Redis.
+# Other fields are deferred and loaded from the database on first access.
+CACHED_USER_FIELDS = ('user_id', 'full_name', 'email', 'phone_number', 'role', 'is_active', 'is_staff', 'is_superuser')
+
+
+class AuthenticationUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Authentication is temporarily unavailable."
+    default_code = 'authentication_unavailable'
+
+
+def issue_token(user_id, token_type):
+    """
+    Returns a signed access or refresh token for a user.
+    """
+    issued_at = datetime.datetime.now(datetime.timezone.utc)
+    lifetime = ACCESS_TOKEN_LIFETIME if token_type == 'access' else REFRESH_TOKEN_LIFETIME
+    payload = {
+        "user_id": str(user_id),
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        # A float, PyJWT would truncate a datetime to the second
+        "iat": issued_at.timestamp(),
+        "exp": issued_at + lifetime,
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
+
+
+def decode_token(token):
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise AuthenticationFailed("Token has expired.")
+    except jwt.InvalidTokenError:
+        raise AuthenticationFailed("Invalid token.")
+
+
+def is_revoked(payload):
+    """
+    Checks both revocation keys of a decoded token in one round-trip.
+    """
+    client = get_redis()
+    try:
+        revoked, revoked_before = client.mget(
+            f'auth:revoked:{payload.get("jti")}', f'auth:revoked_before:{payload["user_id"]}'
+        )
+    except redis.RedisError:
+        # Revocations cannot be checked, refuse rather than accept logged out tokens
+        raise AuthenticationUnavailable()
+    if revoked is not None and payload.get("jti"):
+        return True
+    return revoked_before is not None and payload.get("iat", 0) < float(revoked_before)
+
+
+def revoke_token(payload):
+    """
+    Revokes a single decoded token until it expires (logout).
+    """
+    remaining = int(payload["exp"] - time.time())
+    if payload.get("jti") and remaining > 0:
+        get_redis().setex(f'auth:revoked:{payload["jti"]}', remaining, 1)
+
+
+def revoke_user_tokens(user_id):
+    """
+    Revokes every token issued to a user until now (password change).
+    """
+    get_redis().setex(f'auth:revoked_before:{user_id}', int(REFRESH_TOKEN_LIFETIME.total_seconds()), repr(time.time()))
+
+
+class UserCache:
+    """
+    Cache of the authentication relevant fields of users.
+
+    Entries live for `local_ttl` seconds in-process and `ttl` seconds in Redis.
+    The in-process LRU keeps at most `max_entries` users. Saving or deleting a
+    user invalidates both in this worker once the transaction commits (see
+    signals); other workers may keep their in-process entry for up to `local_ttl`.
+    """
+
+    def __init__(self, ttl=300, local_ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.max_entries = max_entries
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id):
+        return f'auth:user:{user_id}'
+
+    @staticmethod
+    def _build(fields):
+        values = dict(fields, user_id=uuid.UUID(fields['user_id']))
+        # from_db expects the values in the model's field order
+        field_names = [f.attname for f in User._meta.concrete_fields if f.attname in values]
+        return User.from_db('default', field_names, [values[name] for name in field_names])
+
+    def get(self, user_id):
+        """
+        Returns the User, or None when it does not exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._users.move_to_end(user_id)
+            else:
+                entry = None
+        if entry is not None:
+            return self._build(entry[0])
+
+        fields = None
+        client = get_redis()
+        try:
+            cached = client.get(self._key(user_id))
+            fields = json.loads(cached) if cached else None
+        except redis.RedisError:
+            client = None
+
+        if fields is None:
+            fields = User.objects.filter(user_id=user_id).values(*CACHED_USER_FIELDS).first()
+            if fields is None:
+                return None
+            fields['user_id'] = str(fields['user_id'])
+            if client is not None:
+                try:
+                    client.setex(self._key(user_id), self.ttl, json.dumps(fields))
+                except redis.RedisError:
+                    pass
+
+        with self._lock:
+            self._users[user_id] = (fields, now + self.local_ttl)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+        return self._build(fields)
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._users.pop(user_id, None)
+        try:
+            get_redis().delete(self._key(user_id))
+        except redis.RedisError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache(
+    ttl=settings.USER_CACHE['TTL'],
+    local_ttl=settings.USER_CACHE['LOCAL_TTL'],
+    max_entries=settings.USER_CACHE['MAX_ENTRIES'],
+)
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    Authenticates "Authorization: Bearer <access token>" headers.
+    request.auth is set to the decoded token payload.
+    """
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth_header = request.headers.get("Authorization", "")
+        parts = auth_header.split()
+        if len(parts) != 2 or parts[0] != self.keyword:
+            return None
+
+        payload = decode_token(parts[1])
+        try:
+            user_id = str(uuid.UUID(str(payload.get("user_id"))))
+        except ValueError:
+            # Not one of our tokens, e.g. issued by /api/token/ for Django's own users
+            return None
+        if payload.get("type", "access") != "access":
+            raise AuthenticationFailed("Invalid token type.")
+        payload["user_id"] = user_id
+        if is_revoked(payload):
+            raise AuthenticationFailed("Token has been revoked.")
+
+        user = user_cache.get(user_id)
+        if user is None or not user.is_active:
+            raise AuthenticationFailed("User not found.")
+        return user, payload
+
+    def authenticate_header(self, request):
+        return self.keyword
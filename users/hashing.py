@@ -0,0 +1,106 @@
+"""
+Password hashing off the request thread.
+
+Hashes run on a bounded process pool, so login and registration spikes use at
+most WORKERS cores per web worker instead of every request thread. At most
+WORKERS + MAX_QUEUE hashes are in flight; further requests are rejected with a
+503 straight away instead of queueing behind the spike.
+"""
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from nutrition_app.redis_client import CommandMetrics
+
+# Hash and verify timings per hasher algorithm, including the wait for a pool process
+metrics = CommandMetrics()
+
+
+class HashingOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many login attempts in progress, please retry shortly."
+    default_code = 'hashing_overloaded'
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _hash(password):
+    return make_password(password)
+
+
+def _verify(password, encoded):
+    """
+    Returns (valid, new_encoded), new_encoded is set when the hash uses an
+    outdated hasher or cost and should be replaced.
+    """
+    if not encoded:
+        return False, None
+    rehashed = []
+    valid = check_password(password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return valid, (rehashed[0] if rehashed else None)
+
+
+class HashingPool:
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            return self._executor
+
+    def run(self, metric, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.record(metric, 0, failed=True)
+            raise HashingOverloaded()
+        started = time.perf_counter()
+        failed = True
+        try:
+            if self.workers:
+                result = self._get_executor().submit(fn, *args).result()
+            else:
+                # WORKERS = 0 hashes on the request thread, e.g. for tests and development
+                result = fn(*args)
+            failed = False
+            return result
+        except BrokenProcessPool:
+            # A pool process died, start a new pool for the next request
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            self._slots.release()
+            metrics.record(metric, time.perf_counter() - started, failed=failed)
+
+
+pool = HashingPool(settings.PASSWORD_HASHING['WORKERS'], settings.PASSWORD_HASHING['MAX_QUEUE'])
+
+
+def hash_password(password):
+    """
+    Returns the encoded hash of a password using the preferred hasher.
+    """
+    return pool.run(f'{get_hasher().algorithm}.hash', _hash, password)
+
+
+def verify_password(password, encoded):
+    """
+    Returns (valid, new_encoded). Save new_encoded when it is not None, it is
+    the password hashed with the currently configured hasher and cost.
+    """
+    algorithm = (encoded or '').split('$', 1)[0] or 'unusable'
+    return pool.run(f'{algorithm}.verify', _verify, password, encoded)
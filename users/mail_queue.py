@@ -0,0 +1,255 @@
+"""
+Outbound mail queue backed by Redis.
+
+EMAIL_BACKEND points to QueuedEmailBackend, so send_mail() only pushes the
+message to a Redis list and returns. `manage.py mail_worker` drains the list
+in batches and delivers through MAIL_QUEUE['DELIVERY_BACKEND'] (SMTP in
+production, the console or file backend locally), keeping one connection open
+across messages while there is mail to send.
+
+Queue keys:
+- mail:queue - messages waiting to be sent (LPUSH, taken from the right).
+- mail:processing - messages taken by the worker and not yet sent. They are
+  moved back to the queue when the worker starts, so a crash does not lose mail.
+- mail:retry - sorted set of failed messages scored by their next attempt time.
+- mail:dead - messages that failed MAX_ATTEMPTS times, and entries that could
+  not be decoded, kept for inspection.
+
+The worker waits for mail with a blocking pop on a Redis client of its own,
+and keeps retrying with a backoff while Redis is unavailable.
+"""
+
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from nutrition_app.redis_client import create_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'mail:queue'
+PROCESSING_KEY = 'mail:processing'
+RETRY_KEY = 'mail:retry'
+DEAD_KEY = 'mail:dead'
+
+
+def delivery_connection(**kwargs):
+    return get_connection(settings.MAIL_QUEUE['DELIVERY_BACKEND'], **kwargs)
+
+
+def serialize_message(message, attempts=0):
+    return json.dumps({
+        "subject": message.subject,
+        "body": message.body,
+        "from_email": message.from_email,
+        "to": message.to,
+        "cc": message.cc,
+        "bcc": message.bcc,
+        "reply_to": message.reply_to,
+        "headers": message.extra_headers,
+        "alternatives": [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        "attempts": attempts,
+    })
+
+
+def deserialize_message(raw):
+    """
+    Returns (message, attempts) for a queued message.
+    """
+    data = json.loads(raw)
+    attempts = data.pop("attempts")
+    data["alternatives"] = [tuple(alternative) for alternative in data["alternatives"]]
+    return EmailMultiAlternatives(**data), attempts
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Queues messages for the mail worker instead of sending them.
+
+    Messages with attachments, and all messages while Redis is unavailable,
+    are sent right away through the delivery backend so none are lost.
+    """
+
+    def send_messages(self, email_messages):
+        queued = [m for m in email_messages if not m.attachments]
+        direct = [m for m in email_messages if m.attachments]
+        if queued:
+            try:
+                get_redis().lpush(QUEUE_KEY, *(serialize_message(m) for m in queued))
+            except redis.RedisError:
+                logger.warning("Mail queue unavailable, sending %d messages directly", len(queued))
+                direct = email_messages
+        sent = len(email_messages) - len(direct)
+        if direct:
+            sent += delivery_connection(fail_silently=self.fail_silently).send_messages(direct) or 0
+        return sent
+
+
+def deliver(connection, messages):
+    """
+    Sends messages one by one over an open connection and returns the
+    indexes of the failed ones with their errors.
+    """
+    failures = []
+    for index, message in enumerate(messages):
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            failures.append((index, e))
+            # The connection may be left half open, reconnect for the next message
+            connection.close()
+            try:
+                connection.open()
+            except Exception:
+                # The backend opens a connection per message until the server is back
+                pass
+    return failures
+
+
+class MailWorker:
+    REDIS_RETRY_DELAY = 1  # Seconds before reconnecting to Redis, doubled on every further failure
+    MAX_REDIS_RETRY_DELAY = 60
+
+    def __init__(self, batch_size, poll_timeout):
+        # The blocking pop waits poll_timeout seconds, longer than the shared clients may
+        self.client = create_redis(
+            max_connections=1, socket_timeout=poll_timeout + settings.REDIS['SOCKET_TIMEOUT'],
+        )
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.config = settings.MAIL_QUEUE
+        self.connection = delivery_connection(fail_silently=False)
+        self.connection_open = False
+        self.stopping = False
+        self._wake = threading.Event()
+
+    def stop(self):
+        """
+        Stops the worker after the current batch.
+        """
+        self.stopping = True
+        self._wake.set()
+
+    def requeue_unfinished(self):
+        """
+        Moves messages left over by a stopped or crashed worker back to the queue.
+        """
+        moved = 0
+        while self.client.lmove(PROCESSING_KEY, QUEUE_KEY, 'RIGHT', 'RIGHT'):
+            moved += 1
+        return moved
+
+    def requeue_due_retries(self):
+        due = self.client.zrangebyscore(RETRY_KEY, '-inf', time.time(), start=0, num=self.batch_size)
+        if due:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.zrem(RETRY_KEY, *due)
+            pipe.rpush(QUEUE_KEY, *due)
+            pipe.execute()
+
+    def take_batch(self):
+        """
+        Waits up to poll_timeout seconds for mail and returns up to batch_size messages.
+        """
+        first = self.client.blmove(QUEUE_KEY, PROCESSING_KEY, self.poll_timeout, 'RIGHT', 'LEFT')
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < self.batch_size:
+            raw = self.client.lmove(QUEUE_KEY, PROCESSING_KEY, 'RIGHT', 'LEFT')
+            if raw is None:
+                break
+            batch.append(raw)
+        return batch
+
+    def process(self, batch):
+        """
+        Sends a batch, schedules failed messages for a retry and returns (sent, failed).
+        """
+        messages, undecodable = [], []
+        for raw in batch:
+            try:
+                messages.append((raw, *deserialize_message(raw)))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # Retrying cannot help, keep it for inspection instead of failing the whole batch
+                logger.error("Moving an undecodable mail entry to %s: %s", DEAD_KEY, e)
+                undecodable.append(raw)
+        if not self.connection_open and messages:
+            try:
+                self.connection.open()
+                self.connection_open = True
+            except Exception as e:
+                # Sending fails per message below and is retried later
+                logger.warning("Cannot connect to the mail server: %s", e)
+        failures = dict(deliver(self.connection, [message for _, message, _ in messages]))
+
+        pipe = self.client.pipeline(transaction=True)
+        for raw in undecodable:
+            pipe.lrem(PROCESSING_KEY, 1, raw)
+            pipe.lpush(DEAD_KEY, raw)
+        for index, (raw, message, attempts) in enumerate(messages):
+            pipe.lrem(PROCESSING_KEY, 1, raw)
+            if index not in failures:
+                continue
+            attempts += 1
+            logger.warning("Sending mail to %s failed (attempt %d): %s", message.to, attempts, failures[index])
+            if attempts >= self.config['MAX_ATTEMPTS']:
+                pipe.lpush(DEAD_KEY, serialize_message(message, attempts))
+            else:
+                delay = min(self.config['RETRY_DELAY'] * 2 ** (attempts - 1), self.config['MAX_RETRY_DELAY'])
+                pipe.zadd(RETRY_KEY, {serialize_message(message, attempts): time.time() + delay})
+        pipe.execute()
+        return len(messages) - len(failures), len(failures) + len(undecodable)
+
+    def close(self):
+        if self.connection_open:
+            self.connection.close()
+            self.connection_open = False
+
+    def run(self, once=False):
+        """
+        Drains the queue until stopped, or until it is empty when once=True.
+
+        Redis errors are retried with a backoff until Redis is back, except
+        with once=True, where they are raised.
+        """
+        failures = 0
+        requeue = True
+        try:
+            while not self.stopping:
+                try:
+                    if requeue:
+                        # Also takes back a batch interrupted by a Redis error, which may resend some of it
+                        moved = self.requeue_unfinished()
+                        if moved:
+                            logger.info("Requeued %d unfinished messages", moved)
+                        requeue = False
+                    self.requeue_due_retries()
+                    batch = self.take_batch()
+                    if batch:
+                        sent, failed = self.process(batch)
+                        logger.info("Sent %d queued messages, %d failed", sent, failed)
+                    failures = 0
+                except redis.RedisError as e:
+                    if once:
+                        raise
+                    failures += 1
+                    requeue = True
+                    delay = min(self.REDIS_RETRY_DELAY * 2 ** (failures - 1), self.MAX_REDIS_RETRY_DELAY)
+                    logger.warning("Mail queue unavailable, retrying in %s s: %s", delay, e)
+                    self.close()
+                    self._wake.wait(delay)
+                    continue
+                if not batch:
+                    # Do not hold the SMTP session open while there is nothing to send
+                    self.close()
+                    if once:
+                        break
+        finally:
+            self.close()
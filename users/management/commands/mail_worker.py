@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.mail_queue import MailWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers mail queued by users.mail_queue.QueuedEmailBackend. Run one "
+        "worker next to the web workers; SIGTERM stops it after the current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Messages sent per batch")
+        parser.add_argument('--poll-timeout', type=int, default=5, help="Seconds to wait for mail before checking retries")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        worker = MailWorker(batch_size=options['batch_size'], poll_timeout=options['poll_timeout'])
+
+        def stop(signum, frame):
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS("Mail worker stopped."))
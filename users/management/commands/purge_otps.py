@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from users.models import OTPVerification
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired rows of the OTPVerification table in batches, so each "
+        "delete holds the write lock only briefly. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted per statement")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        cutoff = now()
+        expired = OTPVerification.objects.filter(expires_at__lt=cutoff)
+        purged = 0
+        while True:
+            batch = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            purged += OTPVerification.objects.filter(pk__in=batch).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired OTPs."))
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_add_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='otpverification',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='otpverification',
+            index=models.Index(fields=['expires_at'], name='users_otpve_expires_4f8a2d_idx'),
+        ),
+    ]
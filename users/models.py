@@ -65,6 +65,13 @@ class OTPVerification(models.Model):
     email = models.EmailField()
     otp_code = models.CharField(max_length=6)
     expires_at = models.DateTimeField()
-    
+    attempts = models.PositiveSmallIntegerField(default=0)  # Failed verifications, see users.otp
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['email', 'expires_at']),  # Latest unexpired OTP of an email, see users.otp
+            models.Index(fields=['expires_at']),  # purge_otps
+        ]
+
     def __str__(self):
         return f"OTP for {self.email}"
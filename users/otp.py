@@ -0,0 +1,109 @@
+"""
+One-time passwords for email verification.
+
+OTPs are kept in Redis - hash per email: otp:{email} => { code, attempts } -
+and expire natively after TTL seconds. With BACKEND = 'db', or while Redis is
+unavailable, they are stored in the OTPVerification table instead, whose
+expired rows are removed by `manage.py purge_otps`.
+
+Every wrong code counts as an attempt; after MAX_ATTEMPTS the OTP is burned,
+so a 6 digit code cannot be brute forced within its lifetime.
+"""
+
+import datetime
+
+import redis
+from django.conf import settings
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.timezone import now
+
+from nutrition_app.redis_client import get_redis
+from .models import OTPVerification
+
+r = get_redis()
+
+VERIFIED = 'verified'
+INVALID = 'invalid'  # Wrong, expired or never issued
+LOCKED = 'locked'  # Too many wrong codes
+
+# Checks a code, counting failed attempts and burning the OTP after too many.
+# KEYS[1] = otp key, ARGV = code, max attempts
+# Returns 1 when verified, 0 when wrong, -1 when missing, -2 when burned now
+_VERIFY_SCRIPT = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then
+    return -1
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return -2
+end
+return 0
+"""
+_verify = r.register_script(_VERIFY_SCRIPT)
+
+_RESULTS = {1: VERIFIED, 0: INVALID, -2: LOCKED}
+
+
+def otp_key(email):
+    return f'otp:{email}'
+
+
+def issue_otp(email):
+    """
+    Creates a new OTP for an email, replacing any previous one, and returns the code.
+    """
+    config = settings.OTP
+    code = get_random_string(length=6, allowed_chars='0123456789')
+    if config['BACKEND'] == 'redis':
+        key = otp_key(email)
+        try:
+            pipe = r.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.hset(key, mapping={'code': code, 'attempts': 0})
+            pipe.expire(key, config['TTL'])
+            pipe.execute()
+            return code
+        except redis.RedisError:
+            pass
+
+    OTPVerification.objects.filter(email=email).delete()
+    OTPVerification.objects.create(
+        email=email, otp_code=code, expires_at=now() + datetime.timedelta(seconds=config['TTL'])
+    )
+    return code
+
+
+def verify_otp(email, code):
+    """
+    Returns VERIFIED, INVALID or LOCKED. A verified OTP is consumed.
+    """
+    config = settings.OTP
+    if config['BACKEND'] == 'redis':
+        try:
+            result = _verify(keys=[otp_key(email)], args=[str(code), config['MAX_ATTEMPTS']])
+        except redis.RedisError:
+            result = -1
+        if result != -1:
+            return _RESULTS[result]
+        # Not in Redis, it may have been issued to the database while Redis was down
+    return _verify_stored_otp(email, str(code), config['MAX_ATTEMPTS'])
+
+
+def _verify_stored_otp(email, code, max_attempts):
+    otp = OTPVerification.objects.filter(email=email, expires_at__gt=now()).order_by('-expires_at').first()
+    if otp is None:
+        return INVALID
+    if constant_time_compare(otp.otp_code, code):
+        otp.delete()
+        return VERIFIED
+    if otp.attempts + 1 >= max_attempts:
+        otp.delete()
+        return LOCKED
+    OTPVerification.objects.filter(pk=otp.pk).update(attempts=F('attempts') + 1)
+    return INVALID
@@ -1,3 +1,437 @@
-from django.test import TestCase
+import datetime
+import io
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+from django.conf import settings
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
+from rest_framework.exceptions import AuthenticationFailed
+
+from nutrition_app.redis_client import get_redis
+from nutrition_app.testing import QueryPlanAssertions
+from . import hashing, mail_queue, otp
+from .authentication import JWTAuthentication, UserCache, issue_token, user_cache
+from .models import OTPVerification, User
+
+
+@skipUnless(connection.vendor == "sqlite", "Asserts on SQLite's EXPLAIN QUERY PLAN output")
+class UserQueryPlanTests(QueryPlanAssertions, TestCase):
+    def test_latest_unexpired_otp_of_an_email(self):
+        self.assertIndexSearch(
+            OTPVerification.objects.filter(email="a@example.com", expires_at__gt=now()).order_by("-expires_at")[:1]
+        )
+
+    def test_expired_otp_lookup(self):
+        self.assertIndexSearch(OTPVerification.objects.filter(expires_at__lt=now()).values_list("pk"))
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create(full_name="A", email="a@example.com", password_hash="x", role="owner")
+        self.addCleanup(user_cache.invalidate, self.user.user_id)
+
+    def test_builds_user_and_serves_repeat_lookups_without_queries(self):
+        user = user_cache.get(str(self.user.user_id))
+        self.assertEqual((user.pk, user.email, user.role), (self.user.pk, "a@example.com", "owner"))
+        with self.assertNumQueries(0):
+            user_cache.get(str(self.user.user_id))
+        # The password hash is not cached, it is loaded on access
+        with self.assertNumQueries(1):
+            self.assertEqual(user.password_hash, "x")
+
+    def test_saving_the_user_invalidates_it_on_commit(self):
+        user_cache.get(str(self.user.user_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.full_name = "B"
+            self.user.save()
+            # Not committed yet, a lookup must not replace the cached row with the old one
+            self.assertEqual(user_cache.get(str(self.user.user_id)).full_name, "A")
+        self.assertEqual(user_cache.get(str(self.user.user_id)).full_name, "B")
+
+    def test_keeps_the_most_recently_used_users(self):
+        cache = UserCache(max_entries=2)
+        users = [self.user] + [
+            User.objects.create(full_name=name, email=f"{name}@example.com") for name in ("b", "c")
+        ]
+        for user in users:
+            self.addCleanup(cache.invalidate, user.user_id)
+        cache.get(str(users[0].user_id))
+        cache.get(str(users[1].user_id))
+        cache.get(str(users[0].user_id))
+        cache.get(str(users[2].user_id))
+        self.assertEqual(list(cache._users), [str(users[0].user_id), str(users[2].user_id)])
+
+    def test_unknown_user(self):
+        self.assertIsNone(user_cache.get("00000000-0000-0000-0000-000000000000"))
+
+
+def pbkdf2(iterations):
+    return {'PBKDF2_ITERATIONS': iterations, 'WORKERS': 0, 'MAX_QUEUE': 0}
+
+
+@mock.patch.object(hashing, 'pool', hashing.HashingPool(workers=0, max_queue=0))
+class PasswordHashingTests(TestCase):
+    @override_settings(PASSWORD_HASHING=pbkdf2(1000))
+    def test_verify(self):
+        encoded = hashing.hash_password("secret")
+        self.assertEqual(hashing.verify_password("secret", encoded), (True, None))
+        self.assertEqual(hashing.verify_password("wrong", encoded), (False, None))
+        self.assertEqual(hashing.verify_password("secret", None), (False, None))
+
+    def test_rehashes_when_the_cost_changes(self):
+        with override_settings(PASSWORD_HASHING=pbkdf2(1000)):
+            encoded = hashing.hash_password("secret")
+        with override_settings(PASSWORD_HASHING=pbkdf2(2000)):
+            valid, new_encoded = hashing.verify_password("secret", encoded)
+        self.assertTrue(valid)
+        self.assertTrue(new_encoded.startswith("pbkdf2_sha256$2000$"))
+
+    def test_rejects_hashes_beyond_the_queue_limit(self):
+        hashing.pool._slots.acquire()
+        self.addCleanup(hashing.pool._slots.release)
+        with self.assertRaises(hashing.HashingOverloaded):
+            hashing.hash_password("secret")
+
+
+@mock.patch.object(hashing, 'pool', hashing.HashingPool(workers=0, max_queue=0))
+@override_settings(PASSWORD_HASHING=pbkdf2(1000))
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        try:
+            get_redis().ping()
+        except redis.RedisError:
+            self.skipTest("Revocations need Redis")
+        self.user = User.objects.create(
+            full_name="A", email="a@example.com", password_hash=hashing.hash_password("secret")
+        )
+        self.addCleanup(user_cache.invalidate, self.user.user_id)
+        self.addCleanup(get_redis().delete, f"auth:revoked_before:{self.user.user_id}")
+
+    def login(self, password="secret"):
+        response = self.client.post("/users/auth/login", {"email": "a@example.com", "password": password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def authenticate(self, access_token):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        return JWTAuthentication().authenticate(request)
+
+    def refresh(self, refresh_token):
+        return self.client.post("/users/auth/refresh", {"refresh_token": refresh_token})
+
+    def test_password_change_revokes_earlier_tokens_only(self):
+        tokens = self.login()
+        self.assertEqual(self.authenticate(tokens["access_token"])[0].pk, self.user.pk)
+        response = self.client.post(
+            "/users/auth/password-reset",
+            {"user_id": str(self.user.user_id), "old_password": "secret", "new_password": "better"},
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaisesMessage(AuthenticationFailed, "revoked"):
+            self.authenticate(tokens["access_token"])
+        self.assertEqual(self.refresh(tokens["refresh_token"]).status_code, 401)
+        # Logging in within the same second as the change
+        tokens = self.login("better")
+        self.assertEqual(self.authenticate(tokens["access_token"])[0].pk, self.user.pk)
+        self.assertEqual(self.refresh(tokens["refresh_token"]).status_code, 200)
+
+    def test_refresh_rejects_access_and_logged_out_tokens(self):
+        tokens = self.login()
+        self.assertEqual(self.refresh(tokens["access_token"]).status_code, 401)
+        self.assertEqual(self.refresh("not-a-token").status_code, 401)
+        new_access_token = self.refresh(tokens["refresh_token"]).json()["access_token"]
+        with self.assertRaisesMessage(AuthenticationFailed, "Invalid token type"):
+            self.authenticate(tokens["refresh_token"])
+
+        response = self.client.post(
+            "/users/auth/logout", {"refresh_token": tokens["refresh_token"]},
+            HTTP_AUTHORIZATION=f"Bearer {new_access_token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(tokens["refresh_token"]).status_code, 401)
+        with self.assertRaisesMessage(AuthenticationFailed, "revoked"):
+            self.authenticate(new_access_token)
+        # Other sessions go on
+        self.assertEqual(self.authenticate(tokens["access_token"])[0].pk, self.user.pk)
+
+
+class RedisHealthTests(TestCase):
+    url = "/health/redis"
+
+    def test_metrics_are_for_admins(self):
+        response = self.client.get(self.url)
+        self.assertIn(response.status_code, (200, 503))
+        self.assertEqual(set(response.json()), {"status"})
+        if response.status_code == 503:
+            self.skipTest("Authenticating the admin needs Redis")
+
+        user = User.objects.create(full_name="A", email="a@example.com")
+        admin = User.objects.create_superuser("admin@example.com", "Admin", "secret")
+        self.addCleanup(user_cache.invalidate, user.user_id)
+        self.addCleanup(user_cache.invalidate, admin.user_id)
+        for account, fields in ((user, {"status"}), (admin, {"status", "latency_ms", "pools", "commands"})):
+            response = self.client.get(
+                self.url, HTTP_AUTHORIZATION=f"Bearer {issue_token(account.user_id, 'access')}"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.json()), fields)
+
+
+@override_settings(OTP={'BACKEND': 'redis', 'TTL': 300, 'MAX_ATTEMPTS': 3})
+class RedisOTPTests(TestCase):
+    def setUp(self):
+        self.key = otp.otp_key("a@example.com")
+        try:
+            get_redis().delete(self.key)
+        except redis.RedisError:
+            self.skipTest("The Redis OTP backend needs Redis")
+        self.addCleanup(get_redis().delete, self.key)
+
+    def wrong(self, code):
+        return "000000" if code != "000000" else "111111"
+
+    def test_otps_are_kept_in_redis_and_used_once(self):
+        code = otp.issue_otp("a@example.com")
+        self.assertFalse(OTPVerification.objects.exists())
+        self.assertGreater(get_redis().ttl(self.key), 290)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.VERIFIED)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.INVALID)
+
+    def test_wrong_codes_burn_the_otp(self):
+        code = otp.issue_otp("a@example.com")
+        self.assertEqual(otp.verify_otp("a@example.com", self.wrong(code)), otp.INVALID)
+        self.assertEqual(get_redis().hget(self.key, "attempts"), "1")
+        self.assertEqual(otp.verify_otp("a@example.com", self.wrong(code)), otp.INVALID)
+        self.assertEqual(otp.verify_otp("a@example.com", self.wrong(code)), otp.LOCKED)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.INVALID)
+
+    def test_reissuing_resets_the_attempts(self):
+        code = otp.issue_otp("a@example.com")
+        otp.verify_otp("a@example.com", self.wrong(code))
+        otp.verify_otp("a@example.com", self.wrong(code))
+        code = otp.issue_otp("a@example.com")
+        self.assertEqual(otp.verify_otp("a@example.com", self.wrong(code)), otp.INVALID)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.VERIFIED)
+
+    def test_expired_otps_are_invalid(self):
+        code = otp.issue_otp("a@example.com")
+        get_redis().pexpire(self.key, 1)
+        time.sleep(0.01)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.INVALID)
+
+
+@override_settings(OTP={'BACKEND': 'db', 'TTL': 300, 'MAX_ATTEMPTS': 3})
+class DatabaseOTPTests(TestCase):
+    def test_verify_consumes_the_otp(self):
+        code = otp.issue_otp("a@example.com")
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.VERIFIED)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.INVALID)
+
+    def test_reissuing_replaces_the_previous_otp(self):
+        otp.issue_otp("a@example.com")
+        code = otp.issue_otp("a@example.com")
+        self.assertEqual(OTPVerification.objects.filter(email="a@example.com").count(), 1)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.VERIFIED)
+
+    def test_wrong_codes_burn_the_otp(self):
+        code = otp.issue_otp("a@example.com")
+        wrong = "000000" if code != "000000" else "111111"
+        self.assertEqual(otp.verify_otp("a@example.com", wrong), otp.INVALID)
+        self.assertEqual(otp.verify_otp("a@example.com", wrong), otp.INVALID)
+        self.assertEqual(otp.verify_otp("a@example.com", wrong), otp.LOCKED)
+        self.assertEqual(otp.verify_otp("a@example.com", code), otp.INVALID)
+
+    def test_purge_otps_deletes_only_expired_rows(self):
+        expired = now() - datetime.timedelta(seconds=1)
+        OTPVerification.objects.bulk_create(
+            OTPVerification(email=f"{i}@example.com", otp_code="123456", expires_at=expired) for i in range(5)
+        )
+        otp.issue_otp("a@example.com")
+        call_command("purge_otps", batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(OTPVerification.objects.values_list("email", flat=True)), ["a@example.com"])
+
+
+class RecordingBackend(locmem.EmailBackend):
+    """
+    Delivery backend recording the connections opened and used.
+    """
+
+    opened = []
+    used = []
+
+    def open(self):
+        RecordingBackend.opened.append(self)
+
+    def send_messages(self, messages):
+        RecordingBackend.used.append(self)
+        return super().send_messages(messages)
+
+
+MAIL_QUEUE_SETTINGS = {
+    'DELIVERY_BACKEND': 'users.tests.RecordingBackend', 'MAX_ATTEMPTS': 3, 'RETRY_DELAY': 30, 'MAX_RETRY_DELAY': 45,
+}
+
+
+@override_settings(MAIL_QUEUE=MAIL_QUEUE_SETTINGS)
+class MailQueueTests(TestCase):
+    def setUp(self):
+        RecordingBackend.opened.clear()
+        RecordingBackend.used.clear()
+
+    def message(self, subject="OTP"):
+        return mail.EmailMessage(subject, "Body", "a@example.com", ["b@example.com"])
+
+    def test_serialization_round_trip(self):
+        message = mail.EmailMultiAlternatives("Subject", "Body", "a@example.com", ["b@example.com"], cc=["c@example.com"])
+        message.attach_alternative("<p>Body</p>", "text/html")
+        restored, attempts = mail_queue.deserialize_message(mail_queue.serialize_message(message, attempts=2))
+        self.assertEqual(attempts, 2)
+        for attr in ("subject", "body", "from_email", "to", "cc", "bcc", "reply_to", "extra_headers"):
+            self.assertEqual(getattr(restored, attr), getattr(message, attr))
+        self.assertEqual(list(restored.alternatives), [("<p>Body</p>", "text/html")])
+
+    def test_deliver_sends_over_one_connection(self):
+        connection = mail_queue.delivery_connection()
+        connection.open()
+        messages = [self.message(f"OTP {i}") for i in range(3)]
+        self.assertEqual(mail_queue.deliver(connection, messages), [])
+        self.assertEqual([m.subject for m in mail.outbox], ["OTP 0", "OTP 1", "OTP 2"])
+        self.assertEqual(RecordingBackend.opened, [connection])
+        self.assertEqual(RecordingBackend.used, [connection] * 3)
+
+
+@override_settings(MAIL_QUEUE=MAIL_QUEUE_SETTINGS)
+class MailWorkerTests(TestCase):
+    """
+    Runs the worker against the mail keys of the configured Redis.
+    """
+
+    def setUp(self):
+        self.client = get_redis()
+        keys = (mail_queue.QUEUE_KEY, mail_queue.PROCESSING_KEY, mail_queue.RETRY_KEY, mail_queue.DEAD_KEY)
+        try:
+            in_use = self.client.exists(*keys)
+        except redis.RedisError:
+            self.skipTest("The mail queue needs Redis")
+        if in_use:
+            self.skipTest("The mail queue of the configured Redis holds mail")
+        self.addCleanup(self.client.delete, *keys)
+        RecordingBackend.opened.clear()
+        RecordingBackend.used.clear()
+
+    def message(self, subject="OTP"):
+        return mail.EmailMessage(subject, "Body", "a@example.com", ["b@example.com"])
+
+    def run_worker(self):
+        worker = mail_queue.MailWorker(batch_size=10, poll_timeout=0.01)
+        worker.run(once=True)
+        return worker
+
+    def test_backend_queues_and_the_worker_sends_over_one_connection(self):
+        backend = mail_queue.QueuedEmailBackend()
+        self.assertEqual(backend.send_messages([self.message(f"OTP {i}") for i in range(3)]), 3)
+        self.assertEqual(self.client.llen(mail_queue.QUEUE_KEY), 3)
+        self.assertEqual(mail.outbox, [])
+
+        self.run_worker()
+        self.assertEqual([m.subject for m in mail.outbox], ["OTP 0", "OTP 1", "OTP 2"])
+        self.assertEqual(len(RecordingBackend.opened), 1)
+        self.assertEqual(RecordingBackend.used, RecordingBackend.opened * 3)
+        self.assertEqual(self.client.llen(mail_queue.PROCESSING_KEY), 0)
+
+    def test_messages_with_attachments_are_sent_directly(self):
+        message = self.message()
+        message.attach("menu.csv", "name,price", "text/csv")
+        self.assertEqual(mail_queue.QueuedEmailBackend().send_messages([message]), 1)
+        self.assertEqual(self.client.llen(mail_queue.QUEUE_KEY), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(
+        MAIL_QUEUE=dict(MAIL_QUEUE_SETTINGS, DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend'),
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=1, EMAIL_TIMEOUT=1,
+    )
+    def test_failures_are_retried_with_backoff_then_dead_lettered(self):
+        # Nothing listens on port 1, every send fails
+        for attempts in range(3):
+            message = self.message(f"OTP {attempts}")
+            self.client.lpush(mail_queue.QUEUE_KEY, mail_queue.serialize_message(message, attempts))
+        started = time.time()
+        with self.assertLogs("users.mail_queue", "WARNING") as logs:
+            self.run_worker()
+        self.assertEqual(sum("failed (attempt" in line for line in logs.output), 3)
+
+        retries = {
+            mail_queue.deserialize_message(raw)[0].subject: (mail_queue.deserialize_message(raw)[1], due - started)
+            for raw, due in self.client.zrange(mail_queue.RETRY_KEY, 0, -1, withscores=True)
+        }
+        self.assertEqual(set(retries), {"OTP 0", "OTP 1"})
+        # 30 seconds, then doubled up to MAX_RETRY_DELAY
+        self.assertEqual(retries["OTP 0"][0], 1)
+        self.assertAlmostEqual(retries["OTP 0"][1], 30, delta=5)
+        self.assertEqual(retries["OTP 1"][0], 2)
+        self.assertAlmostEqual(retries["OTP 1"][1], 45, delta=5)
+        dead = [mail_queue.deserialize_message(raw) for raw in self.client.lrange(mail_queue.DEAD_KEY, 0, -1)]
+        self.assertEqual([(message.subject, attempts) for message, attempts in dead], [("OTP 2", 3)])
+
+        # Due retries go back to the queue
+        self.client.zadd(mail_queue.RETRY_KEY, {raw: 0 for raw in self.client.zrange(mail_queue.RETRY_KEY, 0, -1)})
+        with override_settings(MAIL_QUEUE=MAIL_QUEUE_SETTINGS):
+            self.run_worker()
+        self.assertEqual(sorted(m.subject for m in mail.outbox), ["OTP 0", "OTP 1"])
+        self.assertEqual(self.client.zcard(mail_queue.RETRY_KEY), 0)
+
+    def test_undecodable_entries_are_dead_lettered(self):
+        self.client.lpush(mail_queue.QUEUE_KEY, "not json", '{"subject": "no attempts"}', "[]")
+        mail_queue.QueuedEmailBackend().send_messages([self.message()])
+        with self.assertLogs("users.mail_queue", "ERROR") as logs:
+            self.run_worker()
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual([m.subject for m in mail.outbox], ["OTP"])
+        self.assertEqual(
+            sorted(self.client.lrange(mail_queue.DEAD_KEY, 0, -1)), ["[]", "not json", '{"subject": "no attempts"}']
+        )
+        self.assertEqual(self.client.llen(mail_queue.PROCESSING_KEY), 0)
+
+    def test_waits_for_mail_longer_than_the_socket_timeout(self):
+        with override_settings(REDIS=dict(settings.REDIS, SOCKET_TIMEOUT=0.1)):
+            worker = mail_queue.MailWorker(batch_size=10, poll_timeout=0.5)
+        started = time.monotonic()
+        worker.run(once=True)
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+    def test_redis_errors_are_retried_with_backoff(self):
+        worker = mail_queue.MailWorker(batch_size=10, poll_timeout=0.01)
+        worker.REDIS_RETRY_DELAY = 0.01
+        self.client.lpush(mail_queue.PROCESSING_KEY, mail_queue.serialize_message(self.message()))
+        take_batch = worker.take_batch
+        calls = []
+
+        def flaky_take_batch():
+            calls.append(len(calls))
+            if len(calls) <= 2:
+                raise redis.ConnectionError("Connection refused")
+            if len(calls) == 4:
+                worker.stop()
+            return take_batch()
+
+        with mock.patch.object(worker, 'take_batch', flaky_take_batch), \
+                mock.patch.object(worker._wake, 'wait', wraps=worker._wake.wait) as wait, \
+                self.assertLogs("users.mail_queue", "WARNING") as logs:
+            worker.run()
+        self.assertEqual([call.args for call in wait.call_args_list], [(0.01,), (0.02,)])
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual([m.subject for m in mail.outbox], ["OTP"])
+        self.assertEqual(self.client.llen(mail_queue.PROCESSING_KEY), 0)
+
+    def test_redis_errors_stop_a_single_run(self):
+        worker = mail_queue.MailWorker(batch_size=10, poll_timeout=0.01)
+        with mock.patch.object(worker, 'take_batch', side_effect=redis.ConnectionError("Connection refused")):
+            with self.assertRaises(redis.ConnectionError):
+                worker.run(once=True)
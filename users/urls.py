@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RegisterView, LoginView, LogoutView, VerifyEmailView, RefreshTokenView, UserProfileView, PasswordResetView
+from .views import RegisterView, LoginView, LogoutView, VerifyEmailView, RefreshTokenView, UserProfileView, PasswordResetView, HashingStatsView
 
 urlpatterns = [
     path('auth/register', RegisterView.as_view(), name='register'),
@@ -8,5 +8,6 @@ urlpatterns = [
     path('auth/logout', LogoutView.as_view(), name='logout'),
     path('auth/refresh', RefreshTokenView.as_view(), name='refresh-token'),
     path('auth/password-reset', PasswordResetView.as_view(), name='password-reset'),
+    path('auth/hashing/stats', HashingStatsView.as_view(), name='hashing-stats'),
     path('profile/<str:user_id>', UserProfileView.as_view(), name='user-profile'),
 ]
@@ -1,22 +1,20 @@
 from django.contrib.auth import authenticate
-from django.contrib.auth.hashers import make_password, check_password
-from django.utils.crypto import get_random_string
-from django.utils.timezone import now
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.exceptions import AuthenticationFailed
 from django.core.mail import send_mail
-from .models import User, OTPVerification
-import jwt, datetime, redis
+from .models import User
+import jwt
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-# Redis connection
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+from . import hashing, otp
+from .hashing import hash_password, verify_password
+from .authentication import JWTAuthentication, decode_token, is_revoked, issue_token, revoke_token, revoke_user_tokens
 
 class RegisterView(APIView):
     """
@@ -50,7 +48,7 @@ class RegisterView(APIView):
     )
     def post(self, request):
         data = request.data
-        password_hash = make_password(data['password'])
+        password_hash = hash_password(data['password'])
         user = User.objects.create(
             full_name=data['full_name'],
             email=data['email'],
@@ -58,8 +56,7 @@ class RegisterView(APIView):
             phone_number=data['phone_number'],
             role=data.get('role', 'customer')
         )
-        otp_code = get_random_string(length=6, allowed_chars='0123456789')
-        OTPVerification.objects.create(email=user.email, otp_code=otp_code, expires_at=now() + datetime.timedelta(minutes=5))
+        otp_code = otp.issue_otp(user.email)
         send_mail('Verify Your Email', f'Your OTP code is {otp_code}', 'noreply@example.com', [user.email])
         response= Response({"message": "User registered successfully. Verify email to continue.", "user_id": str(user.user_id)}, status=status.HTTP_201_CREATED)
         response["Access-Control-Allow-Origin"] = "*"
@@ -92,13 +89,14 @@ class VerifyEmailView(APIView):
     )
     def post(self, request):
         data = request.data
-        otp_record = OTPVerification.objects.filter(email=data['email'], otp_code=data['otp']).first()
-        if not otp_record or otp_record.expires_at < now():
+        result = otp.verify_otp(data['email'], data['otp'])
+        if result == otp.LOCKED:
+            return Response({"message": "Too many failed attempts, the OTP is no longer valid."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if result != otp.VERIFIED:
             return Response({"message": "Invalid or expired OTP."}, status=status.HTTP_400_BAD_REQUEST)
         user = User.objects.get(email=data['email'])
         user.is_active = True
         user.save()
-        otp_record.delete()
         response = Response({"message": "Email verified successfully."}, status=status.HTTP_200_OK)
         response["Access-Control-Allow-Origin"] = "*"
         return response
@@ -134,11 +132,17 @@ class LoginView(APIView):
     def post(self, request):
         data = request.data
         user = User.objects.filter(email=data['email']).first()
-        if not user or not check_password(data['password'], user.password_hash):
+        if not user:
+            return Response({"message": "Invalid credentials."}, status=status.HTTP_401_UNAUTHORIZED)
+        valid, new_password_hash = verify_password(data['password'], user.password_hash)
+        if not valid:
             return Response({"message": "Invalid credentials."}, status=status.HTTP_401_UNAUTHORIZED)
-        access_token = jwt.encode({"user_id": str(user.user_id), "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=15)}, settings.SECRET_KEY, algorithm='HS256')
-        refresh_token = jwt.encode({"user_id": str(user.user_id), "exp": datetime.datetime.utcnow() + datetime.timedelta(days=7)}, settings.SECRET_KEY, algorithm='HS256')
-        redis_client.setex(f'session:{user.user_id}', 900, access_token)
+        if new_password_hash:
+            # The configured hasher or cost changed since this password was set
+            User.objects.filter(user_id=user.user_id).update(password_hash=new_password_hash)
+        # Tokens are stateless, JWTAuthentication validates them without a session lookup
+        access_token = issue_token(user.user_id, 'access')
+        refresh_token = issue_token(user.user_id, 'refresh')
         response= Response({"access_token": access_token, "refresh_token": refresh_token, "user_id": str(user.user_id), "expires_in": 900}, status=status.HTTP_200_OK)
         response["Access-Control-Allow-Origin"] = "*"
         return response
@@ -153,7 +157,8 @@ class LogoutView(APIView):
         request_body=openapi.Schema(
             type=openapi.TYPE_OBJECT,
             properties={
-                'user_id': openapi.Schema(type=openapi.TYPE_STRING)
+                'user_id': openapi.Schema(type=openapi.TYPE_STRING),
+                'refresh_token': openapi.Schema(type=openapi.TYPE_STRING)
             }
         ),
         responses={
@@ -168,8 +173,15 @@ class LogoutView(APIView):
         }
     )
     def post(self, request):
-        user_id = request.data.get('user_id')
-        redis_client.delete(f'session:{user_id}')
+        # Revoke the access token of this request and, when given, its refresh token
+        if isinstance(request.auth, dict):
+            revoke_token(request.auth)
+        refresh_token = request.data.get('refresh_token')
+        if refresh_token:
+            try:
+                revoke_token(decode_token(refresh_token))
+            except AuthenticationFailed:
+                pass
         response= Response({"message": "User logged out successfully."}, status=status.HTTP_200_OK)
         response["Access-Control-Allow-Origin"] = "*"
         return response
@@ -181,40 +193,23 @@ class RefreshTokenView(APIView):
         refresh_token = request.data.get('refresh_token')
         try:
             decoded = jwt.decode(refresh_token, settings.SECRET_KEY, algorithms=['HS256'])
-            user_id = decoded['user_id']
-            new_access_token = jwt.encode({"user_id": user_id, "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=15)}, settings.SECRET_KEY, algorithm='HS256')
-            redis_client.setex(f'session:{user_id}', 900, new_access_token)
-            response = Response({"access_token": new_access_token, "expires_in": 900}, status=status.HTTP_200_OK)
-            response["Access-Control-Allow-Origin"] = "*"
-            return response
         except jwt.ExpiredSignatureError:
             return Response({"message": "Refresh token expired."}, status=status.HTTP_401_UNAUTHORIZED)
+        except jwt.InvalidTokenError:
+            return Response({"message": "Invalid refresh token."}, status=status.HTTP_401_UNAUTHORIZED)
+        if decoded.get('type', 'refresh') != 'refresh' or is_revoked(decoded):
+            return Response({"message": "Invalid refresh token."}, status=status.HTTP_401_UNAUTHORIZED)
+        new_access_token = issue_token(decoded['user_id'], 'access')
+        response = Response({"access_token": new_access_token, "expires_in": 900}, status=status.HTTP_200_OK)
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
 
 # Function to extract user from JWT token
 def get_user_from_token(request):
-    auth_header = request.headers.get("Authorization", None)
-    if not auth_header or not auth_header.startswith("Bearer "):
+    result = JWTAuthentication().authenticate(request)
+    if result is None:
         raise AuthenticationFailed("Authentication token missing or invalid.")
-
-    token = auth_header.split(" ")[1]  # Extract token from "Bearer <token>"
-
-    try:
-        decoded_token = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded_token.get("user_id")
-
-        if not user_id:
-            raise AuthenticationFailed("Invalid token payload.")
-
-        user = User.objects.filter(user_id=user_id).first()
-        if not user:
-            raise AuthenticationFailed("User not found.")
-
-        return user
-
-    except jwt.ExpiredSignatureError:
-        raise AuthenticationFailed("Token has expired.")
-    except jwt.InvalidTokenError:
-        raise AuthenticationFailed("Invalid token.")
+    return result[0]
 
 class UserProfileView(APIView):
     """
@@ -269,11 +264,25 @@ class PasswordResetView(APIView):
         user = get_object_or_404(User, user_id=user_id)
 
         # Check if the old password is correct
-        if not check_password(old_password, user.password_hash):
+        if not verify_password(old_password, user.password_hash)[0]:
             raise AuthenticationFailed("Old password is incorrect.")
 
         # Update the password
-        user.password_hash = make_password(new_password)  # Hash the new password
-        user.save()  # Save the updated user record
+        user.password_hash = hash_password(new_password)  # Hash the new password
+        user.save()  # Save the updated user record, which also drops the cached user
+
+        # Sessions started with the old password end here
+        revoke_user_tokens(user.user_id)
 
         return Response({"message": "Password updated successfully."}, status=status.HTTP_200_OK)
+
+
+class HashingStatsView(APIView):
+    """
+    GET /users/auth/hashing/stats
+    Returns the hash and verify timings of this worker per hasher algorithm.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(hashing.metrics.snapshot(), status=status.HTTP_200_OK)